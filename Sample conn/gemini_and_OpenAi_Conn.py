@@ -12,8 +12,13 @@ load_dotenv()
 gemini_api_key = os.getenv("GEMINI_API_KEY")
 if not gemini_api_key:
     raise ValueError("GEMINI_API_KEY not found in environment variables!")
+# Optional local stand-in for load tests (python -m code.standin_server)
+gemini_base_url = os.getenv("GEMINI_BASE_URL")
 try:
-    genai.configure(api_key=gemini_api_key)
+    if gemini_base_url:
+        genai.configure(api_key=gemini_api_key, transport="rest", client_options={"api_endpoint": gemini_base_url})
+    else:
+        genai.configure(api_key=gemini_api_key)
     # Initialize the Gemini model
     # Using gemini-1.5-flash as it's often faster and cheaper for simple tasks
     # You can change back to 'models/gemini-1.5-pro-latest' or your previous model if needed
@@ -32,7 +37,8 @@ if not openai_api_key:
 else:
     try:
         openai.api_key = openai_api_key
-        client = OpenAI(api_key=openai_api_key)
+        # OPENAI_BASE_URL (e.g. http://127.0.0.1:8790/v1) points the client at the local stand-in
+        client = OpenAI(api_key=openai_api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
         openai_enabled = True
         print("OpenAI API configured successfully.")
     except Exception as e:
@@ -0,0 +1,169 @@
+# bench_analysis_parser.py
+# Legacy multi-pass analysis parser vs the single-pass tolerant decoder.
+#
+# Runs both parsers over a corpus of raw Gemini analysis responses and
+# reports, per response kind, how often each parser returns an analysis,
+# how many KPI entries it recovers and how long it takes.
+#
+# The corpus is a directory of real responses (*.txt / *.json, one response per
+# file). Set ANALYSIS_RESPONSE_DIR while running code.main and every raw analysis
+# response is saved there; --corpus defaults to that directory. Responses are
+# grouped by kind (clean, fenced, comments, trailing_commas, truncated, malformed),
+# and every complete one is also cut at 25/50/75/95% ("cut") since real
+# truncations are rare. --synthetic builds a corpus from KPI_LIST instead; it is
+# also used, with a warning, when no real responses are found.
+#
+# Usage (from the repository root):
+#   ANALYSIS_RESPONSE_DIR=responses/ python -m code.main Calls_Generated/ --skip-ideal-call
+#   python -m benchmarks.bench_analysis_parser [--corpus responses/] [--repeat 200] [--output bench_analysis_parser.json]
+#   python -m benchmarks.bench_analysis_parser --synthetic
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import time
+from typing import Dict, List
+
+
+def legacy_parse(response_text: str) -> dict | None:
+    """The parser as it was before the tolerant decoder (same passes, without the prints)."""
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL | re.IGNORECASE)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return None
+    json_start = response_text.find('{')
+    json_end = response_text.rfind('}')
+    if json_start != -1 and json_end != -1 and json_end > json_start:
+        try:
+            return json.loads(re.sub(r",\s*(\}|\])", r"\1", response_text[json_start:json_end+1]))
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+def build_synthetic_corpus(kpis: List[str], seed: int = 7) -> Dict[str, List[str]]:
+    """Realistic response variants keyed by kind."""
+    rng = random.Random(seed)
+    statuses = ["Met", "Not Met", "N/A"]
+    analysis = {
+        "kpi_analysis": [{"kpi": k, "status": rng.choice(statuses),
+                          "reason": "The agent " + " ".join(rng.choice(["asked", "confirmed", "did not mention",
+                                                                         "verified", "skipped"]) for _ in range(8)) + "."}
+                         for k in kpis],
+        "overall_assessment": {"summary": "Polite call with several verification gaps.",
+                               "strengths": ["Clear introduction"],
+                               "mistakes_and_improvement_areas": ["Did not capture the lead source."],
+                               "soft_skills_evaluation": {"confidence": "Average"}},
+    }
+    clean = json.dumps(analysis, indent=2, ensure_ascii=False)
+    commented = clean.replace('"kpi_analysis": [', '"kpi_analysis": [ // one entry per KPI', 1)
+    commented = commented.replace('\n  ],\n  "overall_assessment"', '\n    // ... all KPIs above\n  ],\n  "overall_assessment"', 1)
+    trailing = re.sub(r'("reason": "[^"]*")\n', r'\1,\n', clean)
+    corpus = {
+        "clean": [clean],
+        "fenced": ["Here is the analysis:\n```json\n" + clean + "\n```\nLet me know if you need more."],
+        "comments": ["```json\n" + commented + "\n```"],
+        "trailing_commas": [trailing],
+        # Cut off at 25/50/75/95% of the output, as at the max_output_tokens limit
+        "truncated": ["```json\n" + clean[:int(len(clean) * f)] for f in (0.25, 0.5, 0.75, 0.95)],
+    }
+    return corpus
+
+
+def classify(text: str) -> str:
+    """Kind of a raw response, from what the tolerant decoder had to repair."""
+    from code.analysis_parser import decode_tolerant
+    _, report = decode_tolerant(text)
+    if not report["complete"]:
+        return "truncated" if report["truncated"] else "malformed"
+    if report["comments"]:
+        return "comments"
+    if report["trailing_commas"]:
+        return "trailing_commas"
+    return "clean" if text.strip().startswith("{") else "fenced"
+
+
+def load_corpus(directory: str) -> Dict[str, List[str]]:
+    """Real responses from `directory` grouped by kind, plus cut-off copies of the complete ones."""
+    corpus: Dict[str, List[str]] = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.txt")) + glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        kind = classify(text)
+        corpus.setdefault(kind, []).append(text)
+        if kind not in ("truncated", "malformed"):
+            corpus.setdefault("cut", []).extend(text[:int(len(text) * f)] for f in (0.25, 0.5, 0.75, 0.95))
+    return corpus
+
+
+def _kpi_count(analysis) -> int:
+    """KPI entries in a parsed analysis, in the full ("kpi_analysis") or the compact ("kpis") protocol."""
+    if not isinstance(analysis, dict):
+        return 0
+    entries = analysis.get("kpi_analysis")
+    if not isinstance(entries, list):
+        entries = analysis.get("kpis") # The legacy parser returns compact responses unexpanded
+    return len(entries) if isinstance(entries, list) else 0
+
+
+def run_parser(parse, texts: List[str], repeat: int) -> Dict[str, float]:
+    parsed = kpis = 0
+    for text in texts:
+        analysis = parse(text)
+        parsed += analysis is not None
+        kpis += _kpi_count(analysis)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse(text)
+    seconds = time.perf_counter() - start
+    return {"parsed": parsed, "responses": len(texts), "kpi_entries": kpis,
+            "mean_ms": seconds / (repeat * len(texts)) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis response parsers.")
+    parser.add_argument("--corpus", help="Directory of raw response files (default: ANALYSIS_RESPONSE_DIR).")
+    parser.add_argument("--synthetic", action="store_true", help="Use the synthetic corpus built from KPI_LIST.")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", default="bench_analysis_parser.json")
+    args = parser.parse_args()
+
+    import code.config as config
+    from code.analysis_parser import parse_gemini_response_with_report
+    from code.kpis import KPI_LIST
+
+    directory = args.corpus or config.ANALYSIS_RESPONSE_DIR
+    corpus = load_corpus(directory) if directory and not args.synthetic else {}
+    if not corpus:
+        if not args.synthetic:
+            print(f"No real responses found{f' in {directory}' if directory else ''} (set ANALYSIS_RESPONSE_DIR while "
+                  "running code.main to collect them); using the synthetic corpus.")
+        corpus = build_synthetic_corpus(KPI_LIST)
+    new_parse = lambda text: parse_gemini_response_with_report(text, KPI_LIST)[0]
+
+    results = {}
+    print(f"{'kind':<16} {'parser':<9} {'parsed':>8} {'KPIs':>6} {'mean ms':>9}")
+    for kind, texts in corpus.items():
+        if not texts:
+            continue
+        results[kind] = {"legacy": run_parser(legacy_parse, texts, args.repeat),
+                         "tolerant": run_parser(new_parse, texts, args.repeat)}
+        for name, r in results[kind].items():
+            print(f"{kind:<16} {name:<9} {r['parsed']:>4}/{r['responses']:<3} {r['kpi_entries']:>6} {r['mean_ms']:>9.3f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_clone_prompt.py
+# Per-chunk cost of voice-cloned generation: reference passed as a path vs encoded once.
+#
+# Builds a 30-turn [S1]/[S2] script from the sample ideal call, splits it into
+# S1/S2 chunks and generates every chunk both ways with the same model. Both modes
+# are warmed up on one chunk first, and the order of the modes alternates between
+# rounds, so neither profits from running second.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_clone_prompt [--turns 30] [--rounds 2] [--output bench_clone_prompt.json]
+import argparse
+import json
+import os
+import time
+
+CLONE_AUDIO = os.path.join("voice_samples", "sample_output_for_cloning.mp3")
+CLONE_TRANSCRIPT = os.path.join("voice_samples", "sample_transcript_for_cloning.txt")
+SOURCE_SCRIPT = os.path.join("Calls_Generated", "Audio_Call_Gen", "sample_transcript_ideal_call_rag.txt")
+
+
+def build_tagged_script(turn_count: int) -> str:
+    """Converts the sample AGENT/PATIENT script to [S1]/[S2] tags, repeating it to reach `turn_count` turns."""
+    from code.openSourceTTS import load_dialogue_turns, SPEAKER_TAGS
+    turns = load_dialogue_turns(SOURCE_SCRIPT)
+    if not turns:
+        raise ValueError(f"{SOURCE_SCRIPT} has no AGENT/PATIENT turns to build the script from.")
+    lines = []
+    while len(lines) < turn_count:
+        for turn in turns[:turn_count - len(lines)]:
+            lines.append(f"{SPEAKER_TAGS[turn['speaker']]} {turn['text']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-chunk cost with and without a pre-encoded voice prompt.")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=2, help="Timed runs per mode; the mode order alternates.")
+    parser.add_argument("--output", default="bench_clone_prompt.json")
+    args = parser.parse_args()
+    if args.turns < 1 or args.rounds < 1:
+        parser.error("--turns and --rounds must be at least 1")
+
+    from code.dia_clone import parse_transcript_into_s1_s2_pairs, load_voice_prompt, generate_conversation
+    from code.openSourceTTS import load_dia_model
+
+    chunks = parse_transcript_into_s1_s2_pairs(build_tagged_script(args.turns))
+    with open(CLONE_TRANSCRIPT, "r", encoding="utf-8") as f:
+        prompt_transcript = f.read()
+    print(f"{args.turns} turns -> {len(chunks)} S1/S2 chunk(s).")
+
+    model = load_dia_model()
+    voice_prompt = load_voice_prompt(model, CLONE_AUDIO, prompt_transcript)
+
+    modes = [("path_per_chunk", False), ("encoded_once", True)]
+    print("\n--- warm-up ---")
+    for _, reuse in modes:
+        generate_conversation(model, voice_prompt, chunks[:1], reuse_encoded_prompt=reuse)
+
+    runs = {label: [] for label, _ in modes}
+    for round_number in range(args.rounds):
+        for label, reuse in (modes if round_number % 2 == 0 else modes[::-1]):
+            print(f"\n--- {label} (round {round_number + 1}/{args.rounds}) ---")
+            start = time.perf_counter()
+            generation = generate_conversation(model, voice_prompt, chunks, reuse_encoded_prompt=reuse)
+            total = time.perf_counter() - start
+            if reuse:
+                total += voice_prompt["encode_seconds"] # Count the one-off encode against this mode
+            runs[label].append({"total_seconds": total, "chunk_seconds": generation["chunk_seconds"]})
+
+    results = {"turns": args.turns, "chunks": len(chunks), "rounds": args.rounds,
+               "encode_seconds": voice_prompt["encode_seconds"]}
+    for label, label_runs in runs.items():
+        results[label] = {
+            "total_seconds": sum(run["total_seconds"] for run in label_runs) / len(label_runs),
+            "mean_chunk_seconds": sum(sum(run["chunk_seconds"]) for run in label_runs) / (len(label_runs) * len(chunks)),
+            "runs": label_runs,
+        }
+
+    before, after = results["path_per_chunk"], results["encoded_once"]
+    print(f"\n{'mode':<18}{'total (s)':>12}{'per chunk (s)':>16}")
+    for label in ("path_per_chunk", "encoded_once"):
+        print(f"{label:<18}{results[label]['total_seconds']:>12.1f}{results[label]['mean_chunk_seconds']:>16.2f}")
+    print(f"Saved {before['total_seconds'] - after['total_seconds']:.1f}s over {len(chunks)} chunk(s) "
+          f"(one-off encode: {voice_prompt['encode_seconds']:.2f}s).")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# bench_dia_cpu.py
+# Real-time factor and peak memory of Dia CPU inference configurations.
+#
+# Each configuration runs in its own subprocess so that peak RSS and model
+# load time are measured from a clean start.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_dia_cpu [--max-turns 6] [--threads 8] [--output bench_dia_cpu.json]
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# Sample ideal-call scripts shipped with the repo
+SAMPLE_SCRIPTS = sorted(glob.glob(os.path.join("Calls_Generated", "**", "*ideal_call_rag*.txt"), recursive=True))
+
+CONFIGURATIONS = [
+    {"name": "fp32", "compute_dtype": "float32", "quantize": False, "use_torch_compile": False},
+    {"name": "bf16", "compute_dtype": "bfloat16", "quantize": False, "use_torch_compile": False},
+    {"name": "int8-dynamic", "compute_dtype": "float32", "quantize": True, "use_torch_compile": False},
+    {"name": "fp32+compile", "compute_dtype": "float32", "quantize": False, "use_torch_compile": True},
+]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_single(configuration: dict, scripts: list, max_turns: int, threads: int) -> dict:
+    """Loads Dia with one configuration and renders each script (runs inside the subprocess)."""
+    from code.openSourceTTS import load_dia_model, load_dialogue_turns, build_dia_input, SAMPLE_RATE
+
+    start = time.perf_counter()
+    model = load_dia_model(device="cpu", compute_dtype=configuration["compute_dtype"],
+                           quantize=configuration["quantize"], num_threads=threads)
+    load_seconds = time.perf_counter() - start
+
+    runs = []
+    for script in scripts:
+        turns = load_dialogue_turns(script)[:max_turns]
+        if not turns:
+            continue
+        text = build_dia_input(turns)
+        start = time.perf_counter()
+        audio = model.generate(text, use_torch_compile=configuration["use_torch_compile"])
+        seconds = time.perf_counter() - start
+        audio_seconds = len(audio) / SAMPLE_RATE if audio is not None else 0.0
+        runs.append({
+            "script": script,
+            "turns": len(turns),
+            "characters": len(text),
+            "synthesis_seconds": seconds,
+            "audio_seconds": audio_seconds,
+            "rtf": seconds / audio_seconds if audio_seconds else None,
+        })
+
+    total_synthesis = sum(r["synthesis_seconds"] for r in runs)
+    total_audio = sum(r["audio_seconds"] for r in runs)
+    return {
+        "configuration": configuration,
+        "threads": threads,
+        "load_seconds": load_seconds,
+        "rtf": total_synthesis / total_audio if total_audio else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Dia CPU inference configurations.")
+    parser.add_argument("--max-turns", type=int, default=6, help="Dialogue turns per script (CPU runs are slow).")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Intra-op threads.")
+    parser.add_argument("--configs", nargs="*", help="Subset of configuration names to run.")
+    parser.add_argument("--output", default="bench_dia_cpu.json", help="Where to write the JSON results.")
+    parser.add_argument("--single", help=argparse.SUPPRESS) # Internal: JSON configuration for one subprocess run
+    args = parser.parse_args()
+
+    if args.single:
+        result = run_single(json.loads(args.single), SAMPLE_SCRIPTS, args.max_turns, args.threads)
+        print("RESULT " + json.dumps(result))
+        return
+
+    if not SAMPLE_SCRIPTS:
+        print("Error: no sample scripts found under Calls_Generated/. Run from the repository root.")
+        sys.exit(1)
+
+    configurations = [c for c in CONFIGURATIONS if not args.configs or c["name"] in args.configs]
+    print(f"Benchmarking {len(configurations)} configuration(s) on {len(SAMPLE_SCRIPTS)} script(s), "
+          f"{args.max_turns} turn(s) each, {args.threads} thread(s).")
+
+    results = []
+    for configuration in configurations:
+        print(f"\n--- {configuration['name']} ---")
+        cmd = [sys.executable, "-m", "benchmarks.bench_dia_cpu", "--single", json.dumps(configuration),
+               "--max-turns", str(args.max_turns), "--threads", str(args.threads)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")]
+        if proc.returncode != 0 or not lines:
+            print(f"Configuration failed (exit code {proc.returncode}):\n{proc.stderr[-2000:]}")
+            results.append({"configuration": configuration, "error": proc.stderr[-2000:]})
+            continue
+        results.append(json.loads(lines[-1][len("RESULT "):]))
+
+    print(f"\n{'configuration':<16}{'load (s)':>10}{'RTF':>8}{'peak RSS (MB)':>16}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['configuration']['name']:<16}{'failed':>10}")
+            continue
+        rtf = f"{r['rtf']:.2f}" if r["rtf"] is not None else "n/a"
+        print(f"{r['configuration']['name']:<16}{r['load_seconds']:>10.1f}{rtf:>8}{r['peak_rss_mb']:>16.0f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# bench_kpi_protocol.py
+# Output tokens and latency of the verbose KPI protocol vs the compact KPI-ID protocol.
+#
+# Offline (default): builds equivalent verbose and compact responses for every
+# KPI in KPI_LIST and compares their size. Tokens are estimated at ~4
+# characters per token; with --count-tokens the Gemini tokenizer is used.
+#
+# Live (--live): sends both analysis prompts for a transcript to Gemini
+# --runs times each and records real output tokens (usage metadata),
+# latency and KPI coverage of the parsed result.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_kpi_protocol [--count-tokens]
+#   python -m benchmarks.bench_kpi_protocol --live --transcript sample_transcript1.txt [--runs 3]
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Any, Dict, List
+
+CHARS_PER_TOKEN = 4.0
+
+
+def synthetic_responses(kpis: List[str], seed: int = 11) -> Dict[str, str]:
+    """The same analysis written in both protocols."""
+    from code.kpis import KPI_STATUS_CODES
+    rng = random.Random(seed)
+    codes = list(KPI_STATUS_CODES)
+    rows = [(i, rng.choice(codes), "Agent confirmed it when booking the appointment.") for i in range(1, len(kpis) + 1)]
+    overall = {"summary": "Polite, efficient call with a missed disclosure.",
+               "strengths": ["Clear introduction"],
+               "mistakes_and_improvement_areas": ["Did not disclose out-of-network status."],
+               "soft_skills_evaluation": {"confidence": "Confident"}}
+    verbose = {"kpi_analysis": [{"kpi": kpis[i - 1], "status": KPI_STATUS_CODES[c], "reason": r} for i, c, r in rows],
+               "overall_assessment": overall}
+    compact = {"kpis": [[i, c, r] for i, c, r in rows], "overall_assessment": overall}
+    # Indented like the model's typical output
+    return {"verbose": json.dumps(verbose, indent=2, ensure_ascii=False),
+            "compact": json.dumps(compact, indent=2, ensure_ascii=False)}
+
+
+def _count_tokens(text: str, use_gemini: bool) -> int:
+    if not use_gemini:
+        return int(len(text) / CHARS_PER_TOKEN)
+    import google.generativeai as genai
+    import code.config as config
+    genai.configure(api_key=config.GEMINI_API_KEY)
+    return genai.GenerativeModel(config.GEMINI_MODEL_NAME).count_tokens(text).total_tokens
+
+
+def run_offline(count_tokens: bool) -> Dict[str, Any]:
+    from code.kpis import KPI_LIST
+    from code.analysis_parser import parse_gemini_response_with_report
+    results = {}
+    for name, text in synthetic_responses(KPI_LIST).items():
+        analysis, _ = parse_gemini_response_with_report(text, KPI_LIST)
+        results[name] = {"characters": len(text), "output_tokens": _count_tokens(text, count_tokens),
+                         "kpi_entries": len(analysis["kpi_analysis"])}
+    return results
+
+
+def run_live(transcript_path: str, runs: int) -> Dict[str, Any]:
+    import google.generativeai as genai
+    from google.generativeai.types import GenerationConfig
+    import code.config as config
+    from code.kpis import KPI_LIST
+    from code.prompt_builder import build_analysis_prompt
+    from code.analysis_parser import parse_gemini_response_with_report
+    from code.transcript_processor import load_transcript
+
+    genai.configure(api_key=config.GEMINI_API_KEY)
+    model = genai.GenerativeModel(config.GEMINI_MODEL_NAME)
+    generation_config = GenerationConfig(temperature=config.GEMINI_TEMPERATURE,
+                                         max_output_tokens=config.GEMINI_MAX_OUTPUT_TOKENS)
+    transcript = load_transcript(transcript_path)
+    results = {}
+    for name, compact in (("verbose", False), ("compact", True)):
+        prompt = build_analysis_prompt(transcript, KPI_LIST, compact=compact)
+        latencies, tokens, coverage = [], [], []
+        for run in range(runs):
+            start = time.perf_counter()
+            response = model.generate_content(prompt, generation_config=generation_config)
+            latencies.append(time.perf_counter() - start)
+            tokens.append(response.usage_metadata.candidates_token_count)
+            analysis, _ = parse_gemini_response_with_report(response.text, KPI_LIST)
+            coverage.append(len(analysis["kpi_analysis"]) if analysis else 0)
+            print(f"{name} run {run+1}/{runs}: {tokens[-1]} output tokens, {latencies[-1]:.1f}s, "
+                  f"{coverage[-1]}/{len(KPI_LIST)} KPIs")
+        results[name] = {"runs": runs, "output_tokens_mean": statistics.mean(tokens),
+                         "latency_mean": statistics.mean(latencies), "latency_min": min(latencies),
+                         "kpi_entries_mean": statistics.mean(coverage)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the verbose and compact KPI output protocols.")
+    parser.add_argument("--live", action="store_true", help="Call Gemini instead of using synthetic responses.")
+    parser.add_argument("--transcript", default="sample_transcript1.txt")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--count-tokens", action="store_true", help="Offline mode: count with the Gemini tokenizer.")
+    parser.add_argument("--output", default="bench_kpi_protocol.json")
+    args = parser.parse_args()
+
+    results = run_live(args.transcript, args.runs) if args.live else run_offline(args.count_tokens)
+    token_key = "output_tokens_mean" if args.live else "output_tokens"
+    verbose, compact = results["verbose"], results["compact"]
+    print(f"\n{'protocol':<9} {'output tokens':>14} {'KPI entries':>12}" + (f" {'latency s':>10}" if args.live else ""))
+    for name, r in results.items():
+        kpis = r.get("kpi_entries", r.get("kpi_entries_mean"))
+        print(f"{name:<9} {r[token_key]:>14.0f} {kpis:>12.0f}" + (f" {r['latency_mean']:>10.1f}" if args.live else ""))
+    results["output_token_reduction"] = 1 - compact[token_key] / verbose[token_key]
+    print(f"\nCompact protocol: {results['output_token_reduction']:.0%} fewer output tokens.")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_report_engine.py
+# Load and report times of the KPI report engine over a synthetic results store.
+#
+# Builds a store with --calls synthetic analyses (48 KPI rows each, so the default
+# 21000 calls is ~1M KPI rows) spread over --agents agents and 12 weeks, then times:
+#   - the first full load into numpy arrays
+#   - the full report (categories, agents, weeks, weakest KPIs, mistakes)
+#   - an incremental refresh after adding 1% more calls, some of them re-analyses
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_report_engine [--calls 21000] [--agents 40] [--db bench_results.sqlite] [--keep]
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+
+
+def synthetic_records(kpis, count, agents, seed, start=0):
+    """(call_id, analysis, metadata) tuples in the shape ResultsStore.add_analyses takes."""
+    rng = random.Random(seed)
+    mistakes = ["Did not verify the date of birth.", "Did not ask for the lead source.",
+                "Forgot the out-of-network disclosure.", "Did not confirm the appointment time.",
+                "Interrupted the patient.", "Did not ask about previous treatment."]
+    first_day = datetime.date(2026, 1, 5)
+    for i in range(start, start + count):
+        skill = rng.random() # Per-call agent performance, so rates differ between groups
+        analysis = {
+            "kpi_analysis": [{"kpi": kpi, "status": "N/A" if rng.random() < 0.1 else
+                              ("Met" if rng.random() < skill else "Not Met"), "reason": "Synthetic."}
+                             for kpi in kpis],
+            "overall_assessment": {"summary": "Synthetic call.", "strengths": [],
+                                   "mistakes_and_improvement_areas": rng.sample(mistakes, rng.randint(0, 3))},
+        }
+        metadata = {"agent": f"agent-{rng.randrange(agents):03d}",
+                    "call_date": (first_day + datetime.timedelta(days=rng.randrange(84))).isoformat()}
+        yield f"call-{i:07d}", analysis, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the KPI report engine.")
+    parser.add_argument("--calls", type=int, default=21000)
+    parser.add_argument("--agents", type=int, default=40)
+    parser.add_argument("--db", default="bench_results.sqlite")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic store afterwards.")
+    parser.add_argument("--output", default="bench_report_engine.json")
+    args = parser.parse_args()
+
+    from code.kpis import KPI_LIST
+    from code.report_engine import KpiReportEngine
+    from code.results_store import ResultsStore
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    store = ResultsStore(args.db)
+    start = time.perf_counter()
+    store.add_analyses(synthetic_records(KPI_LIST, args.calls, args.agents, seed=1))
+    results = {"calls": args.calls, "kpi_rows": args.calls * len(KPI_LIST),
+               "store_seconds": time.perf_counter() - start}
+    print(f"Stored {args.calls} calls ({results['kpi_rows']} KPI rows) in {results['store_seconds']:.1f}s.")
+
+    engine = KpiReportEngine(args.db)
+    start = time.perf_counter()
+    engine.refresh()
+    results["load_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    report = engine.report()
+    results["report_seconds"] = time.perf_counter() - start
+
+    # 1% more calls: half new, half re-analyses of existing ones
+    extra = max(1, args.calls // 100)
+    store.add_analyses(synthetic_records(KPI_LIST, extra // 2 + 1, args.agents, seed=2, start=args.calls))
+    store.add_analyses(synthetic_records(KPI_LIST, extra // 2, args.agents, seed=3, start=0))
+    start = time.perf_counter()
+    loaded = engine.refresh()
+    results["incremental_calls"] = loaded
+    results["incremental_refresh_seconds"] = time.perf_counter() - start
+    start = time.perf_counter()
+    report = engine.report()
+    results["report_after_refresh_seconds"] = time.perf_counter() - start
+    assert report["calls"] == args.calls + extra // 2 + 1, "Re-analyzed calls must replace their old rows"
+
+    print(f"\nFirst load:          {results['load_seconds']:.2f}s")
+    print(f"Report:              {results['report_seconds']:.3f}s")
+    print(f"Incremental refresh: {results['incremental_refresh_seconds']:.3f}s ({loaded} calls)")
+    print(f"Report after it:     {results['report_after_refresh_seconds']:.3f}s")
+
+    engine.close()
+    store.close()
+    if not args.keep:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# bench_suite.py
+# End-to-end benchmark suite with response fixtures and regression tracking.
+#
+# Times the text path of the pipeline at 1x, 10x and 100x input sizes:
+#   - transcript_parsing   load_transcript + parse_dialogue_lines over a sample transcript
+#   - analysis_prompt      build_analysis_prompt (compact protocol)
+#   - parse_response       parse_gemini_response on the analysis response fixture (reasons scaled)
+#   - retrieval            retrieve_relevant_knowledge on the parsed analysis (findings scaled)
+#   - ideal_call_prompt    build_ideal_call_prompt with the retrieved knowledge
+#   - full_pipeline        analyze_transcript + generate_ideal_call_text with Gemini replaced by the
+#                          fixture responses (no network; TTS is benchmarked separately)
+# Transcripts come from Calls_Generated/ and are scaled by repeating their turns.
+#
+# Every run is saved to bench_results/<time>_<commit>.json and compared with the latest run
+# of a different commit (or --baseline); a case whose median time grew by more than
+# --threshold is flagged as a regression (exit code 1 with --fail-on-regression).
+#
+# Fixtures live in benchmarks/fixtures/. The committed analysis_response_stub.txt is templated
+# LocalLLMStub output: short, uniform reasons, so parse timings on it understate a real response.
+# Capture a real Gemini response with --record (needs GEMINI_API_KEY) into analysis_response.txt;
+# it is used instead of the stub fixture whenever it exists. --record --stub regenerates the stub one.
+# Each run records which fixture it used, and comparisons across fixtures are flagged.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_suite [--scales 1,10,100] [--cases parse_response,retrieval] [--fail-on-regression]
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESULTS_DIR = "bench_results"
+SAMPLE_TRANSCRIPT = os.path.join("Calls_Generated", "Audio-to-Audio", "sample_transcript1.txt")
+IDEAL_CALL_FIXTURE = os.path.join("Calls_Generated", "Audio_Call_Gen", "sample_transcript_ideal_call_rag.txt")
+NOISE_FLOOR_MS = 0.05 # Differences below this are never flagged
+RECORDED_FIXTURE = "analysis_response.txt" # Captured from Gemini with --record
+STUB_FIXTURE = "analysis_response_stub.txt" # Templated LocalLLMStub output
+
+
+def _fixture_path(name: str) -> str:
+    return os.path.join(FIXTURES_DIR, name)
+
+
+def analysis_fixture() -> str:
+    """The captured Gemini response if one was recorded, else the stub fixture."""
+    if os.path.exists(_fixture_path(RECORDED_FIXTURE)):
+        return _fixture_path(RECORDED_FIXTURE)
+    return _fixture_path(STUB_FIXTURE)
+
+
+def _read(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def scale_transcript(transcript: str, factor: int) -> str:
+    """The transcript's turns repeated `factor` times (a call `factor` times as long)."""
+    return "\n".join([transcript.strip()] * factor)
+
+
+def scale_analysis_response(response_text: str, factor: int) -> str:
+    """An analysis response with every reason and finding repeated `factor` times."""
+    from code.analysis_parser import decode_tolerant
+    analysis, _ = decode_tolerant(response_text)
+    for row in analysis.get("kpis", []):
+        row[2] = " ".join([row[2]] * factor)
+    for entry in analysis.get("kpi_analysis", []):
+        entry["reason"] = " ".join([entry["reason"]] * factor)
+    assessment = analysis.get("overall_assessment") or {}
+    assessment["mistakes_and_improvement_areas"] = assessment.get("mistakes_and_improvement_areas", []) * factor
+    return "```json\n" + json.dumps(analysis, indent=2, ensure_ascii=False) + "\n```"
+
+
+class FixtureReplay:
+    """Answers the pipeline's Gemini prompts with fixture responses (same signatures as gemini_client)."""
+
+    def __init__(self, analysis_response: str, ideal_call_response: str):
+        self.analysis_response = analysis_response
+        self.ideal_call_response = ideal_call_response
+
+    def generate_with_finish_reason(self, prompt: str) -> tuple:
+        if "Rewrite Agent Dialogue" in prompt:
+            return self.ideal_call_response, "STOP"
+        return self.analysis_response, "STOP"
+
+    def generate(self, prompt: str) -> str:
+        return self.generate_with_finish_reason(prompt)[0]
+
+
+def record_fixtures(generate: Callable[[str], tuple], fixture: str, transcript_path: str = SAMPLE_TRANSCRIPT) -> None:
+    """Saves the raw analysis response for the sample transcript as benchmarks/fixtures/<fixture>."""
+    import code.config as config
+    from code.kpis import KPI_LIST
+    from code.prompt_builder import build_analysis_prompt
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    prompt = build_analysis_prompt(_read(transcript_path), KPI_LIST, compact=config.ANALYSIS_COMPACT_PROTOCOL)
+    text, finish_reason = generate(prompt)
+    if not text or finish_reason not in ("STOP", None):
+        raise RuntimeError(f"Recording failed (finish reason {finish_reason}).")
+    with open(_fixture_path(fixture), "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"Recorded {len(text)} characters to {_fixture_path(fixture)}")
+
+
+def build_cases(scale: int) -> Dict[str, Callable[[], Any]]:
+    """Benchmark callables for one input scale (setup cost is paid here, not in the timings)."""
+    import code.config as config
+    from code.analysis_parser import parse_gemini_response
+    from code.kpis import KPI_LIST
+    from code.main import analyze_transcript, generate_ideal_call_text
+    from code.prompt_builder import build_analysis_prompt, build_ideal_call_prompt
+    from code.retriever import retrieve_relevant_knowledge
+    from code.transcript_processor import load_transcript, parse_dialogue_lines
+
+    transcript = scale_transcript(_read(SAMPLE_TRANSCRIPT), scale)
+    transcript_file = os.path.join(tempfile.gettempdir(), f"bench_suite_transcript_{scale}x.txt")
+    with open(transcript_file, "w", encoding="utf-8") as f:
+        f.write(transcript)
+    labels = [config.AGENT_SPEAKER_LABEL, config.PATIENT_SPEAKER_LABEL]
+    response_text = _read(analysis_fixture())
+    response = scale_analysis_response(response_text, scale)
+    analysis = parse_gemini_response(response, KPI_LIST)
+    knowledge = retrieve_relevant_knowledge(analysis)
+    replay = FixtureReplay(response_text, _read(IDEAL_CALL_FIXTURE))
+
+    def full_pipeline():
+        result = analyze_transcript(transcript, replay.generate_with_finish_reason)
+        return generate_ideal_call_text(transcript, result, replay.generate)
+
+    return {
+        "transcript_parsing": lambda: parse_dialogue_lines(load_transcript(transcript_file).splitlines(), labels),
+        "analysis_prompt": lambda: build_analysis_prompt(transcript, KPI_LIST, compact=config.ANALYSIS_COMPACT_PROTOCOL),
+        "parse_response": lambda: parse_gemini_response(response, KPI_LIST),
+        "retrieval": lambda: retrieve_relevant_knowledge(analysis),
+        "ideal_call_prompt": lambda: build_ideal_call_prompt(transcript, analysis, knowledge),
+        "full_pipeline": full_pipeline,
+    }
+
+
+def time_case(fn: Callable[[], Any], min_seconds: float, max_repeats: int) -> Dict[str, float]:
+    """Runs `fn` (after one warm-up call) until `min_seconds` have passed or `max_repeats` runs; times in ms."""
+    fn()
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while len(times) < max_repeats and (len(times) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"repeats": len(times), "median_ms": round(statistics.median(times), 4), "min_ms": round(times[0], 4),
+            "p95_ms": round(times[min(len(times) - 1, int(0.95 * len(times)))], 4),
+            "mean_ms": round(statistics.fmean(times), 4)}
+
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                    text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def find_baseline(results_dir: str, commit: str | None) -> str | None:
+    """The newest saved run of a different commit (or the newest run at all if there is none)."""
+    runs = sorted(glob.glob(os.path.join(results_dir, "*.json")), reverse=True)
+    for path in runs:
+        with open(path, "r", encoding="utf-8") as f:
+            if json.load(f).get("git", {}).get("commit") != commit:
+                return path
+    return runs[0] if runs else None
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """Cases whose median grew by more than `threshold` (relative) and NOISE_FLOOR_MS (absolute)."""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        ratio = current["median_ms"] / previous["median_ms"] if previous["median_ms"] else float("inf")
+        if ratio > 1 + threshold and current["median_ms"] - previous["median_ms"] > NOISE_FLOOR_MS:
+            regressions.append({"case": key, "baseline_ms": previous["median_ms"], "median_ms": current["median_ms"],
+                                "ratio": round(ratio, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark suite with regression tracking.")
+    parser.add_argument("--scales", default="1,10,100", help="Input size multipliers (comma-separated).")
+    parser.add_argument("--cases", help="Only these cases (comma-separated); default: all.")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="Minimum timing per case and scale.")
+    parser.add_argument("--max-repeats", type=int, default=1000)
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="Results file to compare with (default: latest run of another commit).")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown flagged as a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--record", action="store_true", help="Re-record the analysis response fixture and exit.")
+    parser.add_argument("--stub", action="store_true", help="With --record: record from the local LLM stub.")
+    args = parser.parse_args()
+
+    if args.record:
+        if args.stub:
+            from code.llm_stub import LocalLLMStub
+            record_fixtures(LocalLLMStub().generate_with_finish_reason, STUB_FIXTURE)
+        else:
+            from code.gemini_client import generate_with_finish_reason
+            record_fixtures(generate_with_finish_reason, RECORDED_FIXTURE)
+        return
+
+    scales = [int(s) for s in args.scales.split(",")]
+    selected = args.cases.split(",") if args.cases else None
+    fixture = os.path.basename(analysis_fixture())
+    if fixture == STUB_FIXTURE:
+        print(f"Using the stub analysis fixture ({STUB_FIXTURE}); record a real response with --record.")
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'case':<22}{'scale':>6}{'median ms':>12}{'p95 ms':>12}{'runs':>7}")
+    for scale in scales:
+        with contextlib.redirect_stdout(io.StringIO()): # The pipeline functions print progress
+            cases = build_cases(scale)
+        for name, fn in cases.items():
+            if selected and name not in selected:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = time_case(fn, args.min_seconds, args.max_repeats)
+            results[f"{name}@{scale}x"] = stats
+            print(f"{name:<22}{scale:>5}x{stats['median_ms']:>12.3f}{stats['p95_ms']:>12.3f}{stats['repeats']:>7}")
+
+    revision = git_revision()
+    baseline_path = args.baseline or find_baseline(args.results_dir, revision["commit"])
+    regressions = []
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        print(f"\nCompared with {baseline_path} (commit {str(baseline.get('git', {}).get('commit'))[:10]}):")
+        if baseline.get("fixture", fixture) != fixture:
+            print(f"  Warning: the baseline used {baseline['fixture']}, this run {fixture}; timings are not comparable.")
+        for regression in regressions:
+            print(f"  REGRESSION {regression['case']}: {regression['baseline_ms']:.3f} -> "
+                  f"{regression['median_ms']:.3f} ms ({regression['ratio']:.2f}x)")
+        if not regressions:
+            print(f"  No case slower by more than {args.threshold:.0%}.")
+
+    run = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "git": revision,
+           "python": platform.python_version(), "platform": platform.platform(), "scales": scales, "fixture": fixture,
+           "baseline": baseline_path, "threshold": args.threshold, "results": results, "regressions": regressions}
+    os.makedirs(args.results_dir, exist_ok=True)
+    output_path = os.path.join(args.results_dir, f"{datetime.datetime.now():%Y%m%d-%H%M%S}_{(revision['commit'] or 'nogit')[:10]}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {output_path}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# check_import_time.py
+# Import-time budget for the CLIs: `--help` must start fast and without heavy libraries.
+#
+# Runs `python -X importtime -m code.<cli> --help` for each CLI in a fresh interpreter with the
+# API keys removed from the environment (config must not need them at import time), then checks:
+#   - the total import time stays under --budget-ms
+#   - none of the heavy SDKs / ML libraries (torch, whisper, Dia, google.generativeai,
+#     elevenlabs, ...) was imported; they belong in the functions that use them
+# and prints the slowest imports of each CLI. Exit code 1 if any CLI is over budget.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.check_import_time [--budget-ms 300] [--clis main,pipeline] [--top 8] [--output import_times.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+# CLI module -> heavy modules it may import at startup (report_engine works on numpy arrays)
+CLIS = {
+    "main": (),
+    "pipeline": (),
+    "service": (),
+    "standin_server": (),
+    "tracing": (),
+    "profiling": (),
+    "report_engine": ("numpy",),
+}
+HEAVY_MODULES = ("torch", "torchaudio", "whisper", "dia", "soundfile", "google.generativeai", "elevenlabs",
+                 "numpy", "pandas", "openai")
+KEY_VARIABLES = ("GEMINI_API_KEY", "ELEVENLABS_API_KEY", "AGENT_ID", "PATIENT_ID", "OPENAI_API_KEY")
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """The `-X importtime` lines as dicts: module, self_us, cumulative_us, depth (0 = imported directly)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        # "import time:       123 |        456 |     package.module"  (two spaces of indent per nesting level)
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                     "depth": depth})
+    return rows
+
+
+def measure(cli: str) -> Dict[str, Any]:
+    """Import profile of `python -m code.<cli> --help` in a clean interpreter."""
+    env = {key: value for key, value in os.environ.items() if key not in KEY_VARIABLES}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", f"code.{cli}", "--help"],
+                          capture_output=True, text=True, env=env)
+    rows = parse_importtime(proc.stderr)
+    modules = {row["module"] for row in rows}
+    heavy = sorted(m for m in modules if any(m == h or m.startswith(h + ".") for h in HEAVY_MODULES)
+                   and not any(m == a or m.startswith(a + ".") for a in CLIS.get(cli, ())))
+    errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+    return {"cli": cli, "exit_code": proc.returncode,
+            "total_ms": round(sum(r["cumulative_us"] for r in rows if r["depth"] == 0) / 1000, 1),
+            "heavy_modules": sorted({next(h for h in HEAVY_MODULES if m == h or m.startswith(h + "."))
+                                     for m in heavy}),
+            "slowest": sorted((r for r in rows if r["depth"] == 0), key=lambda r: r["cumulative_us"], reverse=True),
+            "stderr": errors[-5:]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CLI startup import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="Maximum total import time per CLI.")
+    parser.add_argument("--clis", help=f"Comma-separated subset of: {', '.join(CLIS)}.")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports shown per CLI.")
+    parser.add_argument("--output", help="Also write the measurements as JSON.")
+    args = parser.parse_args()
+
+    failures, results = [], []
+    for cli in (args.clis.split(",") if args.clis else CLIS):
+        result = measure(cli)
+        results.append(result)
+        problems = []
+        if result["exit_code"] != 0:
+            problems.append(f"--help exited with {result['exit_code']}: {' / '.join(result['stderr'])}")
+        if result["total_ms"] > args.budget_ms:
+            problems.append(f"{result['total_ms']:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        if result["heavy_modules"]:
+            problems.append(f"imports {', '.join(result['heavy_modules'])} at startup")
+        status = "FAIL" if problems else "ok"
+        print(f"\ncode.{cli}: {result['total_ms']:.1f} ms [{status}]")
+        for row in result["slowest"][:args.top]:
+            print(f"  {row['cumulative_us'] / 1000:>8.1f} ms  {row['module']}")
+        for problem in problems:
+            print(f"  ! {problem}")
+        if problems:
+            failures.append(cli)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": [{k: v for k, v in r.items() if k != "slowest"}
+                                                                for r in results]}, f, indent=2)
+    if failures:
+        print(f"\nImport-time check failed for: {', '.join(failures)}")
+        sys.exit(1)
+    print(f"\nAll CLIs start within {args.budget_ms:.0f} ms without heavy imports.")
+
+
+if __name__ == "__main__":
+    main()
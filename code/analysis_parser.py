@@ -1,14 +1,250 @@
 # analysis_parser.py
 import json
-import re # Regular expressions for more robust JSON extraction
+import re # Regular expressions for the tolerant token scanner
+from typing import Any, Dict, List, Tuple
+from code.kpis import KPI_LIST, KPI_STATUS_CODES
 
-def parse_gemini_response(response_text: str) -> dict | None:
+# Strict C decoder, tried first: well-formed responses (the common case) never reach the Python scanner
+_STRICT_DECODER = json.JSONDecoder()
+
+# Whitespace and comments (// line, /* block */), skipped between tokens; comments are how
+# the model reproduces the "// ..." lines of our prompt schema
+_SPACE = r"\s*(?:(?://[^\n]*|/\*.*?\*/)\s*)*"
+_SKIP = re.compile(_SPACE, re.DOTALL)
+# One token per match, together with the whitespace/comments before it (half the matches on indented JSON)
+_TOKEN = re.compile(r"""
+    (?P<ws>""" + _SPACE + r""")
+    (?:
+    (?P<str>"(?:[^"\\]|\\.)*")
+  | (?P<num>-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<lit>true|false|null)
+  | (?P<punct>[{}\[\]:,])
+    )
+""", re.VERBOSE | re.DOTALL)
+_LITERALS = {"true": True, "false": False, "null": None}
+_PARTIAL_NUMBER = re.compile(r"-?\d*(?:\.\d*)?(?:[eE][+-]?\d*)?")
+
+
+def _is_cut_token(rest: str) -> bool:
+    """True if `rest` (the unparsed end of the input) is the start of a token that was cut off."""
+    return (rest.startswith('"') or rest.startswith("/*") or rest == "/"
+            or any(literal.startswith(rest) for literal in _LITERALS)
+            or _PARTIAL_NUMBER.fullmatch(rest) is not None)
+
+
+def decode_tolerant(text: str) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Decodes the outermost JSON object in `text`.
+
+    Surrounding prose and ``` fences are ignored, `//` and `/* */` comments
+    and trailing commas are skipped, and raw newlines inside strings are
+    accepted. If the object is cut off (e.g. at the output-token limit) or
+    hits a syntax error, the longest valid prefix is returned with every open
+    object/array closed; a member whose value was cut off is dropped.
+
+    Well-formed JSON is decoded by the C decoder; only when that fails does
+    the tolerant scanner make its single pass over the object.
+
+    Args:
+        text: Raw model response.
+
+    Returns:
+        (value, report). `value` is None if no object starts in the text.
+        `report` has 'mode' ("strict" or "tolerant"), 'complete' (the
+        outermost object was closed), 'truncated' (input ended inside it),
+        'error_at' (offset of an unexpected token, or None), 'comments' and
+        'trailing_commas' (repairs made), and 'end' (offset after the object).
+    """
+    report = {"mode": "strict", "complete": False, "truncated": False, "error_at": None,
+              "comments": 0, "trailing_commas": 0, "end": None}
+    start = text.find("{")
+    if start == -1:
+        return None, report
+
+    try:
+        value, end = _STRICT_DECODER.raw_decode(text, start)
+        report.update(complete=True, end=end)
+        return value, report
+    except json.JSONDecodeError:
+        report["mode"] = "tolerant"
+
+    root = None
+    stack: List[list] = [] # [container, pending key] per open object/array
+    # What the grammar allows next: "value", "key_or_end", "colon", "comma_or_end", "value_or_end"
+    state = "value"
+    after_comma = False
+    pos, n = start, len(text)
+
+    def _attach(value):
+        nonlocal root
+        if not stack:
+            root = value
+            return
+        frame = stack[-1]
+        if isinstance(frame[0], list):
+            frame[0].append(value)
+        else:
+            frame[0][frame[1]] = value
+            frame[1] = None
+
+    while pos < n:
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            # An unterminated string/comment or a partial literal means the input was cut off here
+            pos = _SKIP.match(text, pos).end()
+            if pos < n and not _is_cut_token(text[pos:]):
+                report["error_at"] = pos
+            break
+        space = match.group("ws")
+        if "/" in space:
+            report["comments"] += space.count("//") + space.count("/*")
+        kind = match.lastgroup
+        pos, token = match.start(kind), match.group(kind)
+        if match.end() == n and kind in ("num", "lit"):
+            break # A number or literal at the very end may itself be truncated ("12" of "123")
+
+        if kind == "punct":
+            if token in "{[":
+                if state not in ("value", "value_or_end"):
+                    report["error_at"] = pos
+                    break
+                container = {} if token == "{" else []
+                _attach(container)
+                stack.append([container, None])
+                state = "key_or_end" if token == "{" else "value_or_end"
+            elif token in "}]":
+                if not stack or (token == "}") != isinstance(stack[-1][0], dict) or \
+                        state not in ("key_or_end", "value_or_end", "comma_or_end"):
+                    report["error_at"] = pos
+                    break
+                if after_comma:
+                    report["trailing_commas"] += 1
+                stack.pop()
+                state = "comma_or_end"
+            elif token == ":":
+                if state != "colon":
+                    report["error_at"] = pos
+                    break
+                state = "value"
+            else: # ","
+                if state != "comma_or_end":
+                    report["error_at"] = pos
+                    break
+                state = "key_or_end" if isinstance(stack[-1][0], dict) else "value_or_end"
+                after_comma = True
+                pos = match.end()
+                continue
+        else:
+            if kind == "str":
+                value = json.loads(token, strict=False) if "\\" in token or "\n" in token else token[1:-1]
+            elif kind == "num":
+                value = json.loads(token)
+            else:
+                value = _LITERALS[token]
+            if state == "key_or_end" and kind == "str":
+                stack[-1][1] = value
+                state = "colon"
+            elif state in ("value", "value_or_end"):
+                _attach(value)
+                state = "comma_or_end"
+            else:
+                report["error_at"] = pos
+                break
+        after_comma = False
+        pos = match.end()
+        if not stack:
+            report.update(complete=True, end=pos)
+            break
+
+    if not report["complete"]:
+        report["truncated"] = report["error_at"] is None
+    return root, report
+
+
+def kpi_key(kpi: str) -> str:
+    """Normalized KPI text used to match entries to the checklist (case and spacing ignored)."""
+    return " ".join(str(kpi).split()).lower()
+
+
+def expand_compact_analysis(analysis: Dict[str, Any], kpis: List[str]) -> Tuple[Dict[str, Any], int]:
+    """
+    Expands a compact KPI-ID response ("kpis": [[id, status code, reason], ...])
+    into the regular "kpi_analysis" shape with full KPI text and status names.
+    Entries given as {"id", "status", "reason"} objects are accepted too.
+
+    Args:
+        analysis: Decoded response containing a "kpis" list.
+        kpis: The KPI list the IDs refer to (1-based).
+
+    Returns:
+        (analysis in the regular shape, number of entries dropped because
+        they were incomplete or had an unknown ID/status).
+    """
+    expanded, dropped = [], 0
+    for entry in analysis.pop("kpis", None) or []:
+        if isinstance(entry, dict):
+            entry = [entry.get("id"), entry.get("status", entry.get("s")), entry.get("reason", entry.get("r"))]
+        if not isinstance(entry, list) or len(entry) < 3 or entry[2] is None:
+            dropped += 1 # Cut off before its reason
+            continue
+        kpi_id, code, reason = entry[:3]
+        status = KPI_STATUS_CODES.get(str(code).strip().upper(), code if code in KPI_STATUS_CODES.values() else None)
+        if not isinstance(kpi_id, int) or not 1 <= kpi_id <= len(kpis) or status is None:
+            dropped += 1
+            continue
+        expanded.append({"kpi": kpis[kpi_id - 1], "status": status, "reason": reason})
+    # Same key order as the verbose protocol, so the saved _analysis.json looks the same
+    return {"kpi_analysis": expanded, **analysis}, dropped
+
+
+def parse_gemini_response_with_report(response_text: str, expected_kpis: List[str] | None = None
+                                      ) -> Tuple[dict | None, Dict[str, Any]]:
+    """
+    Parses an analysis response and reports what had to be repaired or was lost.
+
+    KPI entries cut off before their 'reason' are removed, so every entry in
+    the returned 'kpi_analysis' has a kpi, a status and a reason.
+
+    Args:
+        response_text: The raw string response from the Gemini API.
+        expected_kpis: The KPI list sent in the prompt; when given, KPIs with
+            no complete entry are listed in report['lost_kpis']. Compact
+            (KPI-ID) responses are expanded against it, or against KPI_LIST.
+
+    Returns:
+        (analysis dict or None, report) - see decode_tolerant for the report
+        fields, plus 'incomplete_entries' and 'lost_kpis'.
+    """
+    analysis, report = decode_tolerant(response_text or "")
+    report["incomplete_entries"] = 0
+    report["lost_kpis"] = []
+    if not isinstance(analysis, dict):
+        return None, report
+
+    if "kpis" in analysis and "kpi_analysis" not in analysis:
+        # Compact KPI-ID protocol; IDs are positions in the KPI list the prompt was built from
+        analysis, dropped = expand_compact_analysis(analysis, expected_kpis or KPI_LIST)
+        report["incomplete_entries"] += dropped
+    entries = analysis.get("kpi_analysis")
+    if isinstance(entries, list):
+        complete = [e for e in entries if isinstance(e, dict) and e.get("kpi") and e.get("status") and "reason" in e]
+        report["incomplete_entries"] += len(entries) - len(complete)
+        analysis["kpi_analysis"] = complete
+    if expected_kpis:
+        seen = {kpi_key(e["kpi"]) for e in analysis.get("kpi_analysis", [])}
+        report["lost_kpis"] = [k for k in expected_kpis if kpi_key(k) not in seen]
+    return analysis, report
+
+
+def parse_gemini_response(response_text: str, expected_kpis: List[str] | None = None) -> dict | None:
     """
     Parses the raw text response from Gemini, expecting a JSON object.
-    Attempts to handle potential markdown code blocks or surrounding text.
+    Handles markdown code blocks, surrounding text, comments, trailing
+    commas and responses truncated at the output-token limit.
 
     Args:
         response_text: The raw string response from the Gemini API.
+        expected_kpis: Optional KPI list, used to report KPIs lost to truncation.
 
     Returns:
         A dictionary representing the parsed JSON analysis,
@@ -19,78 +255,25 @@ def parse_gemini_response(response_text: str) -> dict | None:
         return None
 
     print("Attempting to parse Gemini JSON response...")
+    analysis, report = parse_gemini_response_with_report(response_text, expected_kpis)
+    if analysis is None:
+        print("Error: Could not find or parse a valid JSON object in the response.")
+        print("--- Raw Response Text ---")
+        print(response_text)
+        print("--- End Raw Response Text ---")
+        return None
 
-    # 1. Try direct JSON parsing first (ideal case)
-    try:
-        return json.loads(response_text)
-    except json.JSONDecodeError:
-        print("Direct JSON parsing failed. Trying to extract JSON block...")
-        pass # Continue to extraction methods
-
-    # 2. Try extracting JSON within ```json ... ``` markdown blocks
-    match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL | re.IGNORECASE)
-    if match:
-        json_string = match.group(1)
-        print("Found JSON block within ```json ``` markers.")
-        try:
-            return json.loads(json_string)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing extracted JSON block: {e}")
-            print("--- Extracted String ---")
-            print(json_string)
-            print("--- End Extracted String ---")
-            return None # Parsing failed
-
-    # 3. Try extracting the first '{' to the last '}' as a fallback
-    json_start = response_text.find('{')
-    json_end = response_text.rfind('}')
-    if json_start != -1 and json_end != -1 and json_end > json_start:
-        json_string = response_text[json_start:json_end+1]
-        print("Found JSON block using simple '{' and '}' search.")
-        try:
-            # Sometimes Gemini might add trailing commas which are invalid JSON
-            # Basic attempt to remove trailing comma before closing brace/bracket
-            cleaned_json_string = re.sub(r",\s*(\}|\])", r"\1", json_string)
-            return json.loads(cleaned_json_string)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing fallback JSON block: {e}")
-            print("--- Fallback String ---")
-            print(json_string) # Print original string found
-            print("--- End Fallback String ---")
-            return None # Parsing failed
-
-    # 4. If all methods fail
-    print("Error: Could not find or parse a valid JSON object in the response.")
-    print("--- Raw Response Text ---")
-    print(response_text)
-    print("--- End Raw Response Text ---")
-    return None
-
-# --- Example Usage (Optional) ---
-# if __name__ == "__main__":
-#     # Test cases
-#     valid_json_text = '{"key": "value", "list": [1, 2]}'
-#     markdown_json_text = "Some text before ```json\n{\"key\": \"value\", \"nested\": {\"a\": 1}}\n``` Some text after."
-#     simple_markers_text = "Blah blah { \"key\": \"value\" , \"num\": 5 } blah"
-#     invalid_text = "This is not JSON."
-#     text_with_trailing_comma = '{"key": "value", "list": [1, 2,], }' # Invalid JSON
-
-#     print("--- Testing Valid JSON ---")
-#     parsed = parse_gemini_response(valid_json_text)
-#     print(parsed)
-
-#     print("\n--- Testing Markdown JSON ---")
-#     parsed = parse_gemini_response(markdown_json_text)
-#     print(parsed)
-
-#     print("\n--- Testing Simple Markers JSON ---")
-#     parsed = parse_gemini_response(simple_markers_text)
-#     print(parsed)
-
-#     print("\n--- Testing Invalid Text ---")
-#     parsed = parse_gemini_response(invalid_text)
-#     print(parsed)
-
-#     print("\n--- Testing Trailing Comma JSON ---")
-#     parsed = parse_gemini_response(text_with_trailing_comma)
-#     print(parsed)
\ No newline at end of file
+    if report["comments"] or report["trailing_commas"]:
+        print(f"Repaired response JSON: skipped {report['comments']} comment(s) "
+              f"and {report['trailing_commas']} trailing comma(s).")
+    if report["truncated"]:
+        print("Warning: The response was cut off; keeping the longest valid prefix.")
+    elif report["error_at"] is not None:
+        print(f"Warning: Invalid JSON at offset {report['error_at']}; keeping the valid part before it.")
+    if report["incomplete_entries"]:
+        print(f"Warning: Dropped {report['incomplete_entries']} incomplete KPI entr(y/ies).")
+    if report["lost_kpis"]:
+        print(f"Warning: {len(report['lost_kpis'])} KPI(s) missing from the analysis:")
+        for kpi in report["lost_kpis"]:
+            print(f" - {kpi}")
+    return analysis
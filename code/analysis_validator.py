@@ -0,0 +1,147 @@
+# analysis_validator.py
+# Checks a parsed analysis against the KPI list and re-asks Gemini only for the KPIs that are missing or invalid.
+from typing import Any, Dict, List, Tuple
+
+from code.analysis_parser import kpi_key, parse_gemini_response_with_report
+from code.kpis import KPI_STATUS_CODES
+from code.tracing import count
+
+VALID_STATUSES = tuple(KPI_STATUS_CODES.values())
+# Spellings the model uses for a valid status; normalized in place instead of re-asked
+_STATUS_ALIASES = {
+    "met": "Met", "yes": "Met",
+    "not met": "Not Met", "not_met": "Not Met", "notmet": "Not Met", "no": "Not Met",
+    "n/a": "N/A", "na": "N/A", "not applicable": "N/A",
+}
+OVERALL_ASSESSMENT_FIELDS = ("summary", "strengths", "mistakes_and_improvement_areas", "soft_skills_evaluation")
+
+
+def validate_analysis(analysis: Dict[str, Any], kpis: List[str]) -> Dict[str, Any]:
+    """
+    Diffs an analysis against the KPI list. Status spellings like "met" or
+    "Not Applicable" are normalized in place; duplicates and entries for
+    unknown KPIs are removed.
+
+    Args:
+        analysis: Parsed analysis in the regular kpi_analysis shape.
+        kpis: The KPI checklist.
+
+    Returns:
+        A report with 'missing' and 'invalid' (KPI texts that need a new
+        answer), 'unknown' and 'duplicates' (entries removed), 'normalized'
+        (statuses fixed in place), 'overall_missing' (assessment fields not
+        present) and 'complete' (nothing to re-ask).
+    """
+    known = {kpi_key(kpi): kpi for kpi in kpis}
+    report = {"missing": [], "invalid": [], "unknown": [], "duplicates": 0, "normalized": 0, "overall_missing": []}
+    kept, seen = [], set()
+    for entry in analysis.get("kpi_analysis") or []:
+        if not isinstance(entry, dict) or kpi_key(entry.get("kpi", "")) not in known:
+            report["unknown"].append(entry.get("kpi") if isinstance(entry, dict) else entry)
+            continue
+        key = kpi_key(entry["kpi"])
+        if key in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+        # Use the canonical KPI text so downstream lookups match exactly
+        entry["kpi"] = known[key]
+        status = entry.get("status")
+        if status not in VALID_STATUSES:
+            fixed = _STATUS_ALIASES.get(" ".join(str(status).split()).lower())
+            if fixed:
+                entry["status"] = fixed
+                report["normalized"] += 1
+        if entry.get("status") not in VALID_STATUSES or not str(entry.get("reason") or "").strip():
+            report["invalid"].append(known[key])
+        kept.append(entry)
+    analysis["kpi_analysis"] = kept
+    report["missing"] = [kpi for kpi in kpis if kpi_key(kpi) not in seen]
+
+    overall = analysis.get("overall_assessment")
+    overall = overall if isinstance(overall, dict) else {}
+    report["overall_missing"] = [field for field in OVERALL_ASSESSMENT_FIELDS if field not in overall]
+    report["complete"] = not (report["missing"] or report["invalid"])
+    return report
+
+
+def merge_kpi_answers(analysis: Dict[str, Any], answers: List[Dict[str, Any]], kpis: List[str]) -> int:
+    """
+    Puts re-asked answers into the analysis (replacing invalid entries) and
+    restores checklist order. Only valid answers are merged.
+
+    Returns:
+        The number of KPIs filled in.
+    """
+    by_key = {kpi_key(entry["kpi"]): entry for entry in analysis.get("kpi_analysis", [])}
+    filled = 0
+    for answer in answers:
+        key = kpi_key(answer.get("kpi", ""))
+        if answer.get("status") in VALID_STATUSES and str(answer.get("reason") or "").strip():
+            current = by_key.get(key)
+            if current is None or current.get("status") not in VALID_STATUSES or not str(current.get("reason") or "").strip():
+                by_key[key] = answer
+                filled += 1
+    order = {kpi_key(kpi): i for i, kpi in enumerate(kpis)}
+    analysis["kpi_analysis"] = sorted(by_key.values(), key=lambda entry: order.get(kpi_key(entry["kpi"]), len(order)))
+    return filled
+
+
+def ensure_complete_analysis(analysis: Dict[str, Any], transcript: str, kpis: List[str],
+                             max_rounds: int = 1, generate=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Validates an analysis and re-asks for missing or invalid KPIs with a
+    small focused prompt (see prompt_builder.build_kpi_reask_prompt), then
+    merges the answers. A handful of KPIs costs a fraction of a full rerun:
+    the transcript is sent again, but the instructions, schema and output
+    cover only the KPIs in question.
+
+    Args:
+        analysis: Parsed analysis (modified in place).
+        transcript: The call transcript the analysis was made from.
+        kpis: The KPI checklist (KPI numbers in the re-ask refer to it).
+        max_rounds: Re-ask rounds; 0 only validates.
+        generate: Prompt -> response text callable (defaults to gemini_client.generate_analysis).
+
+    Returns:
+        (analysis, report of the final validation plus 'reasked' and 'filled' counts).
+    """
+    from code.prompt_builder import build_kpi_reask_prompt
+    report = first = validate_analysis(analysis, kpis)
+    reasked = filled = 0
+    for round_number in range(1, max_rounds + 1):
+        if report["complete"]:
+            break
+        targets = report["missing"] + report["invalid"]
+        print(f"Analysis incomplete: {len(report['missing'])} missing, {len(report['invalid'])} invalid KPI(s). "
+              f"Re-asking for them (round {round_number}/{max_rounds})...")
+        if generate is None:
+            from code.gemini_client import generate_analysis as generate
+        ids = {i: kpi for i, kpi in enumerate(kpis, start=1) if kpi in targets}
+        count("retries_total", stage="gemini_reask")
+        response_text = generate(build_kpi_reask_prompt(transcript, ids))
+        reasked += len(targets)
+        if not response_text:
+            print("Re-ask request failed; keeping the analysis as it is.")
+            break
+        answers, _ = parse_gemini_response_with_report(response_text, kpis)
+        if not answers:
+            print("Could not parse the re-ask response; keeping the analysis as it is.")
+            break
+        # Answers for KPIs that were not asked about are ignored
+        wanted = {kpi_key(kpi) for kpi in targets}
+        filled += merge_kpi_answers(analysis, [a for a in answers.get("kpi_analysis", []) if kpi_key(a["kpi"]) in wanted], kpis)
+        report = validate_analysis(analysis, kpis)
+
+    # Cleanup done by the first validation is part of the outcome too
+    for field in ("unknown", "duplicates", "normalized"):
+        report[field] = first[field]
+    report["reasked"] = reasked
+    report["filled"] = filled
+    if not report["complete"]:
+        print(f"Warning: analysis still lacks {len(report['missing'])} KPI(s) and has {len(report['invalid'])} invalid entr(y/ies).")
+    elif reasked:
+        print(f"Analysis complete after re-asking for {reasked} KPI(s).")
+    if report["overall_missing"]:
+        print(f"Warning: overall_assessment is missing: {', '.join(report['overall_missing'])}")
+    return analysis, report
@@ -1,11 +1,12 @@
-import os
+import shutil
 import sys
-# Use the specific client class
-from elevenlabs.client import ElevenLabs
-# Corrected import: Use 'ApiError' (lowercase 'i') and remove RateLimitError for now
-from elevenlabs.client import ApiError # <--- CORRECTED IMPORT
-from elevenlabs import play # Optional
 import code.config as config
+from code.transcript_processor import parse_dialogue_lines
+from code.tts_synthesis import synthesize_lines
+from code.tts_cache import open_default_cache, with_cache, print_cache_stats
+from code.audio_writer import open_writer_for_output
+from code.tts_segmenter import segment_dialogue
+from code.tts_engines import ElevenLabsEngine
 
 API_KEY = config.ELEVENLABS_API_KEY
 AGENT_ID = config.AGENT_VOICE_ID
@@ -13,116 +14,128 @@ PATIENT_ID = config.PATIENT_VOICE_ID
 TRANSCRIPT_FILE = "sample_transcript_ideal_call_rag.txt"
 OUTPUT_FILENAME = "sample_output_for_cloning.mp3"
 MODEL_ID = "eleven_multilingual_v2" # Or "eleven_monolingual_v1"
+OUTPUT_FORMAT = config.ELEVENLABS_OUTPUT_FORMAT # Raw PCM, e.g. "pcm_24000"
+SAMPLE_RATE = int(OUTPUT_FORMAT.split("_")[1])
+# Finished lines are kept here until the combined file is written, so a rerun resumes
+PARTS_DIR = OUTPUT_FILENAME + ".parts"
+
+
+def create_client():
+    """Creates the ElevenLabs client (honours ELEVENLABS_BASE_URL for local stand-ins)."""
+    # Use the specific client class; imported here so the module loads without the SDK
+    from elevenlabs.client import ElevenLabs
+    if config.ELEVENLABS_BASE_URL:
+        return ElevenLabs(api_key=API_KEY, base_url=config.ELEVENLABS_BASE_URL)
+    return ElevenLabs(api_key=API_KEY)
+
+
+def main():
+    # --- Validation ---
+    if not API_KEY:
+        print("Error: ELEVENLABS_API_KEY not found in environment variables (.env file).")
+        sys.exit(1)
+    if not AGENT_ID:
+        print("Error: AGENT_ID not found in environment variables (.env file).")
+        sys.exit(1)
+    if not PATIENT_ID:
+        print("Error: PATIENT_ID not found in environment variables (.env file).")
+        sys.exit(1)
+
+    print("Configuration loaded successfully.")
+    print(f" - AGENT Voice ID: {AGENT_ID}")
+    print(f" - PATIENT Voice ID: {PATIENT_ID}")
+    print(f" - Using Model: {MODEL_ID} ({OUTPUT_FORMAT})")
+    print(f" - Transcript: {TRANSCRIPT_FILE}")
+    print(f" - Output File: {OUTPUT_FILENAME}")
+    print(f" - Workers: {config.TTS_MAX_WORKERS}, Retries per line: {config.TTS_MAX_RETRIES}")
+
+    # --- Initialize ElevenLabs Client ---
+    try:
+        client = create_client()
+        print("ElevenLabs client initialized successfully.")
+    except Exception as e:
+        print(f"Error initializing ElevenLabs client: {e}")
+        sys.exit(1)
 
-# --- Validation ---
-if not API_KEY:
-    print("Error: ELEVENLABS_API_KEY not found in environment variables (.env file).")
-    sys.exit(1)
-# ... (add checks for AGENT_ID and PATIENT_ID back if you removed them) ...
-if not AGENT_ID:
-    print("Error: AGENT_ID not found in environment variables (.env file).")
-    sys.exit(1)
-if not PATIENT_ID:
-    print("Error: PATIENT_ID not found in environment variables (.env file).")
-    sys.exit(1)
-
-print("Configuration loaded successfully.")
-print(f" - AGENT Voice ID: {AGENT_ID}")
-print(f" - PATIENT Voice ID: {PATIENT_ID}")
-print(f" - Using Model: {MODEL_ID}")
-print(f" - Transcript: {TRANSCRIPT_FILE}")
-print(f" - Output File: {OUTPUT_FILENAME}")
-
-
-# --- Initialize ElevenLabs Client ---
-try:
-    client = ElevenLabs(api_key=API_KEY)
-    print("ElevenLabs client initialized successfully.")
-except Exception as e:
-    print(f"Error initializing ElevenLabs client: {e}")
-    sys.exit(1)
-
-# --- Read and Parse Transcript ---
-try:
-    with open(TRANSCRIPT_FILE, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    print(f"Successfully read {len(lines)} lines from '{TRANSCRIPT_FILE}'.")
-except FileNotFoundError:
-    print(f"Error: Transcript file '{TRANSCRIPT_FILE}' not found.")
-    sys.exit(1)
-except Exception as e:
-    print(f"Error reading transcript file: {e}")
-    sys.exit(1)
-
-# --- Process Lines and Generate Audio ---
-all_audio_bytes = []
-
-print("\nStarting audio generation...")
-for i, line in enumerate(lines):
-    line = line.strip()
-    if not line:
-        continue
-
-    speaker_text = ""
-    voice_id = None
-    speaker_label = "Unknown"
-
-    if line.startswith("AGENT:"):
-        speaker_text = line.replace("AGENT:", "", 1).strip()
-        voice_id = AGENT_ID
-        speaker_label = "AGENT"
-    elif line.startswith("PATIENT:"):
-        speaker_text = line.replace("PATIENT:", "", 1).strip()
-        voice_id = PATIENT_ID
-        speaker_label = "PATIENT"
-    else:
-        print(f"Warning: Skipping unrecognized line format (line {i+1}): {line}")
-        continue
-
-    if not speaker_text:
-        print(f"Warning: Skipping line with speaker label but no text (line {i+1}): {line}")
-        continue
-
-    print(f" - Processing line {i+1} ({speaker_label}): '{speaker_text[:50]}...'")
+    # --- Read and Parse Transcript ---
+    try:
+        with open(TRANSCRIPT_FILE, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        print(f"Successfully read {len(lines)} lines from '{TRANSCRIPT_FILE}'.")
+    except FileNotFoundError:
+        print(f"Error: Transcript file '{TRANSCRIPT_FILE}' not found.")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error reading transcript file: {e}")
+        sys.exit(1)
+
+    dialogue = parse_dialogue_lines(lines, [config.AGENT_SPEAKER_LABEL, config.PATIENT_SPEAKER_LABEL])
+    if not dialogue:
+        print("\nNo audio was generated (transcript might be empty or all lines skipped).")
+        sys.exit(0)
+
+    # Long turns become several sentence-sized requests; playback can start after the first one
+    if config.TTS_SEGMENT_MAX_SECONDS > 0:
+        turn_count = len(dialogue)
+        dialogue = segment_dialogue(dialogue, config.TTS_SEGMENT_MAX_SECONDS)
+        print(f"Split {turn_count} turn(s) into {len(dialogue)} segment(s) of at most ~{config.TTS_SEGMENT_MAX_SECONDS:.0f}s.")
+
+    # --- Generate Audio Concurrently, Streaming Each Segment to the Output in Order ---
+    print(f"\nStarting audio generation for {len(dialogue)} line(s)...")
+    voice_ids = {config.AGENT_SPEAKER_LABEL: AGENT_ID, config.PATIENT_SPEAKER_LABEL: PATIENT_ID}
+    engine = ElevenLabsEngine(voice_ids, MODEL_ID, OUTPUT_FORMAT, client=client,
+                              max_concurrency=config.TTS_MAX_WORKERS)
+    cache = open_default_cache()
+    synthesize = with_cache(lambda line: engine.synthesize(line["text"], line["speaker"]), cache,
+                            engine.name, f"{MODEL_ID}/{OUTPUT_FORMAT}",
+                            lambda line: voice_ids[line["speaker"]])
+    try:
+        writer = open_writer_for_output(OUTPUT_FILENAME, SAMPLE_RATE, [line["index"] for line in dialogue],
+                                        gap_seconds=0.25,
+                                        pauses_after={line["index"]: line["pause_after_ms"] / 1000
+                                                      for line in dialogue if "pause_after_ms" in line})
+    except Exception as e:
+        print(f"Error opening output file '{OUTPUT_FILENAME}': {e}")
+        sys.exit(1)
 
     try:
-        audio_stream = client.text_to_speech.convert(
-            voice_id=voice_id,
-            text=speaker_text,
-            model_id=MODEL_ID
+        result = synthesize_lines(
+            dialogue,
+            synthesize,
+            max_workers=engine.max_concurrency,
+            max_retries=config.TTS_MAX_RETRIES,
+            base_delay=config.TTS_RETRY_BASE_DELAY,
+            parts_dir=PARTS_DIR,
+            extension="pcm",
+            on_segment=writer.append,
+            identity_for=lambda line: engine.cache_identity(line["speaker"]),
         )
-        line_audio_bytes = b"".join(audio_stream)
-        all_audio_bytes.append(line_audio_bytes)
-
-    # Removed specific RateLimitError block
-    # Use ApiError with correct capitalization
-    except ApiError as e: # <--- CORRECTED CASE in except block
-        print(f"Error: ElevenLabs API error processing line {i+1} ('{line}') with voice {voice_id}: {e}")
-        # You can potentially check e.status_code or str(e) here if you need to know if it was a rate limit
-        # For example: if hasattr(e, 'status_code') and e.status_code == 429: print("   (This was likely a rate limit error)")
+    finally:
+        writer.close()
+    print_cache_stats(cache)
+    stats = engine.metrics.summary()
+    if stats["requests"]:
+        print(f"ElevenLabs: {stats['requests']} request(s), {stats['characters']} characters, "
+              f"mean latency {stats['latency_mean']:.2f}s, RTF {stats['rtf']:.2f}")
+
+    if result["failed"]:
+        print(f"\nError: {len(result['failed'])} segment(s) could not be synthesized:")
+        by_index = {line["index"]: line for line in dialogue}
+        for index, message in result["failed"]:
+            print(f" - segment {index+1} (script line {by_index[index].get('line', index)+1}): {message}")
+        print(f"'{writer.path}' holds the audio up to the first failed line ({writer.segments_written} segment(s)).")
+        print(f"Completed lines are saved in '{PARTS_DIR}'; rerun to resume.")
         print("       Please check your API key, voice ID, model ID, and account status/quota.")
-        sys.exit(1) # Decide if you want to exit on the first error
-    except Exception as e:
-        print(f"Error: An unexpected error occurred processing line {i+1}: {e}")
-        # Consider if you want to sys.exit(1) here too, or maybe just continue
-        sys.exit(1) # Exiting for now
-
-# --- Combine Audio Chunks and Save to File ---
-if not all_audio_bytes:
-    print("\nNo audio was generated (transcript might be empty or all lines skipped).")
-    sys.exit(0)
-
-print(f"\nCombining {len(all_audio_bytes)} audio segments...")
-try:
-    with open(OUTPUT_FILENAME, "wb") as f:
-        for audio_chunk in all_audio_bytes:
-            f.write(audio_chunk)
-    print(f"\n✅ Combined audio successfully saved as: {OUTPUT_FILENAME}")
+        sys.exit(1)
+
+    print(f"\n✅ {writer.segments_written} audio segments streamed to: {writer.path}")
+    # The run is complete, the per-line segments are no longer needed for resuming
+    shutil.rmtree(PARTS_DIR, ignore_errors=True)
 
     # Optional: Play the generated audio
+    # from elevenlabs import play
     # print("Playing generated audio...")
-    # play(b"".join(all_audio_bytes))
+    # with open(writer.path, "rb") as f: play(f.read())
 
-except Exception as e:
-    print(f"Error writing combined audio to file '{OUTPUT_FILENAME}': {e}")
-    sys.exit(1)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
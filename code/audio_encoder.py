@@ -0,0 +1,196 @@
+# audio_encoder.py
+# Compact encoding of finished calls for the archive (Opus/MP3, mono, 16/24 kHz) on a background pool.
+import os
+import threading
+import time
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from code.audio_writer import FfmpegEncoder, ffmpeg_available, float_to_pcm16
+
+# Codec -> (file extension, ffmpeg arguments). Opus in "voip" mode is tuned for speech.
+ARCHIVE_CODECS = {
+    "opus": (".opus", ["-c:a", "libopus", "-application", "voip"]),
+    "mp3": (".mp3", ["-c:a", "libmp3lame"]),
+    "wav": (".wav", []),
+}
+
+
+def archive_path(output_path: str, codec: str) -> str:
+    """`output_path` with the extension of `codec` (e.g. call.mp3 -> call.opus)."""
+    return os.path.splitext(output_path)[0] + ARCHIVE_CODECS[codec][0]
+
+
+def to_mono(audio):
+    """Downmixes (frames, channels) audio, as returned by soundfile, to mono float32."""
+    import numpy as np
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    return audio
+
+
+def resample(audio, sample_rate: int, target_rate: int):
+    """
+    Resamples mono float audio. Uses scipy's polyphase filter when it is
+    installed, otherwise a windowed-sinc low-pass followed by interpolation.
+    """
+    import numpy as np
+    if sample_rate == target_rate or audio.size == 0:
+        return audio
+    try:
+        from math import gcd
+        from scipy.signal import resample_poly
+        g = gcd(sample_rate, target_rate)
+        return resample_poly(audio, target_rate // g, sample_rate // g).astype(np.float32)
+    except ImportError:
+        pass
+    if target_rate < sample_rate:
+        # Anti-aliasing: cut everything above the new Nyquist frequency
+        cutoff = target_rate / sample_rate / 2
+        taps = np.arange(-64, 65)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        audio = np.convolve(audio, kernel / kernel.sum(), mode="same")
+    frames = int(round(len(audio) * target_rate / sample_rate))
+    positions = np.arange(frames) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def encode_audio(audio, sample_rate: int, output_path: str, codec: str = "opus",
+                 bitrate: str = "24k", target_rate: int = 24000) -> Dict[str, Any]:
+    """
+    Encodes float audio to a compact archive file.
+
+    The audio is downmixed to mono first. With ffmpeg, resampling and encoding
+    happen in one ffmpeg pass; without it the audio is resampled in numpy and
+    stored as 16-bit WAV (with a warning), so archiving never fails outright.
+
+    Args:
+        audio: Float audio in [-1, 1], shape (frames,) or (frames, channels).
+        sample_rate: Sample rate of `audio`.
+        output_path: Target path; its extension is replaced by the codec's.
+        codec: "opus", "mp3" or "wav".
+        bitrate: Target bitrate for compressed codecs (e.g. "24k").
+        target_rate: Output sample rate (16000 or 24000 are plenty for speech).
+
+    Returns:
+        A report dict: 'path', 'codec', 'bytes', 'encode_seconds',
+        'audio_seconds', 'sample_rate' and 'kbps' (effective bitrate).
+    """
+    if codec not in ARCHIVE_CODECS:
+        raise ValueError(f"Unknown archive codec '{codec}', expected one of {sorted(ARCHIVE_CODECS)}.")
+    start = time.perf_counter()
+    mono = to_mono(audio)
+    if codec != "wav" and not ffmpeg_available():
+        print(f"Warning: ffmpeg not found, archiving '{output_path}' as WAV instead of {codec}.")
+        codec = "wav"
+    path = archive_path(output_path, codec)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    if codec == "wav":
+        pcm = float_to_pcm16(resample(mono, sample_rate, target_rate))
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(target_rate)
+            wav.writeframes(pcm)
+    else:
+        encoder = FfmpegEncoder(path, sample_rate, 1,
+                                ARCHIVE_CODECS[codec][1] + ["-b:a", bitrate, "-ar", str(target_rate)])
+        encoder.write(float_to_pcm16(mono))
+        encoder.close()
+
+    audio_seconds = len(mono) / sample_rate if sample_rate else 0.0
+    size = os.path.getsize(path)
+    return {
+        "path": path,
+        "codec": codec,
+        "bytes": size,
+        "encode_seconds": time.perf_counter() - start,
+        "audio_seconds": audio_seconds,
+        "sample_rate": target_rate,
+        "kbps": (size * 8 / 1000 / audio_seconds) if audio_seconds else 0.0,
+    }
+
+
+class ArchiveEncoder:
+    """
+    Encodes finished calls on a small thread pool so encoding of one call
+    overlaps with synthesis of the next (ffmpeg runs in its own process and
+    numpy releases the GIL, so threads are enough).
+    """
+
+    def __init__(self, codec: str = "opus", bitrate: str = "24k", sample_rate: int = 24000, max_workers: int = 2):
+        self.codec = codec
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="archive-encode")
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self.reports: List[Dict[str, Any]] = []
+
+    def submit(self, audio, sample_rate: int, output_path: str,
+               on_done: Callable[[Future], None] | None = None) -> Future:
+        """Queues one call for encoding; the Future resolves to the encode report."""
+        future = self._executor.submit(encode_audio, audio, sample_rate, output_path,
+                                       self.codec, self.bitrate, self.sample_rate)
+        future.add_done_callback(self._record)
+        if on_done:
+            future.add_done_callback(on_done)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _record(self, future: Future) -> None:
+        if future.exception() is not None:
+            print(f"Archive encoding failed: {future.exception()}")
+            return
+        report = future.result()
+        with self._lock:
+            self.reports.append(report)
+        print(f"Archived {report['path']}: {report['bytes'] / 1024:.0f} KB "
+              f"({report['kbps']:.0f} kbps) in {report['encode_seconds']:.2f}s")
+
+    def wait(self) -> List[Dict[str, Any]]:
+        """Blocks until every submitted call is encoded and returns all reports so far."""
+        with self._lock:
+            futures = list(self._futures)
+            self._futures.clear()
+        for future in futures:
+            future.exception() # Waits; failures were already reported
+        with self._lock:
+            return list(self.reports)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            reports = list(self.reports)
+        audio_seconds = sum(r["audio_seconds"] for r in reports)
+        total_bytes = sum(r["bytes"] for r in reports)
+        return {
+            "files": len(reports),
+            "bytes": total_bytes,
+            "audio_seconds": audio_seconds,
+            "encode_seconds": sum(r["encode_seconds"] for r in reports),
+            "kbps": (total_bytes * 8 / 1000 / audio_seconds) if audio_seconds else 0.0,
+        }
+
+    def print_summary(self) -> None:
+        s = self.summary()
+        if s["files"]:
+            print(f"Archive: {s['files']} file(s), {s['bytes'] / (1024 * 1024):.1f} MB for "
+                  f"{s['audio_seconds'] / 60:.1f} min of audio ({s['kbps']:.0f} kbps average), "
+                  f"{s['encode_seconds']:.1f}s spent encoding")
+
+    def shutdown(self) -> None:
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+
+def open_default_encoder() -> ArchiveEncoder | None:
+    """Opens the archive encoder configured in config.py, or None if ARCHIVE_CODEC is empty."""
+    import code.config as config
+    if not config.ARCHIVE_CODEC:
+        return None
+    return ArchiveEncoder(config.ARCHIVE_CODEC, config.ARCHIVE_BITRATE, config.ARCHIVE_SAMPLE_RATE,
+                          config.ARCHIVE_ENCODE_WORKERS)
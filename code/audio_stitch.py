@@ -0,0 +1,94 @@
+# audio_stitch.py
+# Click-free joining of generated clips: silence trimming, fades/crossfades, pauses.
+from typing import List
+
+import numpy as np
+
+
+def trim_silence(clip: np.ndarray, sample_rate: int, threshold_db: float = -45.0, pad_ms: float = 30.0) -> np.ndarray:
+    """
+    Removes leading and trailing silence, keeping `pad_ms` of it on each side.
+    Silence is anything below `threshold_db` relative to full scale, measured
+    over 10 ms windows so single-sample spikes don't count as speech.
+    """
+    if clip.size == 0:
+        return clip
+    window = max(1, int(sample_rate * 0.01))
+    frames = len(clip) // window
+    if frames == 0:
+        return clip
+    rms = np.sqrt(np.mean(clip[:frames * window].reshape(frames, window) ** 2, axis=1))
+    threshold = 10 ** (threshold_db / 20)
+    voiced = np.nonzero(rms > threshold)[0]
+    if voiced.size == 0:
+        return clip[:0]
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, voiced[0] * window - pad)
+    end = min(len(clip), (voiced[-1] + 1) * window + pad)
+    return clip[start:end]
+
+
+def _fade(length: int) -> np.ndarray:
+    # Equal-power (sine) curve: keeps loudness constant through a crossfade
+    return np.sin(np.linspace(0.0, np.pi / 2, length, dtype=np.float32))
+
+
+def stitch_clips(clips: List[np.ndarray], sample_rate: int, crossfade_ms: float = 15.0, pause_ms: float = 0.0,
+                 trim: bool = True, threshold_db: float = -45.0, pad_ms: float = 30.0,
+                 pauses_ms: List[float] | None = None) -> np.ndarray:
+    """
+    Joins mono float clips into one preallocated buffer without clicks.
+
+    With `pause_ms == 0` neighbouring clips overlap by `crossfade_ms` with an
+    equal-power crossfade. With a pause, each clip fades out/in over
+    `crossfade_ms` and `pause_ms` of silence is inserted between them.
+
+    Args:
+        clips: Mono float32 arrays in playback order (empty arrays are skipped).
+        sample_rate: Sample rate of the clips.
+        crossfade_ms: Crossfade (or fade in/out) length at each boundary.
+        pause_ms: Silence between clips.
+        trim: Trim leading/trailing silence from each clip first.
+        threshold_db: Silence threshold used when trimming.
+        pad_ms: Silence kept around speech when trimming.
+        pauses_ms: Optional pause after each clip (overrides `pause_ms` per
+            boundary, e.g. longer at the end of a turn than between sentences).
+
+    Returns:
+        The stitched float32 audio.
+    """
+    if pauses_ms is None:
+        pauses_ms = [pause_ms] * len(clips)
+    if trim:
+        clips = [trim_silence(c, sample_rate, threshold_db, pad_ms) for c in clips]
+    kept = [(np.asarray(c, dtype=np.float32), p) for c, p in zip(clips, pauses_ms) if c.size > 0]
+    if not kept:
+        return np.array([], dtype=np.float32)
+    clips = [c for c, _ in kept]
+
+    fade_len = int(sample_rate * crossfade_ms / 1000)
+    # Boundary i sits between clip i and clip i + 1: either a pause or a crossfade overlap
+    pauses = [int(sample_rate * p / 1000) for _, p in kept[:-1]]
+    # Never overlap more than half of the shorter neighbour
+    overlaps = [0 if pause else min(fade_len, len(a) // 2, len(b) // 2)
+                for pause, a, b in zip(pauses, clips, clips[1:])]
+    total = sum(len(c) for c in clips) + sum(pauses) - sum(overlaps)
+    output = np.zeros(total, dtype=np.float32)
+
+    position = 0
+    for i, clip in enumerate(clips):
+        clip = clip.copy()
+        if i > 0:
+            # Short fades next to a pause remove the step discontinuity at the silence
+            head = overlaps[i - 1] or min(fade_len, len(clip) // 2)
+            if head:
+                clip[:head] *= _fade(head)
+        if i < len(clips) - 1:
+            tail = overlaps[i] or min(fade_len, len(clip) // 2)
+            if tail:
+                clip[-tail:] *= _fade(tail)[::-1]
+        # Overlap-add: the faded tail of the previous clip is already in the buffer
+        output[position:position + len(clip)] += clip
+        if i < len(clips) - 1:
+            position += len(clip) + pauses[i] - overlaps[i]
+    return output
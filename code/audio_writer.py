@@ -0,0 +1,169 @@
+# audio_writer.py
+# Streams synthesized segments into a single valid audio file as they arrive.
+import os
+import shutil
+import subprocess
+import wave
+from typing import Dict, List
+
+
+def float_to_pcm16(samples) -> bytes:
+    """Converts float audio in [-1, 1] (numpy array or torch tensor) to 16-bit PCM bytes."""
+    import numpy as np
+    if hasattr(samples, "cpu"):
+        samples = samples.cpu().numpy()
+    samples = np.clip(np.asarray(samples, dtype=np.float32).flatten(), -1.0, 1.0)
+    return (samples * 32767.0).astype("<i2").tobytes()
+
+
+def strip_id3_tags(data: bytes) -> bytes:
+    """
+    Removes ID3v2 (leading) and ID3v1 (trailing) tags from an MP3 segment so
+    that the remaining MPEG frames can be appended to another MP3 stream.
+    """
+    if data[:3] == b"ID3" and len(data) >= 10:
+        # Tag size is a 28-bit "synchsafe" integer, plus an optional 10-byte footer
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+class FfmpegEncoder:
+    """Encodes raw 16-bit PCM fed in chunks to a compressed file (format from the extension)."""
+
+    def __init__(self, path: str, sample_rate: int, channels: int = 1, extra_args: List[str] | None = None):
+        if not ffmpeg_available():
+            raise RuntimeError("ffmpeg not found on PATH; incremental encoding is unavailable.")
+        self.path = path
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+               "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0"]
+        cmd += (extra_args or []) + [path]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, pcm: bytes) -> None:
+        self._proc.stdin.write(pcm)
+        self._proc.stdin.flush()
+
+    def close(self) -> None:
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self._proc.returncode} while writing {self.path}")
+
+
+class StreamingAudioWriter:
+    """
+    Appends PCM segments to one output file in line order, as soon as each is ready.
+
+    Segments may arrive out of order (e.g. from a worker pool); they are held
+    only until every earlier segment has been written. A WAV output has its
+    header patched after every write, so the file on disk is always playable
+    up to the last completed segment. Any other extension (.mp3, .ogg, .opus)
+    is encoded incrementally through ffmpeg.
+    """
+
+    def __init__(self, path: str, sample_rate: int, expected_indexes: List[int],
+                 channels: int = 1, sample_width: int = 2, gap_seconds: float = 0.0,
+                 encoder_args: List[str] | None = None, pauses_after: Dict[int, float] | None = None):
+        """
+        Args:
+            path: Output file path.
+            sample_rate: Sample rate of the incoming PCM.
+            expected_indexes: Line indexes in the order they should appear.
+            channels: Number of interleaved channels in the incoming PCM.
+            sample_width: Bytes per sample (2 for 16-bit PCM).
+            gap_seconds: Silence inserted between consecutive segments.
+            pauses_after: Optional silence (seconds) after specific segment
+                indexes, overriding `gap_seconds` (e.g. sentence vs turn pauses).
+            encoder_args: Extra ffmpeg arguments (e.g. ["-b:a", "64k"]) for compressed output.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self._order = list(expected_indexes)
+        self._position = 0
+        self._pending: Dict[int, bytes] = {}
+        self._frame_bytes = channels * sample_width
+        self._gap_seconds = gap_seconds
+        self._pauses_after = pauses_after or {}
+        self._last_index = None
+        self.bytes_written = 0
+        self.segments_written = 0
+
+        if path.lower().endswith(".wav"):
+            self._encoder = None
+            # Our own handle, so it can be flushed after every write (wave leaves it open on close)
+            self._file = open(path, "wb")
+            self._wav = wave.open(self._file, "wb")
+            self._wav.setnchannels(channels)
+            self._wav.setsampwidth(sample_width)
+            self._wav.setframerate(sample_rate)
+        else:
+            self._wav = None
+            self._encoder = FfmpegEncoder(path, sample_rate, channels, encoder_args)
+
+    def _write(self, pcm: bytes) -> None:
+        if self._wav is not None:
+            # writeframes() patches the RIFF header to the new length on every call
+            self._wav.writeframes(pcm)
+            self._file.flush()
+        else:
+            self._encoder.write(pcm)
+        self.bytes_written += len(pcm)
+
+    def append(self, index: int, pcm: bytes) -> None:
+        """Queues a segment and writes every segment that is now next in order."""
+        self._pending[index] = pcm
+        while self._position < len(self._order) and self._order[self._position] in self._pending:
+            index = self._order[self._position]
+            segment = self._pending.pop(index)
+            if self._last_index is not None:
+                pause = self._pauses_after.get(self._last_index, self._gap_seconds)
+                if pause > 0:
+                    self._write(b"\x00" * (int(self.sample_rate * pause) * self._frame_bytes))
+            self._write(segment)
+            self._last_index = index
+            self.segments_written += 1
+            self._position += 1
+
+    @property
+    def buffered_segments(self) -> int:
+        """Segments received but still waiting for an earlier one."""
+        return len(self._pending)
+
+    @property
+    def complete(self) -> bool:
+        return self._position == len(self._order)
+
+    def close(self) -> None:
+        if self._wav is not None:
+            self._wav.close()
+            self._file.close()
+        else:
+            self._encoder.close()
+        if self._pending:
+            print(f"Warning: {len(self._pending)} segment(s) were not written to {self.path} "
+                  f"because an earlier segment is missing.")
+
+
+def writable_output_path(path: str) -> str:
+    """`path`, or the WAV file next to it when its compressed format needs ffmpeg and ffmpeg is not installed."""
+    if not path.lower().endswith(".wav") and not ffmpeg_available():
+        return os.path.splitext(path)[0] + ".wav"
+    return path
+
+
+def open_writer_for_output(path: str, sample_rate: int, expected_indexes: List[int], **kwargs) -> StreamingAudioWriter:
+    """
+    Opens a StreamingAudioWriter, falling back to WAV next to `path` when the
+    requested compressed format needs ffmpeg and it is not installed.
+    """
+    actual_path = writable_output_path(path)
+    if actual_path != path:
+        print(f"Warning: ffmpeg not found, writing uncompressed audio to '{actual_path}' instead of '{path}'.")
+    return StreamingAudioWriter(actual_path, sample_rate, expected_indexes, **kwargs)
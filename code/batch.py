@@ -0,0 +1,295 @@
+# batch.py
+# Batch processing of many transcripts (used by main.py):
+#   - input discovery: directories, glob patterns, single files and manifest files
+#   - a worker pool running one transcript per task
+#   - a per-transcript checkpoint, so reruns skip transcripts that are already done
+#   - throughput / ETA progress lines and a summary of failures
+#
+# Manifest files (.csv with a header, .jsonl or a .json list) have one transcript per row:
+#   path (required), call_id, agent, call_date (ISO date). Relative paths are resolved
+#   against the manifest's directory.
+import csv
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List
+
+from code.results_store import call_id_for
+
+MANIFEST_EXTENSIONS = (".csv", ".jsonl", ".json")
+# Files main.py writes next to transcripts; never picked up as input
+DERIVED_SUFFIXES = ("_ideal_call_rag.txt",)
+
+
+def _job(path: str, row: Dict[str, Any] | None = None, root: str | None = None) -> Dict[str, Any]:
+    row = row or {}
+    return {
+        "path": path,
+        "call_id": row.get("call_id") or call_id_for(path, root),
+        "agent": row.get("agent") or None,
+        "call_date": row.get("call_date") or None,
+    }
+
+
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """Reads a manifest file into jobs (see the module header for the format)."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        if manifest_path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        elif manifest_path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        path = (row.get("path") or row.get("transcript_path") or "").strip()
+        if not path:
+            print(f"Warning: Manifest row {number} in {manifest_path} has no path; skipping it.")
+            continue
+        jobs.append(_job(os.path.normpath(os.path.join(base, path)), row, root=base))
+    return jobs
+
+
+def glob_root(pattern: str) -> str:
+    """The directory part of a glob pattern before its first wildcard ("data/*/calls/*.txt" -> "data")."""
+    parts = os.path.normpath(pattern).split(os.sep)
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            return os.sep.join(parts[:i]) or (os.sep if os.path.isabs(pattern) else ".")
+    return os.path.dirname(pattern) or "."
+
+
+def make_call_ids_unique(jobs: List[Dict[str, Any]], path_of: Callable[[Dict[str, Any]], str] = lambda job: job["path"]) -> None:
+    """
+    Appends a short hash of the file path to call IDs that still collide
+    (e.g. a/call.txt and b/call.txt passed as separate files), so results
+    and checkpoint entries of different calls never overwrite each other.
+    """
+    counts = Counter(job["call_id"] for job in jobs)
+    for job in jobs:
+        if counts[job["call_id"]] > 1:
+            digest = hashlib.sha1(os.path.abspath(path_of(job)).encode("utf-8")).hexdigest()[:8]
+            job["call_id"] = f"{job['call_id']}-{digest}"
+
+
+def discover_transcripts(inputs: List[str]) -> List[Dict[str, Any]]:
+    """
+    Expands the command-line inputs into transcript jobs.
+
+    Args:
+        inputs: Directories (searched recursively for *.txt), glob patterns,
+            transcript files and manifest files.
+
+    Returns:
+        Jobs with 'path', 'call_id', 'agent' and 'call_date', without
+        duplicates and without files written by a previous run. Call IDs
+        default to the path relative to the directory (or glob base) the
+        transcript was found in, and are unique within the batch.
+    """
+    jobs: List[Dict[str, Any]] = []
+    for item in inputs:
+        if os.path.isdir(item):
+            jobs.extend(_job(p, root=item) for p in sorted(glob.glob(os.path.join(item, "**", "*.txt"), recursive=True)))
+        elif os.path.isfile(item) and item.lower().endswith(MANIFEST_EXTENSIONS):
+            jobs.extend(load_manifest(item))
+        elif os.path.isfile(item):
+            jobs.append(_job(item))
+        elif glob.has_magic(item):
+            jobs.extend(_job(p, root=glob_root(item)) for p in sorted(glob.glob(item, recursive=True)) if os.path.isfile(p))
+        else:
+            print(f"Warning: '{item}' is not a file, directory or matching glob; skipping it.")
+
+    unique, seen = [], set()
+    for job in jobs:
+        key = os.path.abspath(job["path"])
+        if key in seen or job["path"].endswith(DERIVED_SUFFIXES):
+            continue
+        seen.add(key)
+        unique.append(job)
+    make_call_ids_unique(unique)
+    return unique
+
+
+def fingerprint(path: str) -> str:
+    """Content hash of a transcript, so an edited transcript is processed again."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Append-only JSONL log of finished transcripts. One line per attempt;
+    the last line for a call wins. Lines are flushed as they are written, so
+    an interrupted batch loses at most the transcripts in flight.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._entries[entry["call_id"]] = entry
+                    except (json.JSONDecodeError, KeyError):
+                        continue # A line cut off by a crash
+
+    def is_done(self, job: Dict[str, Any], digest: str) -> bool:
+        entry = self._entries.get(job["call_id"])
+        return bool(entry and entry.get("status") == "done" and entry.get("fingerprint") == digest)
+
+    def record(self, job: Dict[str, Any], status: str, digest: str | None, seconds: float, error: str | None = None) -> None:
+        entry = {"call_id": job["call_id"], "path": job["path"], "status": status, "fingerprint": digest,
+                 "seconds": round(seconds, 3), "finished_at": time.time()}
+        if error:
+            entry["error"] = error
+        with self._lock:
+            self._entries[job["call_id"]] = entry
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class Progress:
+    """Prints one line per finished transcript with throughput and ETA."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = self.failed = 0
+        self.start = time.perf_counter()
+
+    def update(self, job: Dict[str, Any], ok: bool, seconds: float) -> None:
+        self.done += 1
+        self.failed += not ok
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        print(f"[{self.done}/{self.total}] {'ok    ' if ok else 'FAILED'} {job['call_id']} ({seconds:.1f}s) | "
+              f"{rate * 60:.1f} calls/min | elapsed {_format_duration(elapsed)} | ETA {_format_duration(eta)}"
+              f"{f' | {self.failed} failed' if self.failed else ''}")
+
+
+def run_batch(jobs: List[Dict[str, Any]], process: Callable[[Dict[str, Any]], Dict[str, Any] | None],
+              workers: int = 4, checkpoint: Checkpoint | None = None, store=None, store_every: int = 25,
+              force: bool = False, failures_path: str | None = None) -> Dict[str, Any]:
+    """
+    Runs `process` for every job on a thread pool.
+
+    Analyses returned by `process` are written to the results store in bulk
+    (one add_analyses transaction per `store_every` calls, from this thread
+    only). A transcript is checkpointed as done only once its analysis is
+    stored, so a crash never marks unsaved work as done.
+
+    Args:
+        jobs: From discover_transcripts.
+        process: Job -> analysis dict, or None (or an exception) on failure.
+        workers: Transcripts processed concurrently.
+        checkpoint: Checkpoint to skip finished transcripts and record new ones.
+        store: Optional ResultsStore.
+        store_every: Analyses buffered before a bulk write.
+        force: Process transcripts even if the checkpoint says they are done.
+        failures_path: Where to write the failure summary as JSON.
+
+    Returns:
+        Summary with 'total', 'skipped', 'succeeded', 'failed', 'seconds' and 'failures'.
+    """
+    checkpoint = checkpoint or Checkpoint("")
+    pending_jobs, skipped = [], 0
+    for job in jobs:
+        try:
+            job["fingerprint"] = fingerprint(job["path"])
+        except OSError as e:
+            job["fingerprint"] = None
+            job["error"] = str(e)
+        if not force and job["fingerprint"] and checkpoint.is_done(job, job["fingerprint"]):
+            skipped += 1
+            continue
+        pending_jobs.append(job)
+    print(f"\n--- Batch: {len(jobs)} transcript(s), {skipped} already done, {len(pending_jobs)} to process "
+          f"with {workers} worker(s) ---")
+
+    failures: List[Dict[str, Any]] = []
+    buffered: List[tuple] = [] # (job, analysis, seconds) waiting for the bulk write
+    progress = Progress(len(pending_jobs))
+
+    def _flush():
+        if not buffered:
+            return
+        try:
+            if store is not None:
+                store.add_analyses([(job["call_id"], analysis, {"transcript_path": os.path.abspath(job["path"]),
+                                                                "agent": job["agent"], "call_date": job["call_date"]})
+                                    for job, analysis, _ in buffered])
+            for job, _, seconds in buffered:
+                checkpoint.record(job, "done", job["fingerprint"], seconds)
+        except Exception as e:
+            print(f"Error writing {len(buffered)} analyses to the results store: {e}")
+            for job, _, seconds in buffered:
+                failures.append({"call_id": job["call_id"], "path": job["path"], "error": f"store: {e}"})
+                checkpoint.record(job, "failed", job["fingerprint"], seconds, f"store: {e}")
+        buffered.clear()
+
+    def _run(job):
+        start = time.perf_counter()
+        if job.get("error"):
+            return job, None, job["error"], 0.0
+        try:
+            analysis = process(job)
+            return job, analysis, None if analysis else "processing returned no analysis", time.perf_counter() - start
+        except Exception as e:
+            traceback.print_exc()
+            return job, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        try:
+            futures = [pool.submit(_run, job) for job in pending_jobs]
+            for future in as_completed(futures):
+                job, analysis, error, seconds = future.result()
+                if error:
+                    failures.append({"call_id": job["call_id"], "path": job["path"], "error": error})
+                    checkpoint.record(job, "failed", job["fingerprint"], seconds, error)
+                else:
+                    buffered.append((job, analysis, seconds))
+                    if len(buffered) >= store_every:
+                        _flush()
+                progress.update(job, error is None, seconds)
+        except KeyboardInterrupt:
+            # Drop the queued transcripts now; leaving the with block would otherwise process them all first
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("\nInterrupted; saving finished transcripts. Rerun to continue where this stopped.")
+            raise
+        finally:
+            _flush()
+
+    summary = {"total": len(jobs), "skipped": skipped, "succeeded": len(pending_jobs) - len(failures),
+               "failed": len(failures), "seconds": round(time.perf_counter() - start, 2), "failures": failures}
+    print(f"\n--- Batch finished in {_format_duration(summary['seconds'])}: {summary['succeeded']} succeeded, "
+          f"{summary['failed']} failed, {skipped} skipped ---")
+    if failures:
+        print("Failures:")
+        for failure in failures:
+            print(f" - {failure['call_id']} ({failure['path']}): {failure['error']}")
+        if failures_path:
+            with open(failures_path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+            print(f"Failure summary written to {failures_path}")
+    elif failures_path and os.path.exists(failures_path):
+        os.remove(failures_path) # An earlier run's failures would otherwise look current
+    return summary
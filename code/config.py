@@ -4,9 +4,9 @@ from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
+# Keys are checked when a feature first needs them (see require() below), not at import time,
+# so --help, dry runs and parse-only tools work without any keys set
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set. Please create a .env file.")
 
 # You can adjust the model name if needed
 # Check Google AI Studio or documentation for available models (e.g., gemini-1.5-pro)
@@ -19,17 +19,117 @@ PATIENT_SPEAKER_LABEL = "PATIENT" # Or "SPEAKER_02", "Caller", etc.
 # Response generation settings (adjust as needed)
 GEMINI_TEMPERATURE = 0.2 # Lower temperature for more deterministic, factual analysis
 GEMINI_MAX_OUTPUT_TOKENS = 8192 # Generous limit for JSON output, adjust based on model/needs
+ANALYSIS_COMPACT_PROTOCOL = os.getenv("ANALYSIS_COMPACT_PROTOCOL", "1") == "1" # Model answers KPIs by number + status code (far fewer output tokens)
+ANALYSIS_REASK_ROUNDS = int(os.getenv("ANALYSIS_REASK_ROUNDS", "1")) # Focused follow-ups for missing/invalid KPIs, 0 = validate only
+GEMINI_MAX_CONTINUATIONS = int(os.getenv("GEMINI_MAX_CONTINUATIONS", "2")) # Follow-up requests for an analysis cut off at the token limit
+ANALYSIS_RESPONSE_DIR = os.getenv("ANALYSIS_RESPONSE_DIR", "") # Raw analysis responses are saved here (corpus for bench_analysis_parser), empty = off
+# Optional override so the Gemini client can be pointed at a local stand-in server (see standin_server.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") # e.g. http://127.0.0.1:8790; uses the REST transport
 
+# --- Analysis Results Storage (see results_store.py) ---
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", "analysis_results.sqlite") # One row per (call, KPI); empty = don't use the store
+ANALYSIS_JSON_EXPORT = os.getenv("ANALYSIS_JSON_EXPORT", "1") == "1" # Also write <transcript>_analysis.json next to each transcript
 
-# --- ElevenLabs Config ---
-ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-if not ELEVENLABS_API_KEY:
-    print("Warning: ELEVENLABS_API_KEY environment variable not set. TTS functionality will fail.")
+# --- Batch Processing (python -m code.main <dir|glob|manifest>, see batch.py) ---
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4")) # Transcripts processed concurrently (mostly waiting on Gemini)
+BATCH_CHECKPOINT_PATH = os.getenv("BATCH_CHECKPOINT_PATH", "batch_checkpoint.jsonl") # Finished transcripts; reruns skip them
+BATCH_STORE_EVERY = int(os.getenv("BATCH_STORE_EVERY", "25")) # Analyses written to the results store per transaction
+BATCH_FAILURES_PATH = os.getenv("BATCH_FAILURES_PATH", "batch_failures.json") # Failure summary of the last batch
+
+# --- Stage Pipeline (python -m code.pipeline, see pipeline.py) ---
+PIPELINE_STT_WORKERS = int(os.getenv("PIPELINE_STT_WORKERS", "1")) # Whisper processes; each loads its own model
+PIPELINE_LLM_WORKERS = int(os.getenv("PIPELINE_LLM_WORKERS", "8")) # Concurrent Gemini calls (threads)
+PIPELINE_TTS_WORKERS = int(os.getenv("PIPELINE_TTS_WORKERS", "2")) # Processes for Dia, threads for ElevenLabs
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4")) # Calls waiting between two stages
 
+# --- Local Service (python -m code.service, see service.py) ---
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1") # Localhost only; the service has no authentication
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765"))
+SERVICE_LLM_WORKERS = int(os.getenv("SERVICE_LLM_WORKERS", "4")) # Analysis / ideal-call jobs running at once
+SERVICE_TTS_WORKERS = int(os.getenv("SERVICE_TTS_WORKERS", "1")) # TTS jobs running at once (Dia renders one script at a time)
+SERVICE_MAX_JOBS = int(os.getenv("SERVICE_MAX_JOBS", "1000")) # Finished jobs kept in memory for status/result queries
 
+# --- Tracing & Metrics (see tracing.py) ---
+TRACE_PATH = os.getenv("TRACE_PATH", "") # JSONL file every stage span is appended to, empty = no trace file
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Prometheus text endpoint (/metrics) for CLI runs, 0 = off
+GEMINI_INPUT_COST_PER_1M = float(os.getenv("GEMINI_INPUT_COST_PER_1M", "0.075")) # USD per 1M prompt tokens (cost metrics only)
+GEMINI_OUTPUT_COST_PER_1M = float(os.getenv("GEMINI_OUTPUT_COST_PER_1M", "0.30")) # USD per 1M response tokens
 
+# --- Profiling (--profile, see profiling.py) ---
+PROFILE_DIR = os.getenv("PROFILE_DIR", "") # Per-stage CPU/memory profile output directory, empty = profiling off
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01")) # Seconds between stack/memory samples
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1")) # Traceback depth of allocation sites, 0 = no tracemalloc (it slows allocation-heavy code)
+
+
+# --- ElevenLabs Config ---
+ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 AGENT_VOICE_ID = os.getenv("AGENT_ID")  
 PATIENT_VOICE_ID = os.getenv("PATIENT_ID") 
 
 # Choose an ElevenLabs model - "eleven_multilingual_v2" is versatile
-ELEVENLABS_MODEL = "eleven_multilingual_v2"
\ No newline at end of file
+ELEVENLABS_MODEL = "eleven_multilingual_v2"
+
+# Raw PCM lets segments be streamed into one valid output file (see audio_writer.py)
+ELEVENLABS_OUTPUT_FORMAT = "pcm_24000" # pcm_16000 / pcm_22050 / pcm_24000 / pcm_44100
+
+# Optional override so the ElevenLabs client can be pointed at a local stand-in server (see standin_server.py)
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL")
+
+# --- TTS Synthesis Settings ---
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "4")) # Concurrent synthesis requests (keep within your plan's concurrency limit)
+TTS_MAX_RETRIES = int(os.getenv("TTS_MAX_RETRIES", "5")) # Retries per line on 429 / transient errors
+TTS_RETRY_BASE_DELAY = float(os.getenv("TTS_RETRY_BASE_DELAY", "1.0")) # Seconds, doubled after each retry
+
+# Long turns are split at sentence/clause boundaries so no single TTS request exceeds this (estimated) duration
+TTS_SEGMENT_MAX_SECONDS = float(os.getenv("TTS_SEGMENT_MAX_SECONDS", "10")) # 0 disables segmentation
+
+# --- TTS Engine Routing (see tts_engines.py / tts_generator.py) ---
+TTS_ENGINES = os.getenv("TTS_ENGINES", "elevenlabs,dia") # Candidate engines; "stub" adds an instant placeholder-tone backend
+TTS_MAX_LATENCY_SECONDS = float(os.getenv("TTS_MAX_LATENCY_SECONDS", "0")) # Prefer engines expected to finish a script within this, 0 = no limit
+TTS_MAX_COST_USD = float(os.getenv("TTS_MAX_COST_USD", "0")) # Prefer engines whose per-script cost stays below this, 0 = no limit
+TTS_DIA_VOICE = os.getenv("TTS_DIA_VOICE", "") # Registered voice used by the Dia engine, empty = Dia's default voices
+GENERATE_CALL_AUDIO = os.getenv("GENERATE_CALL_AUDIO", "0") == "1" # main.py: also render the ideal call to audio
+
+# --- TTS Audio Cache ---
+# Repeated utterances (greetings, disclosures, verification questions) are served from here
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache") # Set to an empty string to disable caching
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "512")) # Least-recently-used entries are evicted above this size
+
+# --- Call Archive Encoding (see audio_encoder.py) ---
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "opus") # "opus", "mp3" or "wav"; empty = keep the raw render
+ARCHIVE_BITRATE = os.getenv("ARCHIVE_BITRATE", "24k") # Speech is intelligible down to ~16k with Opus
+ARCHIVE_SAMPLE_RATE = int(os.getenv("ARCHIVE_SAMPLE_RATE", "24000")) # 16000 or 24000; rendered audio is downmixed to mono
+ARCHIVE_ENCODE_WORKERS = int(os.getenv("ARCHIVE_ENCODE_WORKERS", "2")) # Background encoder threads
+
+# --- Voice Cloning ---
+VOICE_REGISTRY_DIR = os.getenv("VOICE_REGISTRY_DIR", "voice_registry") # Preprocessed reference voices, see voice_registry.py
+
+# --- Dia (Local TTS) Inference Settings ---
+DIA_DEVICE = os.getenv("DIA_DEVICE", "auto") # "auto", "cuda" or "cpu"
+DIA_COMPUTE_DTYPE = os.getenv("DIA_COMPUTE_DTYPE", "auto") # "auto", "float32", "bfloat16" or "float16" (GPU only)
+DIA_QUANTIZE_INT8 = os.getenv("DIA_QUANTIZE_INT8", "0") == "1" # Dynamic int8 quantization of Linear layers (CPU only)
+DIA_NUM_THREADS = int(os.getenv("DIA_NUM_THREADS", "0")) # Intra-op threads on CPU, 0 = PyTorch default
+DIA_USE_TORCH_COMPILE = os.getenv("DIA_USE_TORCH_COMPILE", "0") == "1" # Slow first call, faster afterwards
+# Without a registered voice, Dia picks a new random voice on every generate() call. Each segment is its own
+# call, so the RNGs are reset to this seed before each one to keep every speaker's voice across segments.
+DIA_SEED = int(os.getenv("DIA_SEED", "42")) # -1 = unseeded; Dia then renders unvoiced scripts in one piece (no segmentation)
+
+
+# --- Per-Feature Validation ---
+# Environment variable -> setting above, for each feature that needs it
+FEATURE_SETTINGS = {
+    "gemini": {"GEMINI_API_KEY": "GEMINI_API_KEY"},
+    "elevenlabs": {"ELEVENLABS_API_KEY": "ELEVENLABS_API_KEY", "AGENT_ID": "AGENT_VOICE_ID", "PATIENT_ID": "PATIENT_VOICE_ID"},
+}
+
+
+def missing_settings(feature: str) -> list:
+    """Environment variables `feature` needs that are not set."""
+    return [env for env, name in FEATURE_SETTINGS[feature].items() if not globals()[name]]
+
+
+def require(feature: str) -> None:
+    """Raises ValueError naming the missing variables if `feature` ("gemini", "elevenlabs") is not configured."""
+    missing = missing_settings(feature)
+    if missing:
+        raise ValueError(f"{', '.join(missing)} not set (needed for {feature}). Please add it to your .env file.")
@@ -0,0 +1,230 @@
+# dia_clone.py
+# Voice-cloned dialogue generation with Dia, chunked into S1/S2 pairs.
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+
+
+def parse_transcript_into_s1_s2_pairs(transcript_text: str) -> List[str]:
+    """
+    Groups a "[S1] ... [S2] ..." transcript into S1/S2 chunks.
+
+    Each chunk is an S1 turn followed by the next S2 turn (if any), plus a
+    trailing open tag for the other speaker so Dia stops cleanly at the end
+    of the chunk. Orphaned S2 turns that do not follow an S1 are skipped.
+    """
+    # First, get all individual turns (S1 or S2)
+    individual_turns = []
+    # Regex to find [S1] or [S2] tags and the text following them, including their original tags
+    raw_matches = re.finditer(r"(\[S[12]\]\s*.*?(?=\n\[S[12]\]|$))", transcript_text, re.DOTALL)
+    for match in raw_matches:
+        full_turn_text = match.group(1).strip() # Includes the [S_] tag
+        if full_turn_text:
+            individual_turns.append(full_turn_text)
+
+    s1_s2_pairs = []
+    i = 0
+    while i < len(individual_turns):
+        current_turn = individual_turns[i]
+        if current_turn.startswith("[S1]"):
+            pair_text = current_turn
+            # Check if the next turn exists and is an S2
+            if (i + 1) < len(individual_turns) and individual_turns[i+1].startswith("[S2]"):
+                pair_text += "\n" + individual_turns[i+1]
+                pair_text += "\n[S1] "
+                i += 1 # Increment to skip the S2 turn in the next iteration
+            else:
+                pair_text += "\n[S2] "
+            s1_s2_pairs.append(pair_text)
+        i += 1
+    return s1_s2_pairs
+
+
+def load_voice_prompt(model, audio_path: str, transcript: str) -> Dict[str, Any]:
+    """
+    Decodes and encodes the cloning reference once.
+
+    `model.generate` re-reads, resamples and DAC-encodes the reference audio
+    on every call when given a path. Passing the encoded codes instead makes
+    that a one-off cost for the whole conversation.
+
+    Args:
+        model: A loaded Dia model.
+        audio_path: Reference recording of the voice(s) to clone.
+        transcript: "[S1] ... [S2] ..." transcript of the reference recording.
+
+    Returns:
+        A dict with 'codes' (encoded audio prompt tensor), 'transcript'
+        (normalized prefix text), 'audio_path' and 'encode_seconds'.
+    """
+    start = time.perf_counter()
+    with torch.inference_mode():
+        codes = model.load_audio(audio_path)
+    return {
+        "codes": codes,
+        # Normalized once: the prefix must end on a line break before the new dialogue
+        "transcript": transcript.strip() + "\n",
+        "audio_path": audio_path,
+        "encode_seconds": time.perf_counter() - start,
+    }
+
+
+def _to_numpy(raw_output) -> np.ndarray:
+    if raw_output is None:
+        return np.array([], dtype=np.float32)
+    if isinstance(raw_output, torch.Tensor):
+        return raw_output.detach().cpu().numpy().astype(np.float32).flatten()
+    return np.asarray(raw_output, dtype=np.float32).flatten()
+
+
+def generate_chunk(model, voice_prompt: Dict[str, Any], text_chunk: str, use_torch_compile: bool = False,
+                   reuse_encoded_prompt: bool = True) -> np.ndarray:
+    """
+    Generates audio for one S1/S2 chunk in the cloned voice(s).
+
+    The model only returns audio for `text_chunk`; the prompt transcript and
+    codes condition the voice. With `reuse_encoded_prompt=False` the reference
+    is passed as a file path (the old behaviour), for timing comparisons.
+    """
+    audio_prompt = voice_prompt["codes"] if reuse_encoded_prompt else voice_prompt["audio_path"]
+    raw_output = model.generate(
+        text=voice_prompt["transcript"] + text_chunk,
+        audio_prompt=audio_prompt,
+        use_torch_compile=use_torch_compile,
+        verbose=False
+    )
+    return _to_numpy(raw_output)
+
+
+def generate_conversation(model, voice_prompt: Dict[str, Any], chunks: List[str], use_torch_compile: bool = False,
+                          reuse_encoded_prompt: bool = True) -> Dict[str, Any]:
+    """
+    Generates every chunk in order.
+
+    Returns:
+        A dict with 'clips' (one float32 array per chunk, empty on failure)
+        and 'chunk_seconds' (wall time per chunk).
+    """
+    clips = []
+    chunk_seconds = []
+    for i, text_chunk in enumerate(chunks):
+        print(f"  Generating audio for chunk {i+1}/{len(chunks)}:\n'{text_chunk[:150]}...'")
+        start = time.perf_counter()
+        try:
+            clip = generate_chunk(model, voice_prompt, text_chunk, use_torch_compile, reuse_encoded_prompt)
+            if clip.size > 0:
+                print(f"  Chunk {i+1} generated successfully (samples: {len(clip)}).")
+            else:
+                print(f"  Warning: Chunk {i+1} - No audio data or empty audio generated.")
+        except Exception as e:
+            print(f"  ERROR generating audio for chunk {i+1}:")
+            print(f"  Text: '{text_chunk[:60]}...'")
+            print(f"  Error details: {e}")
+            clip = np.array([], dtype=np.float32)
+        chunk_seconds.append(time.perf_counter() - start)
+        clips.append(clip)
+    return {"clips": clips, "chunk_seconds": chunk_seconds}
+
+
+def generate_conversation_batched(model, voice_prompt: Dict[str, Any], chunks: List[str], batch_size: int = 4,
+                                  use_torch_compile: bool = False) -> Dict[str, Any]:
+    """
+    Generates several chunks per forward pass using Dia's batched generate().
+
+    Falls back to one chunk at a time if the installed Dia version does not
+    accept a list of texts.
+
+    Returns:
+        Same shape as `generate_conversation`; 'chunk_seconds' holds the
+        batch wall time split evenly across its chunks.
+    """
+    clips, chunk_seconds = [], []
+    for batch_start in range(0, len(chunks), batch_size):
+        batch = chunks[batch_start:batch_start + batch_size]
+        print(f"  Generating chunks {batch_start+1}-{batch_start+len(batch)}/{len(chunks)} in one batch...")
+        start = time.perf_counter()
+        try:
+            outputs = model.generate(
+                text=[voice_prompt["transcript"] + chunk for chunk in batch],
+                audio_prompt=[voice_prompt["codes"]] * len(batch),
+                use_torch_compile=use_torch_compile,
+                verbose=False
+            )
+        except TypeError:
+            print("  Batched generation is not supported by this Dia version, generating chunk by chunk.")
+            rest = generate_conversation(model, voice_prompt, chunks[batch_start:], use_torch_compile)
+            return {"clips": clips + rest["clips"], "chunk_seconds": chunk_seconds + rest["chunk_seconds"]}
+        except Exception as e:
+            print(f"  ERROR generating batch starting at chunk {batch_start+1}: {e}")
+            outputs = [None] * len(batch)
+        elapsed = time.perf_counter() - start
+        if not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+        clips.extend(_to_numpy(output) for output in outputs)
+        chunk_seconds.extend([elapsed / len(batch)] * len(batch))
+    return {"clips": clips, "chunk_seconds": chunk_seconds}
+
+
+# --- Multi-process generation (CPU nodes) ---
+# Each worker process loads its own model and encodes the reference once.
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_clone_worker(audio_path: str, transcript: str, threads: int, use_torch_compile: bool,
+                       voice_name: str | None = None, registry_dir: str | None = None) -> None:
+    from code.openSourceTTS import load_dia_model
+    model = load_dia_model(device="cpu", num_threads=threads)
+    _worker_state["model"] = model
+    if voice_name:
+        from code.voice_registry import load_voice
+        _worker_state["voice_prompt"] = load_voice(voice_name, registry_dir)
+    else:
+        _worker_state["voice_prompt"] = load_voice_prompt(model, audio_path, transcript)
+    _worker_state["use_torch_compile"] = use_torch_compile
+
+
+def _generate_in_worker(index: int, text_chunk: str):
+    start = time.perf_counter()
+    clip = generate_chunk(_worker_state["model"], _worker_state["voice_prompt"], text_chunk,
+                          _worker_state["use_torch_compile"])
+    return index, clip, time.perf_counter() - start
+
+
+def generate_conversation_multiprocess(audio_path: str, transcript: str, chunks: List[str], workers: int = 2,
+                                       threads_per_worker: int | None = None,
+                                       use_torch_compile: bool = False, voice_name: str | None = None,
+                                       registry_dir: str | None = None) -> Dict[str, Any]:
+    """
+    Spreads chunks across worker processes, each with its own model copy.
+
+    Every worker holds a full model, so memory grows with `workers`; split
+    the CPU cores between them with `threads_per_worker` (defaults to
+    cores // workers) to avoid oversubscription. With `voice_name`, workers
+    load the registered voice instead of encoding the reference themselves.
+
+    Returns:
+        Same shape as `generate_conversation`, clips in chunk order.
+    """
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    clips: List[np.ndarray] = [np.array([], dtype=np.float32)] * len(chunks)
+    chunk_seconds = [0.0] * len(chunks)
+    # "spawn" avoids forking a process that already has torch threads running
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_clone_worker,
+                             initargs=(audio_path, transcript, threads, use_torch_compile,
+                                       voice_name, registry_dir)) as executor:
+        futures = {executor.submit(_generate_in_worker, i, chunk): i for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                _, clips[i], chunk_seconds[i] = future.result()
+                print(f"  Chunk {i+1}/{len(chunks)} generated (samples: {len(clips[i])}).")
+            except Exception as e:
+                print(f"  ERROR generating audio for chunk {i+1}: {e}")
+    return {"clips": clips, "chunk_seconds": chunk_seconds}
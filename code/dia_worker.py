@@ -0,0 +1,290 @@
+# dia_worker.py
+# Long-running Dia TTS worker: loads the model once and renders queued scripts back to back.
+#
+# The queue is a directory on the local filesystem:
+#   <queue>/pending/  jobs waiting to run (one JSON file each, processed oldest first)
+#   <queue>/running/  jobs being rendered, or archive-encoded in the background
+#   <queue>/done/     finished jobs, with timing and real-time factor
+#   <queue>/failed/   jobs that raised, with the error message
+#   <queue>/status.json  queue depth and worker statistics, rewritten after every job
+#
+# Usage:
+#   python -m code.dia_worker serve   [--queue tts_queue]
+#   python -m code.dia_worker submit  script.txt output.mp3 [--voice agent_ben] [--queue tts_queue]
+#   python -m code.dia_worker status  [--queue tts_queue]
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Dict
+
+DEFAULT_QUEUE_DIR = "tts_queue"
+QUEUE_STATES = ("pending", "running", "done", "failed")
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    # Write-then-rename so readers never see a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def ensure_queue(queue_dir: str) -> None:
+    for state in QUEUE_STATES:
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+
+def submit_job(transcript_path: str, output_path: str, queue_dir: str = DEFAULT_QUEUE_DIR, **options) -> str:
+    """
+    Adds a synthesis job to the queue.
+
+    Args:
+        transcript_path: AGENT/PATIENT script to render.
+        output_path: Where the worker should write the audio.
+        queue_dir: Queue directory shared with the worker.
+        **options: Extra job fields passed through to the worker.
+
+    Returns:
+        The job ID.
+    """
+    ensure_queue(queue_dir)
+    # Time-prefixed IDs sort in submission order
+    job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    job = {
+        "id": job_id,
+        "transcript": os.path.abspath(transcript_path),
+        "output": os.path.abspath(output_path),
+        "submitted_at": time.time(),
+        **options,
+    }
+    _write_json(os.path.join(queue_dir, "pending", f"{job_id}.json"), job)
+    return job_id
+
+
+def queue_depth(queue_dir: str = DEFAULT_QUEUE_DIR) -> int:
+    """Number of jobs waiting in the queue (excluding the one being rendered)."""
+    pending_dir = os.path.join(queue_dir, "pending")
+    if not os.path.isdir(pending_dir):
+        return 0
+    return sum(1 for name in os.listdir(pending_dir) if name.endswith(".json"))
+
+
+def job_status(job_id: str, queue_dir: str = DEFAULT_QUEUE_DIR) -> Dict[str, Any] | None:
+    """Returns the job record and its state, or None if the ID is unknown."""
+    for state in QUEUE_STATES:
+        path = os.path.join(queue_dir, state, f"{job_id}.json")
+        if os.path.exists(path):
+            job = _read_json(path)
+            job["state"] = state
+            return job
+    return None
+
+
+def _claim_next_job(queue_dir: str) -> Dict[str, Any] | None:
+    """Moves the oldest pending job to running/ and returns it (None if the queue is empty)."""
+    pending_dir = os.path.join(queue_dir, "pending")
+    for name in sorted(n for n in os.listdir(pending_dir) if n.endswith(".json")):
+        running_path = os.path.join(queue_dir, "running", name)
+        try:
+            # rename() is atomic, so two workers can never claim the same job
+            os.rename(os.path.join(pending_dir, name), running_path)
+        except FileNotFoundError:
+            continue
+        return _read_json(running_path)
+    return None
+
+
+def _requeue_interrupted_jobs(queue_dir: str) -> None:
+    """Jobs left in running/ by a crashed worker go back to the front of the queue."""
+    running_dir = os.path.join(queue_dir, "running")
+    for name in os.listdir(running_dir):
+        if name.endswith(".json"):
+            print(f"Re-queueing interrupted job {name[:-5]}")
+            os.replace(os.path.join(running_dir, name), os.path.join(queue_dir, "pending", name))
+
+
+class DiaWorker:
+    """Keeps one Dia model in memory and renders queued jobs until stopped."""
+
+    def __init__(self, queue_dir: str = DEFAULT_QUEUE_DIR, poll_interval: float = 1.0, model_loader=None):
+        """
+        Args:
+            queue_dir: Queue directory to serve.
+            poll_interval: Seconds to sleep when the queue is empty.
+            model_loader: Zero-argument callable returning a loaded Dia model
+                (defaults to openSourceTTS.load_dia_model).
+        """
+        self.queue_dir = queue_dir
+        self.poll_interval = poll_interval
+        self._model_loader = model_loader
+        self._model = None
+        self.model_load_seconds = None
+        self.processed = 0
+        self.failed = 0
+        self.total_audio_seconds = 0.0
+        self.total_synthesis_seconds = 0.0
+        self.last_job = None
+        self.started_at = time.time()
+        self.cache = None
+        self.encoder = None
+        # Jobs are finished from the archive encoder's threads as well as the main loop
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            loader = self._model_loader
+            if loader is None:
+                from code.openSourceTTS import load_dia_model
+                loader = load_dia_model
+            start = time.perf_counter()
+            self._model = loader()
+            self.model_load_seconds = time.perf_counter() - start
+            print(f"Model ready in {self.model_load_seconds:.1f}s; it stays loaded for all further jobs.")
+        return self._model
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "queue_depth": queue_depth(self.queue_dir),
+            "model_loaded": self._model is not None,
+            "model_load_seconds": self.model_load_seconds,
+            "processed": self.processed,
+            "failed": self.failed,
+            # Real-time factor: synthesis time / audio duration (below 1.0 is faster than real time)
+            "average_rtf": (self.total_synthesis_seconds / self.total_audio_seconds) if self.total_audio_seconds else None,
+            "archive": self.encoder.summary() if self.encoder else None,
+            "last_job": self.last_job,
+        }
+
+    def _publish_status(self) -> None:
+        _write_json(os.path.join(self.queue_dir, "status.json"), self.status())
+
+    def process_job(self, job: Dict[str, Any]) -> None:
+        from code.openSourceTTS import render_script
+        job["started_at"] = time.time()
+        print(f"\n--- Job {job['id']}: {job['transcript']} -> {job['output']} "
+              f"({queue_depth(self.queue_dir)} more waiting) ---")
+        try:
+            import code.config as config
+            result = render_script(self._get_model, job["transcript"], job["output"], self.cache,
+                                   use_torch_compile=job.get("use_torch_compile", config.DIA_USE_TORCH_COMPILE),
+                                   max_segment_seconds=job.get("max_segment_seconds", config.TTS_SEGMENT_MAX_SECONDS),
+                                   voice_name=job.get("voice"),
+                                   encoder=self.encoder)
+        except Exception as e:
+            job["error"] = str(e)
+            print(f"Job {job['id']} failed: {e}")
+            traceback.print_exc()
+            self._finish_job(job, None)
+            return
+        encoding = result.pop("encoding", None)
+        job.update(result)
+        job["rtf"] = (result["synthesis_seconds"] / result["audio_seconds"]) if result["audio_seconds"] else None
+        rtf_text = "cached" if result["cached"] else f"RTF {job['rtf']:.2f}" if job["rtf"] is not None else "RTF -"
+        print(f"Job {job['id']} rendered: {result['audio_seconds']:.1f}s of audio ({rtf_text}).")
+        if encoding is None:
+            self._finish_job(job, result)
+        else:
+            # The job stays in running/ until its archive file exists; the next job starts rendering meanwhile
+            encoding.add_done_callback(lambda future: self._finish_encoded_job(job, result, future))
+
+    def _finish_encoded_job(self, job: Dict[str, Any], result: Dict[str, Any], future) -> None:
+        if future.exception() is not None:
+            job["error"] = f"Archive encoding failed: {future.exception()}"
+            self._finish_job(job, None)
+            return
+        report = future.result()
+        job.update({"output": report["path"], "output_bytes": report["bytes"],
+                    "encode_seconds": report["encode_seconds"], "output_kbps": report["kbps"]})
+        self._finish_job(job, result)
+
+    def _finish_job(self, job: Dict[str, Any], result: Dict[str, Any] | None) -> None:
+        """Records the outcome, moves the job file to done/ or failed/ and republishes status."""
+        with self._lock:
+            if result is None:
+                state = "failed"
+                self.failed += 1
+            else:
+                state = "done"
+                self.processed += 1
+                self.total_audio_seconds += 0.0 if result["cached"] else result["audio_seconds"]
+                self.total_synthesis_seconds += result["synthesis_seconds"]
+            job["finished_at"] = time.time()
+            job["wait_seconds"] = job["started_at"] - job["submitted_at"]
+            _write_json(os.path.join(self.queue_dir, state, f"{job['id']}.json"), job)
+            os.remove(os.path.join(self.queue_dir, "running", f"{job['id']}.json"))
+            self.last_job = {k: job.get(k) for k in ("id", "audio_seconds", "synthesis_seconds", "rtf", "cached",
+                                                     "output_bytes", "encode_seconds", "error")}
+            self._publish_status()
+        if state == "done":
+            print(f"Job {job['id']} done: {job['output']}")
+
+    def serve_forever(self, preload: bool = True) -> None:
+        from code.audio_encoder import open_default_encoder
+        from code.tts_cache import open_default_cache
+        ensure_queue(self.queue_dir)
+        _requeue_interrupted_jobs(self.queue_dir)
+        self.cache = open_default_cache()
+        self.encoder = open_default_encoder()
+        if preload:
+            self._get_model()
+        self._publish_status()
+        print(f"Dia worker serving queue '{self.queue_dir}' (Ctrl+C to stop).")
+        try:
+            while True:
+                job = _claim_next_job(self.queue_dir)
+                if job is None:
+                    time.sleep(self.poll_interval)
+                    continue
+                self.process_job(job)
+        except KeyboardInterrupt:
+            print("\nWorker stopped.")
+        finally:
+            if self.encoder:
+                # Let in-flight archive encodes finish so their jobs are not re-rendered on restart
+                self.encoder.shutdown()
+                self.encoder.print_summary()
+            with self._lock:
+                self._publish_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent Dia TTS worker with a filesystem job queue.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_DIR, help="Queue directory (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Load the model once and process jobs until interrupted.")
+    serve.add_argument("--poll-interval", type=float, default=1.0)
+    serve.add_argument("--lazy", action="store_true", help="Load the model on the first job instead of at startup.")
+    submit = sub.add_parser("submit", help="Queue a script for synthesis.")
+    submit.add_argument("transcript")
+    submit.add_argument("output")
+    submit.add_argument("--voice", help="Registered voice to clone (see code/voice_registry.py).")
+    sub.add_parser("status", help="Show queue depth and worker statistics.")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        DiaWorker(args.queue, args.poll_interval).serve_forever(preload=not args.lazy)
+    elif args.command == "submit":
+        options = {"voice": args.voice} if args.voice else {}
+        job_id = submit_job(args.transcript, args.output, args.queue, **options)
+        print(f"Queued job {job_id} ({queue_depth(args.queue)} job(s) pending).")
+    else:
+        status_path = os.path.join(args.queue, "status.json")
+        status = _read_json(status_path) if os.path.exists(status_path) else {}
+        status["queue_depth"] = queue_depth(args.queue)
+        print(json.dumps(status, indent=2))
+
+
+if __name__ == "__main__":
+    main()
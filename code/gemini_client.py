@@ -1,11 +1,22 @@
 # gemini_client.py
-import google.generativeai as genai
+import json
+import threading
+from typing import List
 import code.config as config # Import config for API key and model settings
-from google.generativeai.types import GenerationConfig # For more detailed config
+from code.tracing import count, gemini_cost, span
+# google.generativeai is imported on first use: it takes longer to import than everything else in a CLI run
 
 def configure_gemini():
     """Configures the Google Generative AI client."""
     try:
+        config.require("gemini")
+        import google.generativeai as genai
+        if config.GEMINI_BASE_URL:
+            # Local stand-in (standin_server.py): it only speaks REST, not gRPC
+            genai.configure(api_key=config.GEMINI_API_KEY, transport="rest",
+                            client_options={"api_endpoint": config.GEMINI_BASE_URL})
+            print(f"Gemini client configured for {config.GEMINI_BASE_URL}.")
+            return True
         genai.configure(api_key=config.GEMINI_API_KEY)
         print("Gemini client configured successfully.")
         return True
@@ -13,58 +24,235 @@ def configure_gemini():
         print(f"Error configuring Gemini client: {e}")
         return False
 
-def generate_analysis(prompt: str) -> str | None:
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
     """
-    Sends the prompt to the configured Gemini model and retrieves the analysis.
+    The GenerativeModel for config.GEMINI_MODEL_NAME, configured on first use
+    and reused afterwards, so long-running processes (service.py) keep a warm
+    client instead of configuring one per request.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            if not configure_gemini():
+                return None
+            import google.generativeai as genai
+            _model = genai.GenerativeModel(config.GEMINI_MODEL_NAME)
+        return _model
+
+
+def _generation_config():
+    from google.generativeai.types import GenerationConfig # For more detailed config
+    return GenerationConfig(
+        temperature=config.GEMINI_TEMPERATURE,
+        max_output_tokens=config.GEMINI_MAX_OUTPUT_TOKENS,
+        # response_mime_type="application/json" # Try enabling this if model supports it well!
+    )
+
+
+def _finish_reason_name(response) -> str | None:
+    """Name of the first candidate's finish reason (e.g. "STOP", "MAX_TOKENS"), if reported."""
+    candidates = getattr(response, "candidates", None) or []
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], "finish_reason", None)
+    if reason is None:
+        return None
+    # An enum in current SDKs; older ones return the plain integer (2 == MAX_TOKENS)
+    name = getattr(reason, "name", None)
+    if name is None:
+        name = {1: "STOP", 2: "MAX_TOKENS", 3: "SAFETY", 4: "RECITATION"}.get(reason, str(reason))
+    return name
+
+
+def _record_usage(current, response, finish_reason: str | None) -> None:
+    """Adds the token counts from the response's usage metadata (and their cost) to a trace span."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    current.set(finish_reason=finish_reason, prompt_tokens=prompt_tokens, response_tokens=response_tokens,
+                cost_usd=gemini_cost(prompt_tokens, response_tokens))
+
+
+def generate_with_finish_reason(prompt: str) -> tuple:
+    """
+    Sends the prompt to the configured Gemini model.
 
     Args:
-        prompt: The prompt string containing transcript, KPIs, and instructions.
+        prompt: The prompt string.
 
     Returns:
-        The raw text response from the Gemini API, or None if an error occurs.
+        (text, finish_reason): the raw response text (None if an error
+        occurs) and the finish reason name, e.g. "STOP" or "MAX_TOKENS".
     """
-    if not configure_gemini(): # Ensure client is configured before each call (or configure once globally)
-         return None
+    model = get_model() # Configured once per process, then reused
+    if model is None:
+         return None, None
 
     print(f"Sending request to Gemini model: {config.GEMINI_MODEL_NAME}...")
     try:
-        model = genai.GenerativeModel(config.GEMINI_MODEL_NAME)
-        generation_config = GenerationConfig(
-            temperature=config.GEMINI_TEMPERATURE,
-            max_output_tokens=config.GEMINI_MAX_OUTPUT_TOKENS,
-            # response_mime_type="application/json" # Try enabling this if model supports it well!
-        )
-
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config
-        )
+        with span("gemini", model=config.GEMINI_MODEL_NAME, prompt_chars=len(prompt)) as current:
+            response = model.generate_content(
+                prompt,
+                generation_config=_generation_config()
+            )
+            finish_reason = _finish_reason_name(response)
+            _record_usage(current, response, finish_reason)
 
         print("Received response from Gemini.")
+        if finish_reason == "MAX_TOKENS":
+            print(f"Warning: Gemini stopped at the output-token limit ({config.GEMINI_MAX_OUTPUT_TOKENS}); the response is truncated.")
         # Basic check if response has text part
         if response.parts:
              # Accessing the text content safely
              # Sometimes response might just have safety ratings or finish reason
             response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
             if response_text:
-                return response_text
+                return response_text, finish_reason
             else:
                 print("Warning: Gemini response received but contains no text part.")
                 # Log the full response for debugging if needed
                 # print("Full Gemini Response:", response)
-                return None
+                return None, finish_reason
         else:
-            print("Warning: Gemini response received but has no parts.")
+            print(f"Warning: Gemini response received but has no parts (finish reason: {finish_reason}).")
             # Log the full response for debugging if needed
             # print("Full Gemini Response:", response)
-            return None
+            return None, finish_reason
 
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
         # You might want to inspect the specific error type for more details
         # For example, handle ResourceExhaustedError, InvalidArgumentError etc.
         # print(f"Gemini API Error Details: {getattr(e, 'response', 'No response details')}")
-        return None
+        return None, None
+
+
+def generate_stream_with_finish_reason(prompt: str, on_text=None) -> tuple:
+    """
+    Like generate_with_finish_reason, but streams the response: `on_text` is
+    called with the accumulated text after every chunk, so callers can show
+    partial results (e.g. KPI entries) before the response is complete.
+
+    Args:
+        prompt: The prompt string.
+        on_text: Optional callable receiving the text received so far.
+
+    Returns:
+        (text, finish_reason), as generate_with_finish_reason.
+    """
+    model = get_model()
+    if model is None:
+        return None, None
+
+    print(f"Streaming request to Gemini model: {config.GEMINI_MODEL_NAME}...")
+    try:
+        text, last_chunk = "", None
+        with span("gemini", model=config.GEMINI_MODEL_NAME, prompt_chars=len(prompt), stream=True) as current:
+            for chunk in model.generate_content(prompt, generation_config=_generation_config(), stream=True):
+                last_chunk = chunk
+                piece = "".join(part.text for part in chunk.parts if hasattr(part, 'text')) if chunk.parts else ""
+                if piece:
+                    text += piece
+                    if on_text:
+                        on_text(text)
+            finish_reason = _finish_reason_name(last_chunk) if last_chunk is not None else None
+            if last_chunk is not None:
+                _record_usage(current, last_chunk, finish_reason) # The last chunk carries the usage totals
+        print("Received streamed response from Gemini.")
+        if finish_reason == "MAX_TOKENS":
+            print(f"Warning: Gemini stopped at the output-token limit ({config.GEMINI_MAX_OUTPUT_TOKENS}); the response is truncated.")
+        return (text or None), finish_reason
+    except Exception as e:
+        print(f"Error calling Gemini API (streaming): {e}")
+        return None, None
+
+
+def generate_analysis(prompt: str) -> str | None:
+    """
+    Sends the prompt to the configured Gemini model and retrieves the analysis.
+
+    Args:
+        prompt: The prompt string containing transcript, KPIs, and instructions.
+
+    Returns:
+        The raw text response from the Gemini API, or None if an error occurs.
+    """
+    return generate_with_finish_reason(prompt)[0]
+
+
+def generate_complete_analysis(prompt: str, expected_kpis: List[str], compact: bool = False,
+                               generate=None) -> str | None:
+    """
+    Gets a JSON analysis, continuing it if the model stops at the output-token limit.
+
+    On a MAX_TOKENS finish, the complete KPI entries received so far are kept
+    and a continuation request asks only for the remaining KPIs (and the
+    overall assessment if it is missing). The pieces are merged, so a
+    truncated analysis costs one extra request for its tail instead of a rerun.
+
+    Args:
+        prompt: The analysis prompt from build_analysis_prompt.
+        expected_kpis: The KPI list used in the prompt, in checklist order.
+        compact: The prompt uses the KPI-ID protocol (build_analysis_prompt(compact=True)).
+        generate: Prompt -> (text, finish_reason) callable (defaults to
+            generate_with_finish_reason; llm_stub.LocalLLMStub for dry runs).
+
+    Returns:
+        The merged analysis as a JSON string (or the raw response text if
+        it was never truncated), or None if the first request fails.
+    """
+    from code.analysis_parser import parse_gemini_response_with_report, kpi_key
+    from code.prompt_builder import build_analysis_continuation_prompt
+
+    generate = generate or generate_with_finish_reason
+    response_text, finish_reason = generate(prompt)
+    if response_text is None or finish_reason != "MAX_TOKENS":
+        return response_text
+
+    merged, _ = parse_gemini_response_with_report(response_text, expected_kpis)
+    merged = merged or {}
+    kpi_ids = {kpi: i for i, kpi in enumerate(expected_kpis, start=1)} if compact else None
+    merged.setdefault("kpi_analysis", [])
+    for attempt in range(1, config.GEMINI_MAX_CONTINUATIONS + 1):
+        seen = {kpi_key(entry["kpi"]) for entry in merged["kpi_analysis"]}
+        remaining = [kpi for kpi in expected_kpis if kpi_key(kpi) not in seen]
+        need_overall = not isinstance(merged.get("overall_assessment"), dict)
+        if not remaining and not need_overall:
+            break
+        count("retries_total", stage="gemini_continuation")
+        print(f"Continuation {attempt}/{config.GEMINI_MAX_CONTINUATIONS}: requesting {len(remaining)} remaining KPI(s)"
+              f"{' and the overall assessment' if need_overall else ''}...")
+        completed = [entry["kpi"] for entry in merged["kpi_analysis"]]
+        continuation_text, finish_reason = generate(
+            build_analysis_continuation_prompt(prompt, completed, remaining, need_overall, kpi_ids))
+        if continuation_text is None:
+            print("Continuation request failed; keeping the partial analysis.")
+            break
+        # Parsed against the full list: compact IDs in the continuation still refer to it
+        piece, _ = parse_gemini_response_with_report(continuation_text, expected_kpis)
+        if not piece:
+            print("Could not parse the continuation; keeping the partial analysis.")
+            break
+        # Only KPIs that were still missing are taken from the continuation, never duplicates
+        for entry in piece.get("kpi_analysis", []):
+            key = kpi_key(entry["kpi"])
+            if key not in seen:
+                merged["kpi_analysis"].append(entry)
+                seen.add(key)
+        if need_overall and isinstance(piece.get("overall_assessment"), dict):
+            merged["overall_assessment"] = piece["overall_assessment"]
+
+    # Back into checklist order, whatever order the pieces arrived in
+    order = {kpi_key(kpi): i for i, kpi in enumerate(expected_kpis)}
+    merged["kpi_analysis"].sort(key=lambda entry: order.get(kpi_key(entry["kpi"]), len(order)))
+    missing = len(expected_kpis) - sum(1 for e in merged["kpi_analysis"] if kpi_key(e["kpi"]) in order)
+    print(f"Merged analysis: {len(merged['kpi_analysis'])} KPI entries"
+          f"{f', {missing} still missing' if missing else ''}.")
+    return json.dumps(merged, ensure_ascii=False)
 
 # --- Example Usage (Optional) ---
 # if __name__ == "__main__":
@@ -0,0 +1,112 @@
+# llm_stub.py
+# Local stand-in for Gemini, used for dry runs (python -m code.main --dry-run ...).
+#
+# Answers every prompt this repo sends with a plausible, deterministic response:
+#   - analysis / continuation / re-ask prompts -> analysis JSON (compact or verbose, matching the prompt)
+#   - ideal-call prompts                        -> a short AGENT/PATIENT script
+#   - diarization prompts                       -> the raw transcript split into labelled turns
+# Statuses are derived from a hash of the transcript, so the same call always gets the same analysis.
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import code.config as config
+from code.kpis import KPI_LIST
+from code.tracing import span
+
+_TRANSCRIPT_BLOCK = re.compile(r"\*\*(?:Call Transcript|Original Call Transcript|Raw Transcript):\*\*\s*```(.*?)```", re.DOTALL)
+
+
+class LocalLLMStub:
+    """
+    Drop-in for the Gemini helpers: generate_with_finish_reason() and
+    generate() have the same signatures as in gemini_client.
+
+    Args:
+        latency_seconds: Simulated response time per request.
+        kpis: The KPI list prompts are built from (to recognize the KPIs asked for).
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, kpis: List[str] | None = None):
+        self.latency_seconds = latency_seconds
+        self.kpis = kpis or KPI_LIST
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def generate_with_finish_reason(self, prompt: str) -> Tuple[str | None, str | None]:
+        with span("gemini", model="stub", prompt_chars=len(prompt), finish_reason="STOP"):
+            if self.latency_seconds:
+                time.sleep(self.latency_seconds)
+            return self._respond(prompt), "STOP"
+
+    def generate(self, prompt: str) -> str | None:
+        return self.generate_with_finish_reason(prompt)[0]
+
+    def generate_stream_with_finish_reason(self, prompt: str, on_text=None, chunk_chars: int = 400) -> Tuple[str | None, str | None]:
+        """Streaming variant (see gemini_client.generate_stream_with_finish_reason); the latency is spread over the chunks."""
+        with span("gemini", model="stub", prompt_chars=len(prompt), finish_reason="STOP", stream=True):
+            text = self._respond(prompt)
+            chunks = max(1, -(-len(text) // chunk_chars))
+            for end in range(chunk_chars, len(text) + chunk_chars, chunk_chars):
+                if self.latency_seconds:
+                    time.sleep(self.latency_seconds / chunks)
+                if on_text:
+                    on_text(text[:end])
+            return text, "STOP"
+
+    # --- Responses ---
+
+    def _respond(self, prompt: str) -> str:
+        with self._lock:
+            self.requests += 1
+        if "**Task:**" in prompt and "Rewrite Agent Dialogue" in prompt:
+            return self._ideal_call(prompt)
+        if "Convert the following raw, unstructured call transcript" in prompt:
+            return self._diarize(prompt)
+        return self._analysis(prompt)
+
+    def _transcript(self, prompt: str) -> str:
+        match = _TRANSCRIPT_BLOCK.search(prompt)
+        return match.group(1).strip() if match else prompt
+
+    def _status(self, transcript_hash: str, kpi_id: int) -> str:
+        roll = int(hashlib.sha1(f"{transcript_hash}:{kpi_id}".encode("utf-8")).hexdigest()[:4], 16) / 0xFFFF
+        return "M" if roll < 0.6 else ("N" if roll < 0.9 else "X")
+
+    def _analysis(self, prompt: str) -> str:
+        transcript_hash = hashlib.sha1(self._transcript(prompt).encode("utf-8")).hexdigest()
+        # Numbered KPIs -> compact protocol (analysis, continuation or re-ask); "- KPI" lines -> verbose
+        numbered = [i for i, kpi in enumerate(self.kpis, start=1) if f"{i}. {kpi}" in prompt]
+        compact = bool(numbered)
+        ids = numbered or [i for i, kpi in enumerate(self.kpis, start=1) if f"- {kpi}" in prompt]
+        rows = [(i, self._status(transcript_hash, i), "Stub answer based on the agent's dialogue.") for i in ids]
+        not_met = [self.kpis[i - 1] for i, status, _ in rows if status == "N"]
+        response: Dict = ({"kpis": [list(row) for row in rows]} if compact else
+                          {"kpi_analysis": [{"kpi": self.kpis[i - 1], "status": {"M": "Met", "N": "Not Met", "X": "N/A"}[s],
+                                             "reason": reason} for i, s, reason in rows]})
+        if "**KPIs to evaluate" not in prompt: # Re-ask prompts only want the KPIs
+            response["overall_assessment"] = {
+                "summary": "Stub assessment of the call.",
+                "strengths": ["Clear introduction"],
+                "mistakes_and_improvement_areas": [f"Missed: {kpi}" for kpi in not_met[:3]],
+                "soft_skills_evaluation": {"confidence": "Average", "empathy_relatability": "Showed Some Empathy"},
+            }
+        return "```json\n" + json.dumps(response, indent=2, ensure_ascii=False) + "\n```"
+
+    def _ideal_call(self, prompt: str) -> str:
+        agent, patient = config.AGENT_SPEAKER_LABEL, config.PATIENT_SPEAKER_LABEL
+        return "\n".join([
+            f"{agent}: Thank you for calling, my name is Alex. May I have your full name, please?",
+            f"{patient}: Hi Alex, it's Sarah Miller.",
+            f"{agent}: Thank you, Sarah. Could you spell your last name and confirm the best phone number to reach you?",
+            f"{patient}: M-I-L-L-E-R, and it's 312-555-7842.",
+            f"{agent}: I'm sorry to hear you're in pain. Let's get you scheduled as soon as possible.",
+        ])
+
+    def _diarize(self, prompt: str) -> str:
+        sentences = [s for s in re.split(r"(?<=[.?!])\s+", self._transcript(prompt)) if s]
+        labels = (config.AGENT_SPEAKER_LABEL, config.PATIENT_SPEAKER_LABEL)
+        return "\n".join(f"{labels[i % 2]}: {sentence}" for i, sentence in enumerate(sentences))
@@ -1,4 +1,15 @@
 # main.py
+# Analyzes call transcripts and generates ideal-call scripts (and audio) for them.
+#
+# Usage (from the repository root):
+#   python -m code.main sample_transcript1.txt                      # one transcript
+#   python -m code.main Calls_Generated/                            # every *.txt under a directory
+#   python -m code.main "calls/2026-*/*.txt" --workers 8            # glob pattern
+#   python -m code.main calls.csv                                   # manifest (path, call_id, agent, call_date)
+#   python -m code.main Calls_Generated/ --dry-run                  # local LLM stub instead of Gemini
+# Reruns skip transcripts already in the checkpoint file (--force to redo them).
+import argparse
+import hashlib
 import json
 import os
 import code.config as config # To access configuration constants easily if needed
@@ -7,17 +18,95 @@ from typing import List, Dict, Any
 from code.transcript_processor import load_transcript
 # Import BOTH prompt builders now
 from code.prompt_builder import build_analysis_prompt, build_ideal_call_prompt
-from code.gemini_client import generate_analysis # This function handles sending prompts to Gemini
+from code.gemini_client import generate_analysis, generate_complete_analysis, generate_with_finish_reason # This function handles sending prompts to Gemini
 from code.analysis_parser import parse_gemini_response
-from code.retriever import retrieve_relevant_knowledge
-from tts_generator import generate_audio_from_script # <-- Import the TTS function
+from code.analysis_validator import ensure_complete_analysis
+from code.results_store import ResultsStore, call_id_for
+from code.retriever import retrieve_relevant_knowledge, KB_DIRECTORY
+from code.tts_generator import generate_audio_from_script # <-- Import the TTS function
+from code.batch import Checkpoint, discover_transcripts, run_batch
+from code.tracing import call_context, configure as configure_tracing, span
+import code.profiling as profiling
 
-def run_analysis(transcript_file_path: str) -> Dict[str, Any] | None:
+
+def save_raw_response(response_text: str, directory: str) -> None:
+    """Keeps a raw analysis response in `directory` (named by its content hash, so repeats are stored once)."""
+    os.makedirs(directory, exist_ok=True)
+    name = hashlib.sha1(response_text.encode("utf-8")).hexdigest()[:16] + ".txt"
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        f.write(response_text)
+
+
+def output_path_for(transcript_file_path: str, suffix: str, output_dir: str | None = None) -> str:
+    """<transcript name><suffix>, next to the transcript or in `output_dir`."""
+    base = os.path.splitext(transcript_file_path)[0]
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, os.path.basename(base))
+    return base + suffix
+
+
+def output_dir_for_call(output_dir: str | None, call_id: str | None) -> str | None:
+    """`output_dir` plus the call ID's folder ("clinic_a/call" -> <output_dir>/clinic_a), so equally named transcripts don't overwrite each other's outputs."""
+    if output_dir and call_id and "/" in call_id:
+        return os.path.join(output_dir, os.path.dirname(call_id))
+    return output_dir
+
+
+def analyze_transcript(transcript: str, generate=None) -> Dict[str, Any] | None:
+    """
+    Analyzes transcript text (steps 2-4 of run_analysis) without saving anything.
+
+    Args:
+        transcript: The call transcript (with speaker labels).
+        generate: Prompt -> (text, finish_reason) callable; defaults to Gemini
+            (llm_stub.LocalLLMStub.generate_with_finish_reason for dry runs).
+
+    Returns:
+        The parsed, validated analysis, or None if analysis fails.
+    """
+    generate = generate or generate_with_finish_reason
+
+    # 2. Build Analysis Prompt
+    print("Building analysis prompt...")
+    with span("prompt_build", kind="analysis") as current:
+        analysis_prompt = build_analysis_prompt(transcript, KPI_LIST, compact=config.ANALYSIS_COMPACT_PROTOCOL)
+        current.set(prompt_chars=len(analysis_prompt))
+
+    # 3. Get Analysis from Gemini (continued automatically if cut off at the token limit)
+    raw_analysis_response = generate_complete_analysis(analysis_prompt, KPI_LIST, compact=config.ANALYSIS_COMPACT_PROTOCOL,
+                                                       generate=generate)
+    if not raw_analysis_response:
+        print("Analysis aborted: Failed to get analysis response from Gemini.")
+        return None
+    if config.ANALYSIS_RESPONSE_DIR:
+        save_raw_response(raw_analysis_response, config.ANALYSIS_RESPONSE_DIR)
+
+    # 4. Parse the Analysis Response
+    with span("parse", response_chars=len(raw_analysis_response)) as current:
+        analysis_result = parse_gemini_response(raw_analysis_response, KPI_LIST)
+        current.set(kpis=len(analysis_result["kpi_analysis"]) if analysis_result else 0)
+
+    # 4b. Make sure every KPI has a valid entry; only the gaps are re-asked
+    if analysis_result:
+        analysis_result, _ = ensure_complete_analysis(analysis_result, transcript, KPI_LIST, config.ANALYSIS_REASK_ROUNDS,
+                                                      generate=lambda prompt: generate(prompt)[0])
+    return analysis_result
+
+
+def run_analysis(transcript_file_path: str, generate=None, store_result: bool = True,
+                 output_dir: str | None = None, call_id: str | None = None) -> Dict[str, Any] | None:
     """
     Runs the call analysis pipeline and returns the parsed analysis report.
 
     Args:
         transcript_file_path: Path to the call transcript file.
+        generate: Prompt -> (text, finish_reason) callable; defaults to Gemini
+            (llm_stub.LocalLLMStub.generate_with_finish_reason for dry runs).
+        store_result: Write the analysis to the results store. The batch
+            runner passes False and stores its analyses in bulk.
+        output_dir: Where to write the _analysis.json file (default: next to the transcript).
+        call_id: ID the analysis is stored under (default: results_store.call_id_for).
 
     Returns:
         The parsed analysis report as a dictionary, or None if analysis fails.
@@ -25,35 +114,35 @@ def run_analysis(transcript_file_path: str) -> Dict[str, Any] | None:
     print(f"\n--- Starting Analysis for: {transcript_file_path} ---")
 
     # 1. Load Transcript
-    transcript = load_transcript(transcript_file_path)
+    with span("load", path=transcript_file_path):
+        transcript = load_transcript(transcript_file_path)
     if not transcript:
         print("Analysis aborted: Could not load transcript.")
         return None
 
-    # 2. Build Analysis Prompt
-    print("Building analysis prompt...")
-    analysis_prompt = build_analysis_prompt(transcript, KPI_LIST)
-
-    # 3. Get Analysis from Gemini
-    raw_analysis_response = generate_analysis(analysis_prompt)
-    if not raw_analysis_response:
-        print("Analysis aborted: Failed to get analysis response from Gemini.")
-        return None
-
-    # 4. Parse the Analysis Response
-    analysis_result = parse_gemini_response(raw_analysis_response)
+    # 2-4. Prompt, Gemini, parse and validate
+    analysis_result = analyze_transcript(transcript, generate)
 
     # 5. Display/Save Analysis Results
     if analysis_result:
         print("\n--- Analysis Successful ---")
         # print(json.dumps(analysis_result, indent=2)) # Keep console clean, save to file
 
-        # Save the result to a file
-        output_filename = transcript_file_path.replace(".txt", "_analysis.json")
+        # Save the result to the results store (and the classic JSON file, if enabled)
         try:
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, indent=2, ensure_ascii=False)
-            print(f"Analysis saved to: {output_filename}")
+            if store_result and config.RESULTS_DB_PATH:
+                store = ResultsStore(config.RESULTS_DB_PATH)
+                try:
+                    store.add_analysis(call_id or call_id_for(transcript_file_path), analysis_result,
+                                       {"transcript_path": os.path.abspath(transcript_file_path)})
+                finally:
+                    store.close()
+                print(f"Analysis stored in: {config.RESULTS_DB_PATH}")
+            if config.ANALYSIS_JSON_EXPORT:
+                output_filename = output_path_for(transcript_file_path, "_analysis.json", output_dir)
+                with open(output_filename, 'w', encoding='utf-8') as f:
+                    json.dump(analysis_result, f, indent=2, ensure_ascii=False)
+                print(f"Analysis saved to: {output_filename}")
             return analysis_result # Return the parsed result
         except Exception as e:
             print(f"Error saving analysis results: {e}")
@@ -65,37 +154,66 @@ def run_analysis(transcript_file_path: str) -> Dict[str, Any] | None:
         return None
 
 
-def generate_and_display_ideal_call(original_transcript: str, analysis_result: Dict[str, Any], transcript_file_path: str):
+def generate_ideal_call_text(original_transcript: str, analysis_result: Dict[str, Any], generate=None) -> str | None:
     """
-    Generates and displays/saves the ideal call text using RAG.
+    RAG steps of the ideal call: retrieve knowledge for the analysis findings,
+    build the prompt and generate the script.
 
     Args:
         original_transcript: The original call transcript text.
         analysis_result: The parsed analysis report dictionary.
-        transcript_file_path: Original transcript path used for naming output file.
-    """
-    print(f"\n--- Starting Ideal Call Generation (RAG Workflow) ---")
+        generate: Prompt -> text callable (defaults to gemini_client.generate_analysis).
 
+    Returns:
+        The ideal call text, or None if generation failed.
+    """
     # --- RAG Step 1: Retrieval ---
     print("Retrieving relevant knowledge based on analysis...")
-    retrieved_knowledge_chunks = retrieve_relevant_knowledge(analysis_result)
+    with span("retrieve") as current:
+        retrieved_knowledge_chunks = retrieve_relevant_knowledge(analysis_result)
+        current.set(chunks=len(retrieved_knowledge_chunks))
     # print("\nRetrieved Knowledge for Prompt:") # Optional: print retrieved chunks
     # for chunk in retrieved_knowledge_chunks:
     #     print(chunk)
 
     # --- RAG Step 2: Augmentation & Prompt Building ---
     print("\nBuilding RAG prompt for ideal call generation...")
-    ideal_call_prompt = build_ideal_call_prompt(
-        original_transcript,
-        analysis_result,
-        retrieved_knowledge_chunks # Pass the retrieved chunks here
-    )
+    with span("prompt_build", kind="ideal_call") as current:
+        ideal_call_prompt = build_ideal_call_prompt(
+            original_transcript,
+            analysis_result,
+            retrieved_knowledge_chunks # Pass the retrieved chunks here
+        )
+        current.set(prompt_chars=len(ideal_call_prompt))
     # print("\n--- Ideal Call RAG Prompt Snippet ---") # Optional: Debug prompt
     # print(ideal_call_prompt[:1000] + "...")
 
     # --- RAG Step 3: Generation ---
     print("\nGenerating ideal call using Gemini with retrieved knowledge...")
-    ideal_call_text = generate_analysis(ideal_call_prompt) # Reuse the Gemini client function
+    return (generate or generate_analysis)(ideal_call_prompt) # Reuse the Gemini client function
+
+
+def generate_and_display_ideal_call(original_transcript: str, analysis_result: Dict[str, Any], transcript_file_path: str,
+                                    generate=None, output_dir: str | None = None, tts_router=None,
+                                    with_audio: bool | None = None) -> str | None:
+    """
+    Generates and displays/saves the ideal call text using RAG.
+
+    Args:
+        original_transcript: The original call transcript text.
+        analysis_result: The parsed analysis report dictionary.
+        transcript_file_path: Original transcript path used for naming output file.
+        generate: Prompt -> text callable (defaults to gemini_client.generate_analysis).
+        output_dir: Where to write the outputs (default: next to the transcript).
+        tts_router: TTS router for the audio (default: tts_generator.default_router()).
+        with_audio: Render the audio too (default: config.GENERATE_CALL_AUDIO).
+            The pipeline passes False and synthesizes in its own TTS stage.
+
+    Returns:
+        The ideal call text, or None if generation failed.
+    """
+    print(f"\n--- Starting Ideal Call Generation (RAG Workflow) ---")
+    ideal_call_text = generate_ideal_call_text(original_transcript, analysis_result, generate)
 
     # --- Handle Generation Output ---
     if ideal_call_text:
@@ -104,172 +222,138 @@ def generate_and_display_ideal_call(original_transcript: str, analysis_result: D
         print(ideal_call_text)
 
         # Save the result to a file
-        output_filename = transcript_file_path.replace(".txt", "_ideal_call_rag.txt") # New name
+        output_filename = output_path_for(transcript_file_path, "_ideal_call_rag.txt", output_dir) # New name
         try:
             with open(output_filename, 'w', encoding='utf-8') as f:
                 f.write(ideal_call_text)
             print(f"\nIdeal call suggestions saved to: {output_filename}")
 
-            # --- Generate Audio ---
-            #audio_output_filename = transcript_file_path.replace(".txt", "_ideal_call_audio.mp3")
-            #print("\n--- Starting Audio Generation ---")
-            #if generate_audio_from_script(ideal_call_text, audio_output_filename):
-            #     print(f"Ideal call audio successfully generated and saved to: {audio_output_filename}")
-            #else:
-            #     print(f"Ideal call audio generation failed.")
+            # --- Generate Audio (engine chosen by the TTS router, see tts_generator.py) ---
+            if config.GENERATE_CALL_AUDIO if with_audio is None else with_audio:
+                audio_output_filename = output_path_for(transcript_file_path, "_ideal_call_audio.mp3", output_dir)
+                print("\n--- Starting Audio Generation ---")
+                audio_path = generate_audio_from_script(ideal_call_text, audio_output_filename, router=tts_router)
+                if audio_path:
+                    print(f"Ideal call audio successfully generated and saved to: {audio_path}")
+                else:
+                    print(f"Ideal call audio generation failed.")
             # --- End Audio Generation ---
-            
+
         except Exception as e:
             print(f"Error saving ideal call suggestions: {e}")
+        return ideal_call_text
 
     else:
         print("\n--- Ideal Call Generation Failed ---")
         print("Failed to get ideal call response from Gemini (RAG).")
-
-    
-
-
-def generate_dummy_transcript(transcript_to_process:str):
-        # --- Ensure sample transcript exists for testing ---
-    if not os.path.exists(transcript_to_process):
-         print(f"Creating dummy transcript file: {transcript_to_process}")
-         with open(transcript_to_process, "w", encoding='utf-8') as f:
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Hello, thank you for calling Healthy Clinic, my name is Ben. May I start with your full name, please?\n")
-            # KPI Met: Introduction
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Hi Ben, it's Sarah Miller.\n")
-            # KPI Met: Got Name
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Okay Sarah, thanks. Could you spell your last name for me?\n")
-            # KPI Met: Verify Spelling
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Sure, M-I-L-L-E-R.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Got it. And what's the best phone number to reach you?\n")
-            # KPI Met: Verify Phone Number
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: 555-987-6543.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Okay, 555-987-6543. So, what brings you in today?\n")
-            # KPI Missed: Capture Lead Source.
-            # Soft Skill Note: Transition is okay, not particularly warm or engaging.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: My left shoulder has been really stiff and painful for about two weeks.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Your left shoulder, okay. Besides stiff and painful, are there any other symptoms like clicking, grinding, or weakness?\n")
-            # KPI Met: Detailed description (affected body part).
-            # KPI Met: Asking about symptoms.
-            # Soft Skill Note: Good clarifying question.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: It's mainly the stiffness, and I definitely feel weaker when I try to lift things overhead.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: And this started about two weeks ago? Has it been constant, or does it come and go?\n")
-            # KPI Met: Duration / Recurrence pattern.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: It's been pretty constant since it started.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Alright. Is this related to any specific injury, like a fall, car accident, or anything at work?\n")
-            # KPI Met: Identify if MVA/WC/Legal related.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: No, not that I can think of. It just kind of started.\n")
-            # Note: Accident-related KPIs should now be N/A based on this answer.
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Have you had any prior treatment or seen any other doctors for this specific shoulder issue before?\n")
-            # KPI Met: Ask about previous treatments.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: No, this is the first time.\n")
-            # Note: Previous treatment detail KPIs (providers, contacts, procedures, tests, records) should be N/A.
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Okay. Let's look at insurance. Do you have health insurance you'd like to use?\n")
-            # Soft Skill Note: Functional transition, slightly abrupt.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Yes, I have Aetna.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Okay, Aetna. Could I get the Member ID number from your card?\n")
-            # KPI Met: Ask for Insurance ID.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: It's W123456789.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: W123456789. Is there a group number as well?\n")
-            # KPI Met: Ask for Insurance Group.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Yes, GRP-ABC.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: And are you the subscriber, the main person on the policy?\n")
-            # KPI Met: Ask for Insurance Subscriber relationship.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Yes.\n")
-            # Note: Subscriber Name/DOB KPIs should be N/A.
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Do you have any secondary insurance coverage?\n")
-            # KPI Met: Ask about Secondary Insurer.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: No, just the Aetna.\n")
-
-            # --- Potential Miss #2 ---
-            # KPI Missed: Disclose Out-of-Network status (Assuming this is required)
-            # Agent proceeds directly to scheduling without mentioning network status.
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Okay, thanks for that information. Let me check the schedule... It looks like Dr. Davis has an opening this Friday at 10:30 AM. Would that time work for you?\n")
-            # Note: Appointment offered.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Yes, Friday at 10:30 is perfect.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Great. So that's booked. Friday at 10:30 AM with Dr. Davis at our main clinic on 456 Health Drive. We'll send you a text message with a link to our online new patient portal to complete your paperwork beforehand. Please try to do that at least a day before your visit.\n")
-            # KPI Met: Confirm Appointment Date.
-            # KPI Met: Confirm Appointment Time.
-            # KPI Met: Confirm Provider.
-            # KPI Met: Confirm Location.
-            # KPI Met: Reiterate Next Steps (Packet/Portal).
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Okay, sounds good.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Do you have any other questions right now?\n")
-            # Soft Skill Note: Good practice to ask for questions.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: No, thank you.\n")
-
-            f.write(f"{config.AGENT_SPEAKER_LABEL}: Alright then, Sarah. We look forward to seeing you on Friday. Have a good day!\n")
-            # Soft Skill Note: Standard, polite closing. Confidence/Energy likely average.
-
-            f.write(f"{config.PATIENT_SPEAKER_LABEL}: Thanks, you too. Bye.\n")
-    
-    print(f"File {transcript_to_process} created.")
-
-if __name__ == "__main__":
-    # --- INPUT: Specify the path to your transcript file ---
-    transcript_to_process = "sample_transcript1.txt" # <--- CHANGE THIS
-
-    if not os.path.exists("sample_transcript1.txt"):
-        generate_dummy_transcript(transcript_to_process)
+        return None
 
 
- # --- Ensure knowledge base dir and some files exist ---
-    KB_DIRECTORY = "knowledge_base" # Make sure this matches retriever.py
+def ensure_knowledge_base():
+    # --- Ensure knowledge base dir and some files exist ---
     if not os.path.exists(KB_DIRECTORY):
         os.makedirs(KB_DIRECTORY)
         print(f"Created directory: {KB_DIRECTORY}")
     knowledge_files_to_check = ["sop_introduction.txt", "sop_verification.txt", "examples_empathy.txt"]
     for fname in knowledge_files_to_check:
         fpath = os.path.join(KB_DIRECTORY, fname)
-        if not os.path.exists(fpath):   # Just Checking here k if Knowledge base not made then insert random shi there 
+        if not os.path.exists(fpath):   # Just Checking here k if Knowledge base not made then insert random shi there
             print(f"Creating dummy knowledge file: {fpath}")
             content = f"Content for {fname}. Example: keyword {fname.split('.')[0].split('_')[-1]}"
             with open(fpath, "w") as f:
                 f.write(content)
 
 
+def process_transcript(job: Dict[str, Any], generate=None, ideal_call: bool = True, output_dir: str | None = None,
+                       tts_router=None) -> Dict[str, Any] | None:
+    """
+    Full pipeline for one batch job: analysis, then ideal call text & audio.
+
+    The analysis is returned (not stored); the batch runner writes it to
+    the results store together with the other finished transcripts.
+    """
+    with call_context(job.get("call_id")): # Trace spans of this transcript are grouped by its call ID
+        return _process_transcript(job, generate, ideal_call, output_dir, tts_router)
+
+
+def _process_transcript(job: Dict[str, Any], generate, ideal_call: bool, output_dir: str | None,
+                        tts_router) -> Dict[str, Any] | None:
+    transcript_path = job["path"]
+    output_dir = output_dir_for_call(output_dir, job.get("call_id"))
     # --- STEP 1: Run Analysis ---
-    analysis_data = run_analysis(transcript_to_process)
+    analysis_data = run_analysis(transcript_path, generate=generate, store_result=False, output_dir=output_dir)
 
     # --- STEP 2: Generate Ideal Call Text & Audio (if analysis was successful) ---
-    if analysis_data:
-        original_transcript_content = load_transcript(transcript_to_process)
+    if analysis_data and ideal_call:
+        original_transcript_content = load_transcript(transcript_path)
         if original_transcript_content:
-             generate_and_display_ideal_call(original_transcript_content, analysis_data, transcript_to_process)
+            text_generate = (lambda prompt: generate(prompt)[0]) if generate else None
+            generate_and_display_ideal_call(original_transcript_content, analysis_data, transcript_path,
+                                            generate=text_generate, output_dir=output_dir, tts_router=tts_router)
         else:
             print("Could not reload transcript to generate ideal call.")
-    else:
+    elif not analysis_data:
         print("\nSkipping ideal call generation because analysis failed or was not performed.")
+    return analysis_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze call transcripts and generate ideal calls.")
+    parser.add_argument("inputs", nargs="+", help="Transcript files, directories, glob patterns or manifest files (.csv/.jsonl/.json).")
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS, help="Transcripts processed concurrently.")
+    parser.add_argument("--skip-ideal-call", action="store_true", help="Only analyze; no ideal call script or audio.")
+    parser.add_argument("--force", action="store_true", help="Reprocess transcripts the checkpoint lists as done.")
+    parser.add_argument("--checkpoint", default=None, help=f"Checkpoint file (default: {config.BATCH_CHECKPOINT_PATH}).")
+    parser.add_argument("--output-dir", default=None, help="Write outputs here instead of next to each transcript.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Use the local LLM stub instead of Gemini and a placeholder TTS engine. Results go to a "
+                             "separate store, checkpoint and output directory.")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Dry run: simulated seconds per LLM request.")
+    parser.add_argument("--trace", default=None, help="Append per-stage trace spans to this JSONL file (default: TRACE_PATH).")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (default: METRICS_PORT).")
+    parser.add_argument("--profile", nargs="?", const="profile", default=None, metavar="DIR",
+                        help="Profile every stage (CPU samples, Python/RSS memory peaks) into DIR (default: profile/; setting PROFILE_DIR also enables it).")
+    args = parser.parse_args()
+    configure_tracing(args.trace, args.metrics_port)
+    profiling.configure(args.profile)
+
+    jobs = discover_transcripts(args.inputs)
+    if not jobs:
+        print("No transcripts found.")
+        return
+
+    generate, tts_router = None, None
+    db_path, checkpoint_path, output_dir = config.RESULTS_DB_PATH, args.checkpoint or config.BATCH_CHECKPOINT_PATH, args.output_dir
+    if args.dry_run:
+        from code.llm_stub import LocalLLMStub
+        from code.tts_engines import StubEngine, TTSRouter
+        stub = LocalLLMStub(latency_seconds=args.stub_latency)
+        generate, tts_router = stub.generate_with_finish_reason, TTSRouter([StubEngine()])
+        # Never mix stub results with real ones
+        db_path = "dry_run_results.sqlite"
+        checkpoint_path = args.checkpoint or "dry_run_checkpoint.jsonl"
+        output_dir = output_dir or "dry_run_output"
+        print(f"Dry run: local LLM stub, results in {db_path}, outputs in {output_dir}/")
+    else:
+        try:
+            config.require("gemini") # Fail before the batch starts, not once per transcript
+        except ValueError as e:
+            parser.error(str(e))
+
+    ensure_knowledge_base()
+    store = ResultsStore(db_path) if db_path else None
+    try:
+        run_batch(jobs,
+                  lambda job: process_transcript(job, generate, not args.skip_ideal_call, output_dir, tts_router),
+                  workers=args.workers, checkpoint=Checkpoint(checkpoint_path), store=store,
+                  store_every=config.BATCH_STORE_EVERY, force=args.force, failures_path=config.BATCH_FAILURES_PATH)
+    finally:
+        if store is not None:
+            store.close()
+        profiling.finish()
 
-    print("\n--- Script Finished ---")
\ No newline at end of file
+    print("\n--- Script Finished ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,390 @@
-# Imports (ensure these are installed locally: pip install soundfile dia-tts torch ipython) # ran on 8:06
-import soundfile as sf
-from dia.model import Dia
+# Imports (ensure these are installed locally: pip install soundfile dia-tts torch) # ran on 8:06
+# torch, Dia and soundfile are imported where they are used, so modules that only need the
+# constants and helpers here (tts_engines, voice_registry) don't pay seconds of import time.
 import traceback
-from IPython.display import Audio # Works in Jupyter/IPython, harmless in plain script
-import torch # For CUDA cache clearing
 import os # For checking file existence
+import time
+import io # In-memory WAV encoding for the TTS cache
+from typing import Any, Dict, List
+from code.transcript_processor import parse_dialogue_lines
+from code.tts_cache import open_default_cache, print_cache_stats
+from code.tts_segmenter import segment_dialogue
+from code.audio_encoder import open_default_encoder
+from code.tracing import span
 
 # Step 1: Define the transcript filename (ASSUMED TO EXIST)
 TRANSCRIPT_FILENAME = "sample_transcript_ideal_call_rag.txt"
+OUTPUT_FILENAME = "dialogue_output.mp3"
+DIA_MODEL_ID = "nari-labs/Dia-1.6B"
+SAMPLE_RATE = 44100 # Dia model default is 44.1kHz
 
-# --- Pre-run check for the transcript file ---
-if not os.path.exists(TRANSCRIPT_FILENAME):
-    print(f"Error: The required transcript file '{TRANSCRIPT_FILENAME}' was not found in the current directory.")
-    print(f"Please make sure the file exists and contains the dialogue content.")
-    # You might want to exit the script here if the file is essential
-    exit()
-else:
-    print(f"Using existing transcript file: '{TRANSCRIPT_FILENAME}'")
-
-# Clear CUDA cache before loading the model
-if torch.cuda.is_available():
-    torch.cuda.empty_cache()
-    print("CUDA cache cleared before model loading.")
-else:
-    print("No CUDA GPU detected. Model will attempt to run on CPU (if supported by 'Dia'), which might be significantly slower.")
-
-# --- Load and Prepare Transcript Segments ---
-print(f"\nLoading transcript from: {TRANSCRIPT_FILENAME}")
-model_input_parts = []
-dialogue_segment_count = 0
-
-try:
-    with open(TRANSCRIPT_FILENAME, 'r', encoding='utf-8') as f:
-        for line_num, line_content in enumerate(f):
-            line_content = line_content.strip()
-            if not line_content: continue
-            # Handle potential BOM (Byte Order Mark) for UTF-8 files from Windows
-            if line_num == 0 and line_content.startswith('\ufeff'):
-                line_content = line_content[1:]
-                if not line_content: continue
-
-            if line_content.startswith("AGENT:"):
-                text = line_content.replace("AGENT:", "", 1).strip()
-                if text:
-                    model_input_parts.append(f"[S1] {text}")
-                    dialogue_segment_count += 1
-            elif line_content.startswith("PATIENT:"):
-                text = line_content.replace("PATIENT:", "", 1).strip()
-                if text:
-                    model_input_parts.append(f"[S2] {text}")
-                    dialogue_segment_count +=1
-            else:
-                # Avoid printing for known non-dialogue lines like headers from the original script
-                if not (line_content.startswith("**") and line_content.endswith("**")):
-                    print(f"Info: Line {line_num+1} in transcript is not AGENT/PATIENT or a known header, skipping: '{line_content[:50]}...'")
-
-
-    if not model_input_parts:
-        print(f"Error: No valid AGENT/PATIENT lines found in {TRANSCRIPT_FILENAME}. Exiting.")
-        # exit() # Or raise an error
-    else:
-        print(f"Processed {dialogue_segment_count} dialogue segments for model input.")
-        final_model_input_text = " ".join(model_input_parts)
-        print("\nFormatted text for Dia model (first 200 chars):")
-        print(final_model_input_text[:200] + "...")
-
-        print("\nLoading Dia model...")
-        # You can explicitly move the model to CPU if you don't have a GPU or want to force CPU
-        # device = "cuda" if torch.cuda.is_available() else "cpu"
-        # model = Dia.from_pretrained("nari-labs/Dia-1.6B").to(device)
-        # print(f"Model will run on {device}.")
-        model = Dia.from_pretrained("nari-labs/Dia-1.6B") # Dia might handle device placement
-        print("Model loaded.")
-        if torch.cuda.is_available() and hasattr(model, 'parameters') and next(model.parameters(), None) is not None:
-             print(f"Model is on device: {next(model.parameters()).device}")
-
-
-        print("\nGenerating audio... (This may take a moment, especially on CPU)")
-        output_audio_data = model.generate(final_model_input_text)
-        print("Audio generated.")
-
-        OUTPUT_FILENAME = "dialogue_output.mp3"
-        SAMPLE_RATE = 44100 # Dia model default is 44.1kHz
-        sf.write(OUTPUT_FILENAME, output_audio_data, SAMPLE_RATE)
-        print(f"\nAudio saved as {OUTPUT_FILENAME}")
-
-except FileNotFoundError:
-    # This specific error is less likely now with the os.path.exists check, but good to keep.
-    print(f"Error: Transcript file not found at {TRANSCRIPT_FILENAME}.")
-except torch.cuda.OutOfMemoryError as e:
-    print(f"CUDA Out of Memory Error: {e}")
-    print("Try restarting the kernel/script and running again. If it persists, the model might be too large for the available GPU memory.")
+# Dia speaker tags for our script labels
+SPEAKER_TAGS = {"AGENT": "[S1]", "PATIENT": "[S2]"}
+
+
+def load_dialogue_turns(transcript_path: str) -> List[Dict[str, Any]]:
+    """Reads an AGENT/PATIENT script and returns its turns (see parse_dialogue_lines)."""
+    with open(transcript_path, 'r', encoding='utf-8') as f:
+        return parse_dialogue_lines(f.readlines(), list(SPEAKER_TAGS))
+
+
+def build_dia_input(turns: List[Dict[str, Any]]) -> str:
+    """Joins dialogue turns into Dia's "[S1] ... [S2] ..." input format."""
+    return " ".join(f"{SPEAKER_TAGS[turn['speaker']]} {turn['text']}" for turn in turns)
+
+
+def select_device(requested: str = "auto") -> str:
+    """Resolves "auto" to "cuda" when a GPU is available, otherwise "cpu"."""
+    if requested == "auto":
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return requested
+
+
+def select_compute_dtype(device: str, requested: str = "auto", quantize: bool = False) -> str:
+    """
+    Picks the compute dtype for Dia.
+
+    float16 is only fast on GPUs; on CPU it is emulated and slower than float32.
+    bfloat16 is used on CPUs with native support (AVX-512 BF16 / AMX), float32
+    otherwise. Dynamic int8 quantization needs float32 weights.
+    """
+    if quantize:
+        return "float32"
+    if requested != "auto":
+        if device == "cpu" and requested == "float16":
+            print("Warning: float16 is very slow on CPU, using float32 instead.")
+            return "float32"
+        return requested
+    if device == "cuda":
+        return "float16"
+    import torch
+    capability = ""
+    if hasattr(torch.backends, "cpu") and hasattr(torch.backends.cpu, "get_cpu_capability"):
+        capability = torch.backends.cpu.get_cpu_capability()
+    return "bfloat16" if "AVX512" in capability or "AMX" in capability else "float32"
+
+
+def quantize_dia_int8(model):
+    """
+    Applies dynamic int8 quantization to the nn.Linear layers of the Dia network.
+    Weights are stored as int8 and activations quantized on the fly, which cuts
+    memory and speeds up matmuls on CPU. Layers that are not nn.Linear are left as-is.
+    """
+    import torch
+    network = getattr(model, "model", model)
+    linear_count = sum(1 for m in network.modules() if isinstance(m, torch.nn.Linear))
+    if linear_count == 0:
+        print("Warning: no nn.Linear layers found to quantize; running unquantized.")
+        return model
+    quantized = torch.ao.quantization.quantize_dynamic(network, {torch.nn.Linear}, dtype=torch.qint8)
+    if network is model:
+        return quantized
+    model.model = quantized
+    print(f"Applied dynamic int8 quantization to {linear_count} Linear layer(s).")
+    return model
+
+
+def load_dia_model(device: str | None = None, compute_dtype: str | None = None,
+                   quantize: bool | None = None, num_threads: int | None = None):
+    """
+    Loads the Dia model (the expensive step - do this once per process).
+
+    Arguments default to the DIA_* settings in config.py.
+
+    Args:
+        device: "auto", "cuda" or "cpu".
+        compute_dtype: "auto", "float32", "bfloat16" or "float16".
+        quantize: Apply dynamic int8 quantization (CPU only).
+        num_threads: Intra-op thread count for CPU inference (0 = PyTorch default).
+    """
+    import torch
+    from dia.model import Dia
+    import code.config as config
+    device = select_device(device or config.DIA_DEVICE)
+    quantize = config.DIA_QUANTIZE_INT8 if quantize is None else quantize
+    if quantize and device != "cpu":
+        print("Warning: int8 dynamic quantization is CPU-only, ignoring it on GPU.")
+        quantize = False
+    compute_dtype = select_compute_dtype(device, compute_dtype or config.DIA_COMPUTE_DTYPE, quantize)
+    num_threads = config.DIA_NUM_THREADS if num_threads is None else num_threads
+    if device == "cpu" and num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    print(f"\nLoading Dia model on {device} ({compute_dtype}{', int8 dynamic' if quantize else ''}, "
+          f"{torch.get_num_threads()} CPU thread(s))...")
+    with span("tts_load", engine="dia", device=device, compute_dtype=compute_dtype):
+        model = Dia.from_pretrained(DIA_MODEL_ID, compute_dtype=compute_dtype, device=torch.device(device))
+        if quantize:
+            model = quantize_dia_int8(model)
+    print("Model loaded.")
+    return model
+
+
+def seed_dia(seed: int) -> None:
+    """Resets the Python, numpy and torch RNGs that Dia samples from (see config.DIA_SEED)."""
+    import random
+    import numpy as np
+    import torch
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
     if torch.cuda.is_available():
-        print(f"GPU Name: {torch.cuda.get_device_name(0)}")
-        print(f"Total GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB")
-        print(f"Allocated GPU Memory: {torch.cuda.memory_allocated(0) / 1e9:.2f} GB")
-        print(f"Cached GPU Memory: {torch.cuda.memory_reserved(0) / 1e9:.2f} GB")
-except ImportError as e:
-    print(f"ImportError: {e}. Please ensure all required libraries are installed.")
-    print("You might need to run: pip install soundfile dia-tts torch torchaudio torchvision ipython")
-except Exception as e:
-    print(f"An unexpected error occurred: {e}")
-    traceback.print_exc()
-
-finally:
-    # Attempt to free memory after use (or if an error occurs)
-    if 'model' in locals() or 'model' in globals(): # Check both local and global scope
-        del model
-        print("Model deleted from memory.")
+        torch.cuda.manual_seed_all(seed)
+
+
+def resolve_seed(seed: int | None) -> int | None:
+    """The seed to use for unvoiced generation: `seed`, else config.DIA_SEED; None when unseeded (< 0)."""
+    import code.config as config
+    seed = config.DIA_SEED if seed is None else seed
+    return seed if seed >= 0 else None
+
+
+def _generate_cached(model_loader, text: str, cache, use_torch_compile: bool, voice=None, seed: int | None = None):
+    """
+    Generates (or fetches from the cache) the audio for one Dia input string.
+    With a registered `voice` (see voice_registry.load_voice) the output is
+    cloned from its stored prompt tokens; no reference audio is processed.
+    Without one, `seed` (if not None) is set right before generating, so
+    separate calls get the same speaker voices.
+    """
+    import soundfile as sf
+    if voice:
+        voice_id = f"{voice['name']}:{voice['content_hash'][:16]}"
+    else:
+        voice_id = f"seed-{seed}" if seed is not None else "default"
+    cached_wav = cache.get("dia", voice_id, DIA_MODEL_ID, text) if cache else None
+    if cached_wav is not None:
+        audio, _ = sf.read(io.BytesIO(cached_wav), dtype="float32")
+        return audio, 0.0, True
+    model = model_loader()
+    start = time.perf_counter()
+    if voice:
+        device = getattr(model, "device", None)
+        codes = voice["codes"].to(device) if device is not None else voice["codes"]
+        audio = model.generate(voice["transcript"] + text, audio_prompt=codes,
+                               use_torch_compile=use_torch_compile, verbose=False)
+    else:
+        if seed is not None:
+            seed_dia(seed)
+        audio = model.generate(text, use_torch_compile=use_torch_compile)
+    seconds = time.perf_counter() - start
+    if cache:
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, SAMPLE_RATE, format="WAV")
+        cache.put("dia", voice_id, DIA_MODEL_ID, text, buffer.getvalue())
+    return audio, seconds, False
+
+
+def _load_registered_voice(voice_name: str | None):
+    if not voice_name:
+        return None
+    import code.config as config
+    from code.voice_registry import load_voice
+    print(f"Using registered voice '{voice_name}'.")
+    return load_voice(voice_name, config.VOICE_REGISTRY_DIR)
+
+
+def _save_output(audio, output_path: str, encoder=None) -> Dict[str, Any]:
+    """
+    Writes the rendered call, or hands it to the background archive encoder.
+
+    Returns:
+        {'output': path} when written directly, or {'encoding': Future} that
+        resolves to the encoder's report (see audio_encoder.ArchiveEncoder).
+    """
+    if encoder is None:
+        import soundfile as sf
+        sf.write(output_path, audio, SAMPLE_RATE)
+        print(f"\nAudio saved as {output_path}")
+        return {"output": output_path}
+    print(f"\nQueued {output_path} for {encoder.codec} archive encoding.")
+    return {"encoding": encoder.submit(audio, SAMPLE_RATE, output_path)}
+
+
+def render_script_segmented(model_loader, transcript_path: str, output_path: str, cache=None,
+                            use_torch_compile: bool = False, max_segment_seconds: float = 10.0,
+                            voice_name: str | None = None, encoder=None, seed: int | None = None) -> Dict[str, Any]:
+    """
+    Renders a script sentence group by sentence group instead of as one giant input.
+
+    Every segment stays well inside Dia's context window, so generation time
+    per request is bounded and quality does not degrade on long calls. The
+    segments are stitched with pauses (short between sentences, longer
+    between turns), and each one is cached on its own, so repeated greetings
+    and disclosures are only ever generated once.
+
+    Every segment is a separate generate() call, so speakers only keep their
+    voice with a registered voice or a fixed seed; render_script falls back
+    to whole-script rendering when there is neither.
+
+    Returns:
+        Same shape as `render_script`, plus 'segments'.
+    """
+    from code.audio_stitch import stitch_clips
+    turns = load_dialogue_turns(transcript_path)
+    if not turns:
+        raise ValueError(f"No valid AGENT/PATIENT lines found in {transcript_path}.")
+    segments = segment_dialogue(turns, max_segment_seconds)
+    voice = _load_registered_voice(voice_name)
+    print(f"Split {len(turns)} dialogue turn(s) into {len(segments)} segment(s) of at most ~{max_segment_seconds:.0f}s.")
+
+    clips, synthesis_seconds, hits = [], 0.0, 0
+    for segment in segments:
+        text = f"{SPEAKER_TAGS[segment['speaker']]} {segment['text']}"
+        print(f" - Segment {segment['index']+1}/{len(segments)} (line {segment['line']+1}): '{segment['text'][:50]}...'")
+        audio, seconds, cached = _generate_cached(model_loader, text, cache, use_torch_compile, voice, seed)
+        clips.append(audio)
+        synthesis_seconds += seconds
+        hits += cached
+
+    output_audio_data = stitch_clips(clips, SAMPLE_RATE, pauses_ms=[s["pause_after_ms"] for s in segments])
+    print(f"{hits}/{len(segments)} segment(s) came from the TTS cache.")
+    return {
+        "audio_seconds": len(output_audio_data) / SAMPLE_RATE,
+        "synthesis_seconds": synthesis_seconds,
+        "cached": hits == len(segments),
+        "segments": len(segments),
+        **_save_output(output_audio_data, output_path, encoder),
+    }
+
+
+def render_script(model_loader, transcript_path: str, output_path: str, cache=None,
+                  use_torch_compile: bool = False, max_segment_seconds: float = 0.0,
+                  voice_name: str | None = None, encoder=None, seed: int | None = None) -> Dict[str, Any]:
+    """
+    Renders one AGENT/PATIENT script to an audio file with Dia.
+
+    Args:
+        model_loader: Zero-argument callable returning the loaded model. It is
+            only called on a cache miss, so cached scripts never load the model.
+        transcript_path: Path of the ideal call script.
+        output_path: Where to write the audio.
+        cache: Optional AudioCache for whole-script reuse.
+        use_torch_compile: Let Dia compile its decoder step (slow first call).
+        max_segment_seconds: If > 0, render sentence-sized segments instead
+            of the whole script at once (see render_script_segmented).
+        voice_name: Registered voice to clone (see voice_registry.py).
+        encoder: Optional audio_encoder.ArchiveEncoder. The audio is then
+            encoded in the background and `output_path`'s extension is
+            replaced by the codec's.
+        seed: Seed for rendering without a voice (default: config.DIA_SEED,
+            < 0 = unseeded). Segmented rendering needs a voice or a seed.
+
+    Returns:
+        A dict with 'audio_seconds', 'synthesis_seconds' (0 on a cache hit),
+        'cached', and either 'output' (file written) or 'encoding' (a Future
+        resolving to the archive encoder's report).
+    """
+    seed = resolve_seed(seed)
+    if max_segment_seconds > 0 and not voice_name and seed is None:
+        print("Rendering the whole script in one pass: segments would each get different speaker voices "
+              "without a registered voice or DIA_SEED.")
+        max_segment_seconds = 0.0
+    if max_segment_seconds > 0:
+        return render_script_segmented(model_loader, transcript_path, output_path, cache,
+                                       use_torch_compile, max_segment_seconds, voice_name, encoder, seed)
+
+    turns = load_dialogue_turns(transcript_path)
+    if not turns:
+        raise ValueError(f"No valid AGENT/PATIENT lines found in {transcript_path}.")
+    print(f"Processed {len(turns)} dialogue segments for model input.")
+    final_model_input_text = build_dia_input(turns)
+    print("\nFormatted text for Dia model (first 200 chars):")
+    print(final_model_input_text[:200] + "...")
+
+    # A previously rendered identical script is served from the TTS cache without loading the model
+    print("\nGenerating audio... (This may take a moment, especially on CPU)")
+    output_audio_data, synthesis_seconds, cached = _generate_cached(model_loader, final_model_input_text,
+                                                                    cache, use_torch_compile,
+                                                                    _load_registered_voice(voice_name), seed)
+    sample_rate = SAMPLE_RATE
+    print("Found this script in the TTS cache." if cached else "Audio generated.")
+
+    return {
+        "audio_seconds": len(output_audio_data) / sample_rate,
+        "synthesis_seconds": synthesis_seconds,
+        "cached": cached,
+        **_save_output(output_audio_data, output_path, encoder),
+    }
+
+
+if __name__ == "__main__":
+    import torch # For CUDA cache clearing
+
+    # --- Pre-run check for the transcript file ---
+    if not os.path.exists(TRANSCRIPT_FILENAME):
+        print(f"Error: The required transcript file '{TRANSCRIPT_FILENAME}' was not found in the current directory.")
+        print(f"Please make sure the file exists and contains the dialogue content.")
+        # You might want to exit the script here if the file is essential
+        exit()
+    else:
+        print(f"Using existing transcript file: '{TRANSCRIPT_FILENAME}'")
+
+    # Clear CUDA cache before loading the model
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
-        print("CUDA cache cleared at the end.")
+        print("CUDA cache cleared before model loading.")
     else:
-        print("No CUDA GPU was used or available for final cache clearing.")
\ No newline at end of file
+        print("No CUDA GPU detected. Running on CPU; see the DIA_* settings in config.py (dtype, int8, threads).")
+
+    print(f"\nLoading transcript from: {TRANSCRIPT_FILENAME}")
+    loaded = {}
+
+    def _load_once():
+        if "model" not in loaded:
+            loaded["model"] = load_dia_model()
+        return loaded["model"]
+
+    cache = open_default_cache()
+    encoder = open_default_encoder()
+    try:
+        import code.config as config
+        with span("tts", engine="dia"):
+            render_script(_load_once, TRANSCRIPT_FILENAME, OUTPUT_FILENAME, cache,
+                          use_torch_compile=config.DIA_USE_TORCH_COMPILE,
+                          max_segment_seconds=config.TTS_SEGMENT_MAX_SECONDS,
+                          encoder=encoder)
+        print_cache_stats(cache)
+        if encoder:
+            encoder.shutdown()
+            encoder.print_summary()
+    except FileNotFoundError:
+        # This specific error is less likely now with the os.path.exists check, but good to keep.
+        print(f"Error: Transcript file not found at {TRANSCRIPT_FILENAME}.")
+    except ValueError as e:
+        print(f"Error: {e} Exiting.")
+    except torch.cuda.OutOfMemoryError as e:
+        print(f"CUDA Out of Memory Error: {e}")
+        print("Try restarting the kernel/script and running again. If it persists, the model might be too large for the available GPU memory.")
+        if torch.cuda.is_available():
+            print(f"GPU Name: {torch.cuda.get_device_name(0)}")
+            print(f"Total GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB")
+            print(f"Allocated GPU Memory: {torch.cuda.memory_allocated(0) / 1e9:.2f} GB")
+            print(f"Cached GPU Memory: {torch.cuda.memory_reserved(0) / 1e9:.2f} GB")
+    except MemoryError:
+        # CPU-only nodes: host RAM ran out (if the OOM killer didn't get there first)
+        from code.profiling import max_rss_mb
+        peak = max_rss_mb()
+        print(f"Out of host memory{f' (peak RSS {peak / 1024:.2f} GB)' if peak else ''}. Try DIA_QUANTIZE_INT8=1 "
+              f"or a shorter TTS_SEGMENT_MAX_SECONDS; rerun with PROFILE_DIR=profile to see which stage peaks.")
+    except ImportError as e:
+        print(f"ImportError: {e}. Please ensure all required libraries are installed.")
+        print("You might need to run: pip install soundfile dia-tts torch torchaudio torchvision")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        traceback.print_exc()
+
+    finally:
+        # Per-stage time/memory report when run with PROFILE_DIR set (see profiling.py)
+        from code.profiling import finish as finish_profiling
+        finish_profiling()
+        # Attempt to free memory after use (or if an error occurs)
+        if loaded:
+            loaded.clear()
+            print("Model deleted from memory.")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            print("CUDA cache cleared at the end.")
+        else:
+            print("No CUDA GPU was used or available for final cache clearing.")
@@ -0,0 +1,374 @@
+# pipeline.py
+# Producer/consumer pipeline over the call stages: STT (Whisper) -> LLM (diarize, analyze,
+# ideal call via Gemini) -> TTS (ideal call audio), with a bounded queue between stages.
+#
+# Each stage has its own worker count and executor: CPU-bound stages (Whisper, Dia) run in
+# worker processes that load their model once, network-bound stages (Gemini, ElevenLabs)
+# run in threads. Stage workers are asyncio tasks, so while call N+1 is being transcribed,
+# call N is analyzed and call N-1 synthesized. A full queue blocks the stage before it, so
+# memory stays bounded however many calls are queued. At the end, per-stage utilization
+# (busy / starved / blocked share) shows which stage is the bottleneck.
+#
+# Usage (from the repository root):
+#   python -m code.pipeline calls/*.wav transcripts/ [--stt-workers 1] [--llm-workers 8] [--tts-workers 2]
+#   python -m code.pipeline Calls_Generated/ --dry-run        # local LLM stub + placeholder TTS engine
+import argparse
+import asyncio
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import code.config as config
+from code.results_store import call_id_for
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg")
+_DONE = object() # End-of-input marker passed down the queues
+
+
+class Stage:
+    """
+    One pipeline stage.
+
+    Args:
+        name: Shown in the utilization report.
+        fn: Item -> item for the next stage (or None to drop it as failed).
+            Must be a picklable top-level function for "process" stages.
+        workers: Items processed concurrently.
+        kind: "process" (CPU-bound; a process pool) or "thread" (I/O-bound).
+        when: Optional predicate; items it rejects skip this stage.
+        initializer, initargs: Run once per worker process (e.g. load a model).
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Dict[str, Any] | None], workers: int = 1,
+                 kind: str = "thread", when: Callable[[Dict[str, Any]], bool] | None = None,
+                 initializer: Callable | None = None, initargs: tuple = ()):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Stage kind must be 'process' or 'thread', not '{kind}'")
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.when = when
+        self.initializer = initializer
+        self.initargs = initargs
+        self.items = self.skipped = self.failed = 0
+        self.busy_seconds = self.starved_seconds = self.blocked_seconds = 0.0
+
+    def executor(self):
+        if self.kind == "process":
+            # spawn: CUDA and torch's thread pools don't survive fork
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=self.initializer, initargs=self.initargs)
+        return ThreadPoolExecutor(self.workers, thread_name_prefix=self.name,
+                                  initializer=self.initializer, initargs=self.initargs)
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        capacity = self.workers * wall_seconds or 1.0
+        return {
+            "stage": self.name, "kind": self.kind, "workers": self.workers,
+            "items": self.items, "skipped": self.skipped, "failed": self.failed,
+            "mean_seconds": round(self.busy_seconds / self.items, 3) if self.items else None,
+            "utilization": round(self.busy_seconds / capacity, 3), # Share of worker time spent working
+            "starved": round(self.starved_seconds / capacity, 3), # ... waiting for the previous stage
+            "blocked": round(self.blocked_seconds / capacity, 3), # ... waiting for room in the next queue
+        }
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded queues.
+
+    Args:
+        stages: In order.
+        queue_size: Items that may wait between two stages.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.results: List[Dict[str, Any]] = []
+        self.failures: List[Dict[str, Any]] = []
+        self.wall_seconds = 0.0
+
+    def run(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Processes every item; returns the items that made it through all stages."""
+        start = time.perf_counter()
+        try:
+            asyncio.run(self._run(items))
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+        return self.results
+
+    async def _run(self, items: List[Dict[str, Any]]) -> None:
+        loop = asyncio.get_running_loop()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [stage.workers for stage in self.stages]
+        executors = [stage.executor() for stage in self.stages]
+
+        async def feed():
+            for item in items:
+                await queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(_DONE)
+
+        async def work(i: int):
+            stage, executor = self.stages[i], executors[i]
+            next_queue = queues[i + 1] if i + 1 < len(self.stages) else None
+            while True:
+                waited = time.perf_counter()
+                item = await queues[i].get()
+                stage.starved_seconds += time.perf_counter() - waited
+                if item is _DONE:
+                    break
+                if stage.when is not None and not stage.when(item):
+                    stage.skipped += 1
+                    result = item
+                else:
+                    started = time.perf_counter()
+                    try:
+                        result = await loop.run_in_executor(executor, _run_in_call_context, stage.fn, item)
+                        error = None if result is not None else "stage returned no result"
+                    except Exception as e:
+                        result, error = None, f"{type(e).__name__}: {e}"
+                    stage.busy_seconds += time.perf_counter() - started
+                    stage.items += 1
+                    if error:
+                        stage.failed += 1
+                        self.failures.append({"call_id": item.get("call_id"), "stage": stage.name, "error": error})
+                        print(f"Pipeline: '{item.get('call_id')}' failed in {stage.name}: {error}")
+                        continue
+                if next_queue is None:
+                    self.results.append(result)
+                    print(f"Pipeline: '{result.get('call_id')}' done ({len(self.results) + len(self.failures)}/{len(items)}).")
+                else:
+                    waited = time.perf_counter()
+                    await next_queue.put(result)
+                    stage.blocked_seconds += time.perf_counter() - waited
+            # The last worker of a stage tells the next stage's workers that no more input is coming
+            remaining[i] -= 1
+            if remaining[i] == 0 and next_queue is not None:
+                for _ in range(self.stages[i + 1].workers):
+                    await next_queue.put(_DONE)
+
+        try:
+            await asyncio.gather(feed(), *(work(i) for i, stage in enumerate(self.stages) for _ in range(stage.workers)))
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+    def report(self) -> Dict[str, Any]:
+        return {"wall_seconds": round(self.wall_seconds, 2), "completed": len(self.results),
+                "failed": len(self.failures), "stages": [stage.report(self.wall_seconds) for stage in self.stages],
+                "failures": self.failures}
+
+    def print_report(self) -> None:
+        report = self.report()
+        rate = report["completed"] / report["wall_seconds"] * 60 if report["wall_seconds"] else 0.0
+        print(f"\n--- Pipeline: {report['completed']} call(s) done, {report['failed']} failed "
+              f"in {report['wall_seconds']:.1f}s ({rate:.1f} calls/min) ---")
+        print(f"{'stage':<6} {'kind':<8} {'workers':>7} {'items':>6} {'mean s':>7} {'busy':>6} {'starved':>8} {'blocked':>8}")
+        for row in report["stages"]:
+            mean = f"{row['mean_seconds']:.2f}" if row["mean_seconds"] is not None else "-"
+            print(f"{row['stage']:<6} {row['kind']:<8} {row['workers']:>7} {row['items']:>6} {mean:>7} "
+                  f"{row['utilization']:>6.0%} {row['starved']:>8.0%} {row['blocked']:>8.0%}")
+        busiest = max(report["stages"], key=lambda row: row["utilization"], default=None)
+        if busiest and busiest["items"]:
+            print(f"Bottleneck: {busiest['stage']} ({busiest['utilization']:.0%} busy); "
+                  f"give it more workers before the others.")
+
+
+def _run_in_call_context(fn: Callable, item: Dict[str, Any]):
+    """Runs a stage function with its trace spans attributed to the item's call (in any worker)."""
+    from code.tracing import call_context
+    with call_context(item.get("call_id")):
+        return fn(item)
+
+
+# --- Call pipeline stages ---
+
+_whisper_model = None # One model per STT worker process
+
+
+def _init_stt_worker(model_size: str) -> None:
+    global _whisper_model
+    from code.stt_whisper import load_whisper_model
+    _whisper_model = load_whisper_model(model_size)
+
+
+def stt_stage(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Audio -> raw transcript text (runs in an STT worker process)."""
+    from code.stt_whisper import transcribe_audio
+    item["raw_transcript"] = transcribe_audio(_whisper_model, item["audio_path"])
+    return item
+
+
+def llm_stage(item: Dict[str, Any], generate=None, output_dir: str | None = None,
+              ideal_call: bool = True) -> Dict[str, Any] | None:
+    """Diarization (for STT output), analysis and ideal call text; everything that talks to Gemini."""
+    from code.main import generate_and_display_ideal_call, output_dir_for_call, output_path_for, run_analysis
+    from code.stt_whisper import diarize_transcript_with_gemini
+    from code.transcript_processor import load_transcript
+    text_generate = (lambda prompt: generate(prompt)[0]) if generate else None
+    output_dir = output_dir_for_call(output_dir, item.get("call_id"))
+
+    if "raw_transcript" in item:
+        formatted = diarize_transcript_with_gemini(item.pop("raw_transcript"), generate=text_generate)
+        if not formatted:
+            return None
+        item["transcript_path"] = output_path_for(item["audio_path"], "_diarized.txt", output_dir)
+        with open(item["transcript_path"], "w", encoding="utf-8") as f:
+            f.write(formatted)
+
+    analysis = run_analysis(item["transcript_path"], generate=generate, output_dir=output_dir, call_id=item["call_id"])
+    if not analysis:
+        return None
+    item["kpi_counts"] = {status: sum(1 for e in analysis["kpi_analysis"] if e["status"] == status)
+                          for status in ("Met", "Not Met", "N/A")}
+    if ideal_call:
+        item["ideal_call_text"] = generate_and_display_ideal_call(
+            load_transcript(item["transcript_path"]), analysis, item["transcript_path"],
+            generate=text_generate, output_dir=output_dir, with_audio=False)
+    return item
+
+
+_tts_router = None # One router per TTS worker process (a Dia engine keeps its model loaded)
+_tts_router_lock = threading.Lock() # Thread-kind TTS stages share a single router
+
+
+def _init_tts_worker(engines: str | None) -> None:
+    """Builds the TTS router once; `engines` overrides TTS_ENGINES (e.g. "stub" for dry runs)."""
+    global _tts_router
+    from code.tts_generator import build_engine, default_router
+    from code.tts_engines import TTSRouter
+    with _tts_router_lock:
+        if _tts_router is None:
+            _tts_router = (TTSRouter([e for e in (build_engine(name.strip()) for name in engines.split(",")) if e])
+                           if engines else default_router())
+
+
+def tts_stage(item: Dict[str, Any], engines: str | None = None, output_dir: str | None = None) -> Dict[str, Any] | None:
+    """Ideal call text -> audio, with the worker's router (see _init_tts_worker)."""
+    from code.main import output_dir_for_call, output_path_for
+    from code.tts_generator import generate_audio_from_script
+    if _tts_router is None:
+        _init_tts_worker(engines) # Called outside a pipeline worker
+    audio_path = output_path_for(item["transcript_path"], "_ideal_call_audio.mp3",
+                                 output_dir_for_call(output_dir, item.get("call_id")))
+    written_path = generate_audio_from_script(item["ideal_call_text"], audio_path, router=_tts_router)
+    if not written_path:
+        return None
+    item["audio_output"] = written_path
+    return item
+
+
+def discover_inputs(inputs: List[str]) -> List[Dict[str, Any]]:
+    """Audio files (start at STT) and transcripts (start at the LLM stage) from files, directories and globs."""
+    from code.batch import DERIVED_SUFFIXES, glob_root, make_call_ids_unique
+    paths = [] # (path, root the call ID is relative to)
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend((p, item) for p in sorted(glob.glob(os.path.join(item, "**", "*"), recursive=True))
+                         if os.path.isfile(p))
+        elif os.path.isfile(item):
+            paths.append((item, None))
+        else:
+            paths.extend((p, glob_root(item)) for p in sorted(glob.glob(item, recursive=True)) if os.path.isfile(p))
+    jobs, seen = [], set()
+    for path, root in paths:
+        key = os.path.abspath(path)
+        if key in seen or path.endswith(DERIVED_SUFFIXES) or path.endswith("_diarized.txt"):
+            continue
+        seen.add(key)
+        if path.lower().endswith(AUDIO_EXTENSIONS):
+            jobs.append({"call_id": call_id_for(path, root), "audio_path": path})
+        elif path.lower().endswith(".txt"):
+            jobs.append({"call_id": call_id_for(path, root), "transcript_path": path})
+    make_call_ids_unique(jobs, lambda job: job.get("audio_path") or job["transcript_path"])
+    return jobs
+
+
+def build_call_pipeline(stt_workers: int = 1, llm_workers: int = 8, tts_workers: int = 2, queue_size: int = 4,
+                        whisper_model: str = "base", generate=None, tts_engines: str | None = None,
+                        output_dir: str | None = None, synthesize: bool = True) -> Pipeline:
+    """
+    The STT -> LLM -> TTS pipeline. TTS runs in processes when Dia is the
+    first engine (CPU/GPU-bound), otherwise in threads (ElevenLabs is network-bound).
+    """
+    engines = tts_engines or config.TTS_ENGINES
+    stages = [
+        Stage("stt", stt_stage, stt_workers, kind="process", when=lambda item: "audio_path" in item,
+              initializer=_init_stt_worker, initargs=(whisper_model,)),
+        Stage("llm", functools.partial(llm_stage, generate=generate, output_dir=output_dir, ideal_call=synthesize),
+              llm_workers, kind="thread"),
+    ]
+    if synthesize:
+        tts_kind = "process" if engines.split(",")[0].strip() == "dia" else "thread"
+        stages.append(Stage("tts", functools.partial(tts_stage, engines=tts_engines, output_dir=output_dir),
+                            tts_workers, kind=tts_kind, when=lambda item: bool(item.get("ideal_call_text")),
+                            initializer=_init_tts_worker, initargs=(tts_engines,)))
+    return Pipeline(stages, queue_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run calls through the STT -> LLM -> TTS pipeline.")
+    parser.add_argument("inputs", nargs="+", help="Audio files, transcripts, directories or glob patterns.")
+    parser.add_argument("--stt-workers", type=int, default=config.PIPELINE_STT_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=config.PIPELINE_LLM_WORKERS)
+    parser.add_argument("--tts-workers", type=int, default=config.PIPELINE_TTS_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=config.PIPELINE_QUEUE_SIZE)
+    parser.add_argument("--whisper-model", default="base")
+    parser.add_argument("--no-tts", action="store_true", help="Stop after the analysis.")
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--report", default="pipeline_report.json", help="Where to write the utilization report.")
+    parser.add_argument("--dry-run", action="store_true", help="Local LLM stub and placeholder TTS engine (STT still uses Whisper).")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--trace", default=None, help="Append per-stage trace spans to this JSONL file (default: TRACE_PATH).")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port (default: METRICS_PORT).")
+    parser.add_argument("--profile", nargs="?", const="profile", default=None, metavar="DIR",
+                        help="Profile every stage (CPU samples, Python/RSS memory peaks) into DIR (default: profile/; setting PROFILE_DIR also enables it).")
+    args = parser.parse_args()
+    import code.profiling as profiling
+    from code.tracing import configure as configure_tracing
+    # Before the worker processes start, so they inherit TRACE_PATH / PROFILE_DIR
+    configure_tracing(args.trace, args.metrics_port)
+    profiling.configure(args.profile)
+
+    jobs = discover_inputs(args.inputs)
+    if not jobs:
+        print("No audio files or transcripts found.")
+        return
+    generate, tts_engines, output_dir = None, None, args.output_dir
+    if args.dry_run:
+        from code.llm_stub import LocalLLMStub
+        generate = LocalLLMStub(latency_seconds=args.stub_latency).generate_with_finish_reason
+        tts_engines, output_dir = "stub", output_dir or "dry_run_output"
+        # Keep stub analyses out of the real results store
+        config.RESULTS_DB_PATH = "dry_run_results.sqlite"
+    else:
+        try:
+            config.require("gemini")
+        except ValueError as e:
+            parser.error(str(e))
+
+    pipeline = build_call_pipeline(args.stt_workers, args.llm_workers, args.tts_workers, args.queue_size,
+                                   args.whisper_model, generate, tts_engines, output_dir, not args.no_tts)
+    print(f"Pipeline: {len(jobs)} call(s) through {' -> '.join(stage.name for stage in pipeline.stages)}")
+    try:
+        pipeline.run(jobs)
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+    pipeline.print_report()
+    profiling.finish() # The worker processes have exited and written their profiles by now
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(pipeline.report(), f, indent=2)
+    print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# profiling.py
+# Per-stage CPU and memory profiling (--profile): where time and memory go in each pipeline stage.
+#
+# When profiling is on, every tracing span (load, prompt_build, gemini, parse, retrieve,
+# stt_load, stt, tts_load, tts) is also profiled:
+#   - a sampling thread records the Python stack of every thread inside a stage every
+#     PROFILE_SAMPLE_INTERVAL seconds. Sampling works across worker threads and nested stages,
+#     where cProfile cannot be stacked, and costs the same whether a stage runs 1 ms or 10 min.
+#     The stacks are written in collapsed ("folded") format for flamegraph.pl / speedscope,
+#     with the open stages as the root frames (stage:llm;stage:gemini;...).
+#   - tracemalloc (Python objects and numpy arrays) and the resident set size are sampled too,
+#     so each stage gets the highest memory seen while it was running, and the largest
+#     allocation sites are captured whenever traced memory reaches a new high. torch tensors
+#     bypass tracemalloc, so for the Whisper and Dia stages the RSS columns are the real figure.
+#   - getrusage's max RSS before/after each span shows which stage raised the process peak
+#     (the OOM killer's view), and torch's CUDA peak is included when torch is loaded.
+# Every process (incl. the pipeline's spawned Whisper/Dia workers, which inherit PROFILE_DIR)
+# writes <dir>/<run>/process-<pid>.json/.folded at exit; the main process merges them into
+# report.json and flamegraph.folded.
+#
+# Usage:
+#   python -m code.pipeline recordings/ --profile profile/
+#   python -m code.main transcripts/ --dry-run --profile profile/
+#   PROFILE_DIR=profile python -m code.openSourceTTS
+#   python -m code.profiling profile/            # report of the latest run (e.g. after the service stops)
+#   flamegraph.pl profile/<run>/flamegraph.folded > flamegraph.svg
+import argparse
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List
+
+import code.config as config
+
+MB = 1024 * 1024
+MAX_STACK_DEPTH = 128
+SNAPSHOT_GROWTH = 1.1 # Allocation sites are captured when traced memory exceeds the last capture by 10%
+SNAPSHOT_MIN_BYTES = 16 * MB
+PEAK_SITES_KEPT = 3
+
+_start_lock = threading.Lock()
+_profiler = None # This process's Profiler while profiling is on
+
+
+def rss_mb() -> float | None:
+    """Current resident set size in MB (Linux; None elsewhere)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss_mb() -> float | None:
+    """Highest resident set size of this process so far in MB (getrusage; None on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, KiB elsewhere
+
+
+def _cuda_peak_mb() -> float | None:
+    torch = sys.modules.get("torch") # Only if a stage already loaded torch; never imported here
+    try:
+        return torch.cuda.max_memory_allocated() / MB if torch is not None and torch.cuda.is_available() else None
+    except Exception:
+        return None
+
+
+def _process_name() -> str:
+    multiprocessing = sys.modules.get("multiprocessing")
+    return multiprocessing.current_process().name if multiprocessing else "MainProcess"
+
+
+def _new_stage() -> Dict[str, Any]:
+    return {"spans": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "samples": 0, "py_peak_mb": 0.0,
+            "py_retained_mb": 0.0, "rss_peak_mb": 0.0, "max_rss_raised_mb": 0.0, "cuda_peak_mb": 0.0}
+
+
+class Profiler:
+    """
+    Stage-aware sampling profiler of one process.
+
+    Args:
+        run_dir: Directory shared by all processes of the run.
+        interval: Seconds between samples.
+        tracemalloc_frames: Allocation traceback depth; 0 disables tracemalloc.
+    """
+
+    def __init__(self, run_dir: str, interval: float = 0.01, tracemalloc_frames: int = 1):
+        self.run_dir = run_dir
+        self.interval = interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._active: Dict[int, List[str]] = {} # Thread ident -> open stages, outermost first
+        self._labels: Dict[Any, str] = {} # Code object -> frame label
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot_bytes = 0
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.peak_sites: List[Dict[str, Any]] = []
+
+    def start(self) -> "Profiler":
+        os.makedirs(self.run_dir, exist_ok=True)
+        if self.tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True, name="profiler")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    # --- Stage boundaries (called from tracing.span) ---
+
+    def enter(self, stage: str) -> Dict[str, Any]:
+        ident = threading.get_ident()
+        with self._lock:
+            self._active.setdefault(ident, []).append(stage)
+        return {"stage": stage, "ident": ident, "cpu": time.process_time(), "max_rss": max_rss_mb(),
+                "traced": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0}
+
+    def exit(self, token: Dict[str, Any], seconds: float, error: bool) -> Dict[str, float]:
+        """Closes a stage; returns its memory figures (added to the trace span)."""
+        with self._lock:
+            stack = self._active.get(token["ident"])
+            if stack:
+                stack.pop() # Spans are strictly nested within a thread
+            if not stack:
+                self._active.pop(token["ident"], None)
+        attrs: Dict[str, float] = {}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory() # Peak since the last sample
+            attrs["py_peak_mb"] = round(peak / MB, 1)
+            attrs["py_retained_mb"] = round((current - token["traced"]) / MB, 1)
+        rss, max_rss, cuda = rss_mb(), max_rss_mb(), _cuda_peak_mb()
+        if rss is not None:
+            attrs["rss_mb"] = round(rss, 1)
+        if max_rss is not None and token["max_rss"] is not None:
+            attrs["max_rss_raised_mb"] = round(max_rss - token["max_rss"], 1)
+        if cuda is not None:
+            attrs["cuda_peak_mb"] = round(cuda, 1)
+        # process_time() covers every thread of the process (incl. torch's intra-op threads),
+        # so stages running concurrently in one process share their CPU time
+        cpu = time.process_time() - token["cpu"]
+        with self._lock:
+            entry = self.stages.setdefault(token["stage"], _new_stage())
+            entry["spans"] += 1
+            entry["errors"] += int(error)
+            entry["wall_seconds"] += seconds
+            entry["cpu_seconds"] += cpu
+            entry["py_retained_mb"] += attrs.get("py_retained_mb", 0.0)
+            entry["max_rss_raised_mb"] += attrs.get("max_rss_raised_mb", 0.0)
+            for field, value in (("py_peak_mb", attrs.get("py_peak_mb")), ("rss_peak_mb", rss),
+                                 ("cuda_peak_mb", cuda)):
+                if value is not None:
+                    entry[field] = max(entry[field], value)
+        return attrs
+
+    # --- Sampling thread ---
+
+    def _label(self, code_object) -> str:
+        label = self._labels.get(code_object)
+        if label is None:
+            label = f"{code_object.co_name} ({os.path.basename(code_object.co_filename)}:{code_object.co_firstlineno})"
+            self._labels[code_object] = label
+        return label
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e: # A broken sample must never take the run down
+                print(f"Profiler: sample failed: {type(e).__name__}: {e}")
+
+    def _sample(self) -> None:
+        with self._lock:
+            active = {ident: list(stages) for ident, stages in self._active.items()}
+        frames = sys._current_frames()
+        stacks = []
+        for ident, stages in active.items():
+            frame, labels = frames.get(ident), []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stacks.append((stages, ";".join([f"stage:{stage}" for stage in stages] + labels[::-1])))
+        del frames # Frame references keep every local of every thread alive
+
+        traced = peak = 0
+        if tracemalloc.is_tracing():
+            traced, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak() # Each sample sees the peak of its own interval
+        rss = rss_mb()
+        running = {stage for stages in active.values() for stage in stages}
+        with self._lock:
+            self.samples += 1
+            for stages, key in stacks:
+                self.stacks[key] += 1
+                for stage in set(stages):
+                    self.stages.setdefault(stage, _new_stage())["samples"] += 1
+            for stage in running:
+                entry = self.stages.setdefault(stage, _new_stage())
+                entry["py_peak_mb"] = max(entry["py_peak_mb"], peak / MB)
+                if rss is not None:
+                    entry["rss_peak_mb"] = max(entry["rss_peak_mb"], rss)
+        if traced >= max(SNAPSHOT_MIN_BYTES, self._snapshot_bytes * SNAPSHOT_GROWTH):
+            self._capture_peak_sites(traced, sorted(running))
+
+    def _capture_peak_sites(self, traced: int, stages: List[str]) -> None:
+        """Largest allocation sites at a new traced-memory high (what to look at after an OOM)."""
+        self._snapshot_bytes = traced
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                              tracemalloc.Filter(False, __file__)])
+        sites = [{"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                  "size_mb": round(stat.size / MB, 1), "blocks": stat.count}
+                 for stat in snapshot.statistics("lineno")[:10]]
+        with self._lock:
+            self.peak_sites.append({"traced_mb": round(traced / MB, 1), "stages": stages,
+                                    "seconds": round(time.time() - self.started_at, 2), "sites": sites})
+            del self.peak_sites[:-PEAK_SITES_KEPT]
+
+    # --- Output ---
+
+    def write(self) -> str:
+        """Writes this process's profile (process-<pid>.json/.folded); returns the JSON path."""
+        with self._lock:
+            data = {"pid": os.getpid(), "process": _process_name(), "argv": sys.argv, "interval": self.interval,
+                    "seconds": round(time.time() - self.started_at, 2), "samples": self.samples,
+                    "max_rss_mb": max_rss_mb(), "cuda_peak_mb": _cuda_peak_mb(),
+                    "stages": {stage: dict(entry) for stage, entry in self.stages.items()},
+                    "peak_sites": list(self.peak_sites)}
+            stacks = dict(self.stacks)
+        base = os.path.join(self.run_dir, f"process-{os.getpid()}")
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            f.writelines(f"{key} {count}\n" for key, count in stacks.items())
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        return base + ".json"
+
+
+def _start() -> Profiler:
+    global _profiler
+    with _start_lock:
+        if _profiler is None:
+            # One run id for the whole process tree: spawned workers inherit it with PROFILE_DIR
+            run = os.environ.setdefault("PROFILE_RUN", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+            _profiler = Profiler(os.path.join(config.PROFILE_DIR, run), config.PROFILE_SAMPLE_INTERVAL,
+                                 config.PROFILE_TRACEMALLOC_FRAMES).start()
+            atexit.register(_write_at_exit)
+            print(f"Profiling stages into {_profiler.run_dir}/ (every {_profiler.interval * 1000:.0f} ms"
+                  f"{', with tracemalloc' if tracemalloc.is_tracing() else ''}).")
+    return _profiler
+
+
+def _write_at_exit() -> None:
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler.write()
+
+
+def configure(profile_dir: str | None = None) -> None:
+    """
+    Turns profiling on for this run (the --profile flag); call it before
+    worker processes start, they inherit PROFILE_DIR and the run id.
+    """
+    if not profile_dir:
+        return
+    config.PROFILE_DIR = profile_dir
+    os.environ["PROFILE_DIR"] = profile_dir
+    _start()
+
+
+def stage_started(stage: str) -> Dict[str, Any] | None:
+    """Opens a profiled stage (tracing.span); None when profiling is off."""
+    profiler = _profiler or (_start() if config.PROFILE_DIR else None)
+    return profiler.enter(stage) if profiler is not None else None
+
+
+def stage_finished(token: Dict[str, Any], seconds: float, error: bool) -> Dict[str, float]:
+    return _profiler.exit(token, seconds, error) if _profiler is not None else {}
+
+
+def finish() -> Dict[str, Any] | None:
+    """
+    Stops profiling in this process, merges the profiles of every process of
+    the run and prints the per-stage report. Call it from the main process
+    once the workers have exited; no-op when profiling is off.
+    """
+    if _profiler is None:
+        return None
+    _profiler.stop()
+    _profiler.write()
+    report = merge_run(_profiler.run_dir)
+    print_report(report)
+    return report
+
+
+# --- Run report (merges the processes of one run) ---
+
+def merge_run(run_dir: str) -> Dict[str, Any]:
+    """Merges process-*.json/.folded into report.json and flamegraph.folded; returns the report."""
+    processes, stages, stacks, peak_sites = [], {}, Counter(), []
+    for path in sorted(glob.glob(os.path.join(run_dir, "process-*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        processes.append({key: data[key] for key in ("pid", "process", "seconds", "samples", "max_rss_mb", "cuda_peak_mb")})
+        for stage, entry in data["stages"].items():
+            merged = stages.setdefault(stage, _new_stage())
+            for field, value in entry.items():
+                merged[field] = max(merged[field], value) if field.endswith("peak_mb") else merged[field] + value
+        peak_sites += [dict(sites, pid=data["pid"]) for sites in data["peak_sites"]]
+        folded = path[:-len(".json")] + ".folded"
+        if os.path.exists(folded):
+            with open(folded, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, _, count = line.rstrip("\n").rpartition(" ")
+                    if key:
+                        stacks[key] += int(count)
+
+    # Hottest functions per stage: the leaf frame of every sample, under the innermost open stage
+    hot: Dict[str, Counter] = {}
+    for key, count in stacks.items():
+        frames = key.split(";")
+        stage = [frame for frame in frames if frame.startswith("stage:")][-1][len("stage:"):]
+        if not frames[-1].startswith("stage:"):
+            hot.setdefault(stage, Counter())[frames[-1]] += count
+    rows = []
+    for stage, entry in stages.items():
+        total = sum(hot.get(stage, Counter()).values())
+        rows.append({"stage": stage, **{field: round(value, 3) if isinstance(value, float) else value
+                                        for field, value in entry.items()},
+                     "hot_functions": [{"function": function, "share": round(count / total, 3)}
+                                       for function, count in hot.get(stage, Counter()).most_common(5)]})
+    rows.sort(key=lambda row: row["wall_seconds"], reverse=True)
+    peak_sites.sort(key=lambda sites: sites["traced_mb"], reverse=True)
+    report = {"run_dir": run_dir, "processes": processes, "stages": rows, "peak_sites": peak_sites[:PEAK_SITES_KEPT],
+              "flamegraph": os.path.join(run_dir, "flamegraph.folded")}
+    with open(report["flamegraph"], "w", encoding="utf-8") as f:
+        f.writelines(f"{key} {count}\n" for key, count in sorted(stacks.items()))
+    with open(os.path.join(run_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    def mb(value) -> str:
+        return f"{value:.0f}" if value else "-"
+
+    print(f"\n--- Profile: {report['run_dir']} ---")
+    for process in report["processes"]:
+        print(f"  {process['process']} (pid {process['pid']}): {process['seconds']:.1f}s, "
+              f"max RSS {mb(process['max_rss_mb'])} MB" +
+              (f", CUDA peak {mb(process['cuda_peak_mb'])} MB" if process.get("cuda_peak_mb") else ""))
+    print(f"\n{'stage':<13}{'spans':>6}{'wall s':>9}{'cpu s':>9}{'samples':>9}{'py peak MB':>12}"
+          f"{'py kept MB':>12}{'RSS peak MB':>13}{'+max RSS MB':>13}{'CUDA MB':>9}")
+    for row in report["stages"]:
+        print(f"{row['stage']:<13}{row['spans']:>6}{row['wall_seconds']:>9.2f}{row['cpu_seconds']:>9.2f}"
+              f"{row['samples']:>9}{mb(row['py_peak_mb']):>12}{row['py_retained_mb']:>12.1f}"
+              f"{mb(row['rss_peak_mb']):>13}{row['max_rss_raised_mb']:>13.1f}{mb(row['cuda_peak_mb']):>9}")
+    for row in report["stages"]:
+        if row["hot_functions"]:
+            print(f"\nHottest in {row['stage']} (share of its samples):")
+            for hot in row["hot_functions"]:
+                print(f"  {hot['share']:>6.1%}  {hot['function']}")
+    if report["peak_sites"]:
+        top = report["peak_sites"][0]
+        print(f"\nLargest allocation sites at {top['traced_mb']:.0f} MB traced "
+              f"(pid {top['pid']}, during {', '.join(top['stages']) or 'no stage'}):")
+        for site in top["sites"][:5]:
+            print(f"  {site['size_mb']:>8.1f} MB  {site['site']}")
+    print(f"\nFlamegraph stacks: {report['flamegraph']} (flamegraph.pl or speedscope)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and print the per-stage profile of a --profile run.")
+    parser.add_argument("profile_dir", help="Directory given to --profile / PROFILE_DIR.")
+    parser.add_argument("--run", default=None, help="Run id (subdirectory); default: the latest run.")
+    args = parser.parse_args()
+
+    runs = [args.run] if args.run else sorted((run for run in os.listdir(args.profile_dir)
+                                              if os.path.isdir(os.path.join(args.profile_dir, run))),
+                                             key=lambda run: os.path.getmtime(os.path.join(args.profile_dir, run)))
+    if not runs:
+        parser.error(f"No profiled runs in {args.profile_dir}.")
+    print_report(merge_run(os.path.join(args.profile_dir, runs[-1])))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,39 @@
 # prompt_builder.py
 from typing import List, Dict, Any
 import code.config as config # Import config to get speaker labels
+from code.kpis import KPI_STATUS_CODES
 
-def build_analysis_prompt(transcript: str, kpis: List[str]) -> str:
+def build_analysis_prompt(transcript: str, kpis: List[str], compact: bool = False) -> str:
     """
     Builds the prompt for Gemini analysis, incorporating transcript and KPIs.
 
     Args:
         transcript: The full call transcript string (with speaker labels).
         kpis: A list of KPI questions.
+        compact: Use the KPI-ID protocol: KPIs are numbered and the model
+            answers each with a short [id, status code, reason] array instead
+            of repeating the KPI sentence (see analysis_parser.expand_compact_analysis).
 
     Returns:
         The formatted prompt string ready for the Gemini API.
     """
-    kpi_string = "\n".join([f"- {kpi}" for kpi in kpis])
+    if compact:
+        kpi_string = "\n".join([f"{i}. {kpi}" for i, kpi in enumerate(kpis, start=1)])
+        codes = ", ".join(f'"{code}" = {status}' for code, status in KPI_STATUS_CODES.items())
+        kpi_structure = f"""      "kpis": [
+        [1, "M", "Brief justification based on the agent's dialogue in the transcript."]
+        // ... one [KPI number, status code, reason] array per KPI, status codes: {codes}
+      ],"""
+    else:
+        kpi_string = "\n".join([f"- {kpi}" for kpi in kpis])
+        kpi_structure = """      "kpi_analysis": [
+        {
+          "kpi": "KPI text (e.g., Did the representative introduce themselves?)",
+          "status": "Met | Not Met | N/A",
+          "reason": "Brief justification based on the agent's dialogue in the transcript."
+        }
+        // ... include one entry for each KPI from the list above
+      ],"""
 
     # Instructions clearly stating the agent and patient labels from config
     prompt = f"""
@@ -37,14 +57,7 @@ def build_analysis_prompt(transcript: str, kpis: List[str]) -> str:
     **Requested JSON Output Structure:**
     ```json
     {{
-      "kpi_analysis": [
-        {{
-          "kpi": "KPI text (e.g., Did the representative introduce themselves?)",
-          "status": "Met | Not Met | N/A",
-          "reason": "Brief justification based on the agent's dialogue in the transcript."
-        }}
-        // ... include one entry for each KPI from the list above
-      ],
+{kpi_structure}
       "overall_assessment": {{
         "summary": "A brief overall summary of the agent's performance.",
         "strengths": [
@@ -72,6 +85,78 @@ def build_analysis_prompt(transcript: str, kpis: List[str]) -> str:
     return prompt
 
 
+def build_analysis_continuation_prompt(analysis_prompt: str, completed_kpis: List[str],
+                                       remaining_kpis: List[str], need_overall_assessment: bool,
+                                       kpi_ids: Dict[str, int] | None = None) -> str:
+    """
+    Builds the follow-up prompt used when an analysis response was cut off
+    at the output-token limit. It repeats the original prompt and asks only
+    for the part that was not received, in the same JSON structure.
+
+    Args:
+        analysis_prompt: The original prompt from build_analysis_prompt.
+        completed_kpis: KPIs that already have a complete entry.
+        remaining_kpis: KPIs still to be analyzed, in checklist order.
+        need_overall_assessment: Whether "overall_assessment" is still missing.
+        kpi_ids: KPI text -> number, when the original prompt used the
+            compact KPI-ID protocol.
+
+    Returns:
+        The continuation prompt string.
+    """
+    if kpi_ids:
+        remaining_string = "\n".join([f"{kpi_ids[kpi]}. {kpi}" for kpi in remaining_kpis]) if remaining_kpis else "None."
+        list_key = "kpis"
+    else:
+        remaining_string = "\n".join([f"- {kpi}" for kpi in remaining_kpis]) if remaining_kpis else "None."
+        list_key = "kpi_analysis"
+    last_kpi = completed_kpis[-1] if completed_kpis else None
+    resume_point = f"after the entry for \"{last_kpi}\"" if last_kpi else "before the first KPI entry"
+    overall_instruction = (
+        'Also include the complete "overall_assessment" object, covering the whole call.'
+        if need_overall_assessment else
+        'Do not include "overall_assessment"; it was already received.'
+    )
+    return f"""{analysis_prompt}
+
+    **Continuation:** Your previous response to this request was cut off {resume_point}. {len(completed_kpis)} KPI entries were received and must not be repeated.
+    Respond with a single JSON object in the same structure, where "{list_key}" contains entries *only* for these remaining KPIs, in this order:
+    {remaining_string}
+    {overall_instruction} Keep each "reason" brief.
+    """
+
+
+def build_kpi_reask_prompt(transcript: str, kpi_ids: Dict[int, str]) -> str:
+    """
+    Builds a small, focused prompt that asks only for specific KPIs, used to
+    fill gaps (missing or invalid entries) in an otherwise complete analysis.
+
+    Args:
+        transcript: The full call transcript string (with speaker labels).
+        kpi_ids: KPI number (position in KPI_LIST, 1-based) -> KPI text.
+
+    Returns:
+        The prompt string. The answer uses the compact protocol:
+        {"kpis": [[number, status code, reason], ...]}.
+    """
+    kpi_string = "\n".join([f"{kpi_id}. {kpi}" for kpi_id, kpi in sorted(kpi_ids.items())])
+    codes = ", ".join(f'"{code}" = {status}' for code, status in KPI_STATUS_CODES.items())
+    return f"""
+    **Objective:** For the call transcript below, evaluate *only* the listed KPIs for the customer support representative ('{config.AGENT_SPEAKER_LABEL}').
+
+    **Call Transcript:**
+    ```
+    {transcript}
+    ```
+
+    **KPIs to evaluate (keep these numbers):**
+    {kpi_string}
+
+    **Output Format:** A single JSON object and nothing else: {{"kpis": [[number, status code, reason], ...]}} with one array per KPI above.
+    Status codes: {codes}. The reason is one brief sentence based on the agent's dialogue.
+    """
+
+
 # --- NEW Function ---
 def build_ideal_call_prompt(original_transcript: str, analysis_report: Dict[str, Any], retrieved_knowledge: List[str]) -> str:
     """
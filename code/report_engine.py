@@ -0,0 +1,360 @@
+# report_engine.py
+# Aggregate KPI reports over the results store: Met / Not Met / N/A rates per KPI category,
+# per agent and per week, the weakest KPIs and the most frequent mistakes_and_improvement_areas.
+#
+# Results are loaded once into flat numpy arrays (one element per KPI row) and every
+# aggregate is a np.bincount over them, so a report over 1M KPI rows takes well under a
+# second once loaded. refresh() only reads calls added (or re-analyzed) since the last load.
+#
+# Usage:
+#   python -m code.report_engine [--db analysis_results.sqlite] [--output kpi_report.json] [--top 10]
+#   python -m code.report_engine --watch 60     # refresh incrementally and reprint every 60 seconds
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import numpy as np
+
+from code.analysis_parser import kpi_key
+from code.kpis import KPI_CATEGORIES, KPI_CATEGORY_SIZES
+from code.results_store import DEFAULT_DB_PATH
+
+UNKNOWN_AGENT = "(unknown)"
+OTHER_CATEGORY = "Other" # KPIs stored by an older KPI_LIST
+# Column order of every count matrix; matches kpis.KPI_STATUS_CODES
+STATUS_CODES = "MNX"
+
+
+def week_of(call_date: str | None, analyzed_at: float | None) -> str:
+    """ISO week ("2026-W07") of the call date, or of the analysis time if the date is missing or invalid."""
+    if call_date:
+        try:
+            year, week, _ = datetime.date.fromisoformat(str(call_date)[:10]).isocalendar()
+            return f"{year}-W{week:02d}"
+        except ValueError:
+            pass
+    if analyzed_at is None:
+        return "(undated)"
+    year, week, _ = datetime.date.fromtimestamp(analyzed_at).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _rates(counts: np.ndarray) -> Dict[str, Any]:
+    """Counts and rates for one [met, not_met, na] row. met_rate leaves N/A out of the denominator."""
+    met, not_met, na = (int(c) for c in counts)
+    total = met + not_met + na
+    return {
+        "kpi_rows": total, "met": met, "not_met": not_met, "na": na,
+        "met_rate": round(met / (met + not_met), 4) if met + not_met else None,
+        "not_met_share": round(not_met / total, 4) if total else None,
+        "na_share": round(na / total, 4) if total else None,
+    }
+
+
+class _Labels:
+    """Label <-> small integer code, stable across refreshes (np.unique would renumber)."""
+
+    def __init__(self):
+        self.names: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+class KpiReportEngine:
+    """
+    In-memory, vectorized view of the results store.
+
+    Per KPI row three arrays are kept: call index, KPI ID and status code
+    (0 Met, 1 Not Met, 2 N/A). Per call: agent code, week code and whether
+    the call is current. Re-analyzed calls get a new call index and their old
+    one is deactivated, so refresh() only ever appends.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        # Read-only connection; the store runs in WAL mode, so this never blocks its writers
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.categories = _Labels()
+        for category, _ in KPI_CATEGORY_SIZES:
+            self.categories.code(category)
+        self.agents = _Labels()
+        self.weeks = _Labels()
+        self.kpi_texts: Dict[int, str] = {}
+        self._kpi_category = np.zeros(0, dtype=np.int32) # kpi_id -> category code
+
+        self._call_ids: List[str] = []
+        self._call_index: Dict[str, int] = {}
+        self._call_agent = np.zeros(0, dtype=np.int32)
+        self._call_week = np.zeros(0, dtype=np.int32)
+        self._call_active = np.zeros(0, dtype=bool)
+        self._call_mistakes: List[List[str]] = []
+        self._mistakes: Counter = Counter()
+        self._mistake_text: Dict[str, str] = {} # normalized -> first spelling seen
+
+        self._row_call = np.zeros(0, dtype=np.int32)
+        self._row_kpi = np.zeros(0, dtype=np.int32)
+        self._row_status = np.zeros(0, dtype=np.int8)
+        self._active_rows = None # Cached (call, kpi, status) of current calls only
+
+        self._last_rowid = 0
+        self._last_analyzed_at = 0.0
+
+    # --- Loading ---
+
+    def _load_kpis(self) -> None:
+        """Maps every stored KPI ID to its category (KPIs no longer in KPI_LIST go to OTHER_CATEGORY)."""
+        by_key = {kpi_key(kpi): category for kpi, category in KPI_CATEGORIES.items()}
+        rows = self._conn.execute("SELECT kpi_id, text FROM kpis").fetchall()
+        if not rows:
+            return
+        mapping = np.zeros(max(kpi_id for kpi_id, _ in rows) + 1, dtype=np.int32)
+        for kpi_id, text in rows:
+            self.kpi_texts[kpi_id] = text
+            category = KPI_CATEGORIES.get(text) or by_key.get(kpi_key(text), OTHER_CATEGORY)
+            mapping[kpi_id] = self.categories.code(category)
+        self._kpi_category = mapping
+
+    def refresh(self) -> int:
+        """
+        Loads calls stored or re-analyzed since the last refresh (everything on
+        the first call).
+
+        New calls are found by rowid; a re-analyzed call is caught by its newer
+        analyzed_at too, since SQLite may reuse the rowid of the row it replaced.
+        Calls, KPIs and KPI rows are read in one transaction, so a batch
+        committed meanwhile is either seen by all three reads or by none.
+
+        Returns:
+            The number of calls loaded.
+        """
+        start = time.perf_counter()
+        since = (self._last_rowid, self._last_analyzed_at)
+        self._conn.execute("BEGIN") # One read snapshot for every query below
+        try:
+            calls = self._conn.execute(
+                "SELECT rowid, call_id, agent, call_date, analyzed_at, mistakes FROM calls "
+                "WHERE rowid > ? OR analyzed_at > ? ORDER BY rowid", since).fetchall()
+            if not calls:
+                return 0
+            self._load_kpis()
+            # KPI rows come back as plain integers (status via its position in "MNX"), which numpy
+            # converts in one go; the call's rowid is mapped to its new call index with searchsorted.
+            rows = self._conn.execute(
+                "SELECT c.rowid, r.kpi_id, instr('MNX', r.status) - 1 FROM calls c "
+                # CROSS JOIN keeps calls as the outer loop: only the new calls' rows are read, by primary key
+                "CROSS JOIN kpi_results r ON r.call_id = c.call_id "
+                "WHERE c.rowid > ? OR c.analyzed_at > ?", since).fetchall()
+        finally:
+            self._conn.commit()
+
+        first_index = len(self._call_ids)
+        agents, weeks = [], []
+        for rowid, call_id, agent, call_date, analyzed_at, mistakes in calls:
+            previous = self._call_index.get(call_id)
+            if previous is not None:
+                self._call_active[previous] = False
+                self._mistakes.subtract(self._call_mistakes[previous])
+                self._call_mistakes[previous] = []
+            self._call_index[call_id] = len(self._call_ids)
+            self._call_ids.append(call_id)
+            agents.append(self.agents.code(agent or UNKNOWN_AGENT))
+            weeks.append(self.weeks.code(week_of(call_date, analyzed_at)))
+            self._call_mistakes.append(self._count_mistakes(mistakes))
+            self._last_rowid = max(self._last_rowid, rowid)
+            self._last_analyzed_at = max(self._last_analyzed_at, analyzed_at or 0.0)
+        self._mistakes = +self._mistakes # Drop counts that fell to zero
+        self._call_agent = np.concatenate([self._call_agent, np.array(agents, dtype=np.int32)])
+        self._call_week = np.concatenate([self._call_week, np.array(weeks, dtype=np.int32)])
+        self._call_active = np.concatenate([self._call_active, np.ones(len(calls), dtype=bool)])
+
+        if rows:
+            block = np.array(rows, dtype=np.int64)
+            rowids = np.array([call[0] for call in calls], dtype=np.int64) # Sorted by the query
+            call_index = first_index + np.searchsorted(rowids, block[:, 0])
+            valid = block[:, 2] >= 0 # Statuses outside M/N/X are never written, but don't trust it
+            self._row_call = np.concatenate([self._row_call, call_index[valid].astype(np.int32)])
+            self._row_kpi = np.concatenate([self._row_kpi, block[valid, 1].astype(np.int32)])
+            self._row_status = np.concatenate([self._row_status, block[valid, 2].astype(np.int8)])
+        self._active_rows = None
+        print(f"Report engine: loaded {len(calls)} call(s), {len(rows)} KPI row(s) "
+              f"in {time.perf_counter() - start:.2f}s.")
+        return len(calls)
+
+    def _count_mistakes(self, mistakes_json: str | None) -> List[str]:
+        try:
+            mistakes = json.loads(mistakes_json or "[]")
+        except json.JSONDecodeError:
+            return []
+        keys = []
+        for mistake in mistakes if isinstance(mistakes, list) else []:
+            # Same mistake, different spacing/case/trailing period -> one entry
+            key = " ".join(str(mistake).split()).lower().rstrip(".")
+            if key:
+                self._mistake_text.setdefault(key, " ".join(str(mistake).split()))
+                keys.append(key)
+        self._mistakes.update(keys)
+        return keys
+
+    def _rows(self):
+        if self._active_rows is None:
+            active = self._call_active[self._row_call]
+            self._active_rows = (self._row_call[active], self._row_kpi[active], self._row_status[active])
+        return self._active_rows
+
+    # --- Aggregates ---
+
+    def _counts(self, groups: np.ndarray, n_groups: int) -> np.ndarray:
+        """[n_groups, 3] Met / Not Met / N/A counts of the active KPI rows, grouped by `groups` (one code per row)."""
+        _, _, status = self._rows()
+        flat = groups.astype(np.int64) * 3 + status
+        return np.bincount(flat, minlength=n_groups * 3).reshape(n_groups, 3)
+
+    def _grouped(self, call_groups: np.ndarray, names: List[str]) -> List[Dict[str, Any]]:
+        """Rates per group and, within each group, per category (a single bincount over group x category)."""
+        calls, kpi_ids, _ = self._rows()
+        n_groups, n_categories = len(names), len(self.categories.names)
+        row_groups = call_groups[calls]
+        totals = self._counts(row_groups, n_groups)
+        by_category = self._counts(row_groups * n_categories + self._kpi_category[kpi_ids],
+                                   n_groups * n_categories).reshape(n_groups, n_categories, 3)
+        call_counts = np.bincount(call_groups[self._call_active], minlength=n_groups)
+        results = []
+        for g, name in enumerate(names):
+            if not totals[g].any():
+                continue
+            results.append({"name": name, "calls": int(call_counts[g]), **_rates(totals[g]),
+                            "categories": {self.categories.names[c]: _rates(by_category[g, c])["met_rate"]
+                                           for c in range(n_categories) if by_category[g, c].any()}})
+        return results
+
+    def overall(self) -> Dict[str, Any]:
+        _, _, status = self._rows()
+        return _rates(np.bincount(status, minlength=3))
+
+    def category_rates(self) -> List[Dict[str, Any]]:
+        _, kpi_ids, _ = self._rows()
+        counts = self._counts(self._kpi_category[kpi_ids], len(self.categories.names))
+        return [{"category": name, **_rates(counts[c])} for c, name in enumerate(self.categories.names)
+                if counts[c].any()]
+
+    def agent_rates(self) -> List[Dict[str, Any]]:
+        """Agents with the lowest met rate first."""
+        return sorted(self._grouped(self._call_agent, self.agents.names),
+                      key=lambda agent: (agent["met_rate"] is None, agent["met_rate"] or 0.0))
+
+    def week_rates(self) -> List[Dict[str, Any]]:
+        return sorted(self._grouped(self._call_week, self.weeks.names), key=lambda week: week["name"])
+
+    def weakest_kpis(self, top: int = 10) -> List[Dict[str, Any]]:
+        """KPIs with the lowest met rate (N/A excluded), i.e. where coaching pays off most."""
+        _, kpi_ids, _ = self._rows()
+        counts = self._counts(kpi_ids, len(self._kpi_category))
+        answered = counts[:, 0] + counts[:, 1]
+        met_rate = np.divide(counts[:, 0], answered, out=np.ones(len(counts)), where=answered > 0)
+        order = np.lexsort((-counts[:, 1], met_rate)) # Lowest rate first, ties by most Not Met
+        return [{"kpi": self.kpi_texts.get(int(k), f"KPI {k}"),
+                 "category": self.categories.names[self._kpi_category[k]], **_rates(counts[k])}
+                for k in order[:top] if answered[k]]
+
+    def top_mistakes(self, top: int = 10) -> List[Dict[str, Any]]:
+        return [{"mistake": self._mistake_text[key], "calls": count} for key, count in self._mistakes.most_common(top)]
+
+    def report(self, top: int = 10) -> Dict[str, Any]:
+        """The full coaching report (refresh() first to include new calls)."""
+        return {
+            "generated_at": time.time(),
+            "calls": int(self._call_active.sum()),
+            "overall": self.overall(),
+            "categories": self.category_rates(),
+            "agents": self.agent_rates(),
+            "weeks": self.week_rates(),
+            "weakest_kpis": self.weakest_kpis(top),
+            "top_mistakes": self.top_mistakes(top),
+        }
+
+    def to_dataframe(self):
+        """Active KPI rows as a pandas DataFrame (call_id, agent, week, kpi, category, status) for ad-hoc analysis."""
+        import pandas as pd
+        calls, kpi_ids, status = self._rows()
+        return pd.DataFrame({
+            "call_id": pd.Categorical.from_codes(calls, self._call_ids),
+            "agent": pd.Categorical.from_codes(self._call_agent[calls], self.agents.names),
+            "week": pd.Categorical.from_codes(self._call_week[calls], self.weeks.names),
+            "kpi_id": kpi_ids,
+            "category": pd.Categorical.from_codes(self._kpi_category[kpi_ids], self.categories.names),
+            "status": pd.Categorical.from_codes(status, list(STATUS_CODES)),
+        })
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    def pct(value):
+        return "   -  " if value is None else f"{value:6.1%}"
+
+    overall = report["overall"]
+    print(f"\n--- KPI Report: {report['calls']} call(s), {overall['kpi_rows']} KPI row(s) ---")
+    print(f"Met rate (N/A excluded): {pct(overall['met_rate'])}   N/A share: {pct(overall['na_share'])}")
+    print(f"\n{'Category':<32} {'Met':>7} {'Not Met':>8} {'N/A':>7} {'rows':>9}")
+    for row in report["categories"]:
+        print(f"{row['category'][:32]:<32} {pct(row['met_rate']):>7} {pct(row['not_met_share']):>8} "
+              f"{pct(row['na_share']):>7} {row['kpi_rows']:>9}")
+    for title, key in (("Agent", "agents"), ("Week", "weeks")):
+        print(f"\n{title:<24} {'calls':>6} {'Met':>7}  weakest category")
+        for row in report[key]:
+            weakest = min(((rate, name) for name, rate in row["categories"].items() if rate is not None), default=None)
+            weakest_text = f"{weakest[1]} ({weakest[0]:.0%})" if weakest else "-"
+            print(f"{row['name'][:24]:<24} {row['calls']:>6} {pct(row['met_rate']):>7}  {weakest_text}")
+    print("\nWeakest KPIs:")
+    for row in report["weakest_kpis"]:
+        print(f" {pct(row['met_rate'])}  {row['kpi']}")
+    print("\nMost frequent mistakes:")
+    for row in report["top_mistakes"]:
+        print(f" {row['calls']:>5}x  {row['mistake']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KPI coaching report over the analysis results store.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--output", default="kpi_report.json", help="Where to write the report as JSON.")
+    parser.add_argument("--top", type=int, default=10, help="Number of weakest KPIs and mistakes to list.")
+    parser.add_argument("--watch", type=float, default=0, help="Refresh every N seconds and reprint when calls were added.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Error: results store '{args.db}' not found. Run an analysis first.")
+        return
+    engine = KpiReportEngine(args.db)
+    try:
+        while True:
+            if engine.refresh() or not args.watch:
+                start = time.perf_counter()
+                report = engine.report(args.top)
+                print_report(report)
+                print(f"\nReport computed in {time.perf_counter() - start:.3f}s.")
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2, ensure_ascii=False)
+                print(f"Report written to {args.output}")
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# results_store.py
+# Columnar store for call analyses: one row per (call, KPI) plus one row of call-level assessment per call.
+#
+# Tables (SQLite):
+#   kpis         kpi_id, text                       - KPI texts, IDs stable even if KPI_LIST is reordered
+#   calls        call_id, transcript_path, agent, call_date, analyzed_at, summary,
+#                strengths, mistakes (JSON arrays), one column per soft skill,
+#                met / not_met / na counts
+#   kpi_results  call_id, kpi_id, status ("M" / "N" / "X", see kpis.KPI_STATUS_CODES), reason
+#
+# Usage:
+#   python -m code.results_store export-json  <call_id> [output.json] [--db analysis_results.sqlite]
+#   python -m code.results_store export-parquet <directory>             [--db analysis_results.sqlite]
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from code.kpis import KPI_LIST, KPI_STATUS_CODES
+
+DEFAULT_DB_PATH = "analysis_results.sqlite"
+SOFT_SKILLS = ("confidence", "positivity_tone", "energy_level", "enthusiasm", "empathy_relatability",
+               "conversation_steering", "genuineness", "conversation_flow")
+_STATUS_TO_CODE = {status: code for code, status in KPI_STATUS_CODES.items()}
+_CHECKLIST_POSITION = {kpi: position for position, kpi in enumerate(KPI_LIST)}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS kpis (
+    kpi_id INTEGER PRIMARY KEY,
+    text TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    call_id TEXT PRIMARY KEY,
+    transcript_path TEXT,
+    agent TEXT,
+    call_date TEXT,
+    analyzed_at REAL,
+    summary TEXT,
+    strengths TEXT,
+    mistakes TEXT,
+    {", ".join(f"{skill} TEXT" for skill in SOFT_SKILLS)},
+    met INTEGER,
+    not_met INTEGER,
+    na INTEGER
+);
+CREATE TABLE IF NOT EXISTS kpi_results (
+    call_id TEXT NOT NULL,
+    kpi_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT,
+    PRIMARY KEY (call_id, kpi_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kpi_results_by_kpi ON kpi_results (kpi_id, status);
+CREATE INDEX IF NOT EXISTS calls_by_agent_date ON calls (agent, call_date);
+"""
+_CALL_COLUMNS = ("call_id", "transcript_path", "agent", "call_date", "analyzed_at", "summary", "strengths",
+                 "mistakes") + SOFT_SKILLS + ("met", "not_met", "na")
+
+
+def call_id_for(transcript_path: str, root: str | None = None) -> str:
+    """
+    Default call ID: the transcript's path relative to `root` (the input
+    directory it was found in) without its extension, e.g. "clinic_a/call_0042",
+    so equally named transcripts in different folders stay apart. Without a
+    root (or outside it), the file name without its extension.
+    """
+    if root:
+        relative = os.path.relpath(os.path.abspath(transcript_path), os.path.abspath(root))
+        if relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+            return os.path.splitext(relative)[0].replace(os.sep, "/")
+    return os.path.splitext(os.path.basename(transcript_path))[0]
+
+
+class ResultsStore:
+    """
+    SQLite-backed analysis results. Writes are batched into one transaction;
+    re-adding a call replaces its previous rows. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets the report engine read while the batch path writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._kpi_ids: Dict[str, int] = dict(
+            (text, kpi_id) for kpi_id, text in self._conn.execute("SELECT kpi_id, text FROM kpis"))
+
+    def _kpi_id(self, text: str) -> int:
+        kpi_id = self._kpi_ids.get(text)
+        if kpi_id is None:
+            self._conn.execute("INSERT OR IGNORE INTO kpis (text) VALUES (?)", (text,))
+            kpi_id = self._conn.execute("SELECT kpi_id FROM kpis WHERE text = ?", (text,)).fetchone()[0]
+            self._kpi_ids[text] = kpi_id
+        return kpi_id
+
+    def _rows_for(self, call_id: str, analysis: Dict[str, Any], metadata: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+        by_kpi = {} # kpi_id -> row; a KPI the model listed twice keeps its last entry
+        for entry in analysis.get("kpi_analysis", []):
+            if not isinstance(entry, dict):
+                continue
+            code = _STATUS_TO_CODE.get(entry.get("status"))
+            if code is None:
+                continue # Invalid statuses are not stored (see analysis_validator)
+            kpi_id = self._kpi_id(entry["kpi"])
+            by_kpi[kpi_id] = (call_id, kpi_id, code, entry.get("reason"))
+        kpi_rows = list(by_kpi.values())
+        counts = {"M": 0, "N": 0, "X": 0}
+        for row in kpi_rows:
+            counts[row[2]] += 1
+        # Malformed model output must not abort a bulk write: anything but an object counts as missing
+        overall = analysis.get("overall_assessment")
+        overall = overall if isinstance(overall, dict) else {}
+        skills = overall.get("soft_skills_evaluation")
+        skills = skills if isinstance(skills, dict) else {}
+        call_row = (
+            call_id,
+            metadata.get("transcript_path"),
+            metadata.get("agent"),
+            metadata.get("call_date"),
+            metadata.get("analyzed_at", time.time()),
+            overall.get("summary"),
+            json.dumps(overall.get("strengths") or [], ensure_ascii=False),
+            json.dumps(overall.get("mistakes_and_improvement_areas") or [], ensure_ascii=False),
+            *(skills.get(skill) for skill in SOFT_SKILLS),
+            counts["M"], counts["N"], counts["X"],
+        )
+        return call_row, kpi_rows
+
+    def add_analyses(self, records: Iterable[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> int:
+        """
+        Writes many analyses in a single transaction.
+
+        Args:
+            records: (call_id, analysis, metadata) tuples. Metadata keys:
+                'transcript_path', 'agent', 'call_date' (ISO date) and
+                optionally 'analyzed_at' (epoch seconds).
+
+        Returns:
+            The number of calls written.
+        """
+        with self._lock:
+            known_kpis = len(self._kpi_ids)
+            try:
+                rows_by_call = {} # A call listed twice keeps its last analysis
+                for call_id, analysis, metadata in records:
+                    rows_by_call[call_id] = self._rows_for(call_id, analysis, metadata or {})
+                if not rows_by_call:
+                    return 0
+                call_rows = [call_row for call_row, _ in rows_by_call.values()]
+                kpi_rows = [row for _, rows in rows_by_call.values() for row in rows]
+                placeholders = ", ".join("?" for _ in _CALL_COLUMNS)
+                with self._conn: # One transaction (incl. new KPI texts): all calls are stored, or none
+                    self._conn.executemany("DELETE FROM kpi_results WHERE call_id = ?", [(r[0],) for r in call_rows])
+                    self._conn.executemany(f"INSERT OR REPLACE INTO calls ({', '.join(_CALL_COLUMNS)}) "
+                                           f"VALUES ({placeholders})", call_rows)
+                    self._conn.executemany("INSERT INTO kpi_results VALUES (?, ?, ?, ?)", kpi_rows)
+            except BaseException:
+                # The new kpis rows were rolled back too; forget their cached IDs
+                self._conn.rollback()
+                for text in list(self._kpi_ids)[known_kpis:]:
+                    del self._kpi_ids[text]
+                raise
+            return len(call_rows)
+
+    def add_analysis(self, call_id: str, analysis: Dict[str, Any], metadata: Dict[str, Any] | None = None) -> None:
+        self.add_analyses([(call_id, analysis, metadata or {})])
+
+    def call_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT call_id FROM calls ORDER BY call_id")]
+
+    def load_analysis(self, call_id: str) -> Dict[str, Any] | None:
+        """Rebuilds the analysis in the original _analysis.json shape (None if the call is unknown)."""
+        with self._lock:
+            self._conn.row_factory = sqlite3.Row
+            try:
+                call = self._conn.execute("SELECT * FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+                if call is None:
+                    return None
+                rows = self._conn.execute(
+                    "SELECT k.text, r.status, r.reason FROM kpi_results r JOIN kpis k USING (kpi_id) "
+                    "WHERE r.call_id = ?", (call_id,)).fetchall()
+            finally:
+                self._conn.row_factory = None
+        # Checklist order (kpi_id is first-seen order); KPIs no longer in KPI_LIST go last
+        rows = sorted(rows, key=lambda row: _CHECKLIST_POSITION.get(row["text"], len(KPI_LIST)))
+        return {
+            "kpi_analysis": [{"kpi": text, "status": KPI_STATUS_CODES[status], "reason": reason}
+                             for text, status, reason in rows],
+            "overall_assessment": {
+                "summary": call["summary"],
+                "strengths": json.loads(call["strengths"] or "[]"),
+                "mistakes_and_improvement_areas": json.loads(call["mistakes"] or "[]"),
+                "soft_skills_evaluation": {skill: call[skill] for skill in SOFT_SKILLS if call[skill] is not None},
+            },
+        }
+
+    def export_json(self, call_id: str, output_path: str) -> bool:
+        """Writes one call as a classic _analysis.json file."""
+        analysis = self.load_analysis(call_id)
+        if analysis is None:
+            print(f"Error: call '{call_id}' is not in {self.path}.")
+            return False
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(analysis, f, indent=2, ensure_ascii=False)
+        return True
+
+    def export_parquet(self, directory: str) -> List[str]:
+        """Writes calls, kpis and kpi_results as Parquet files (requires pandas with pyarrow)."""
+        import pandas as pd
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        with self._lock:
+            for table in ("kpis", "calls", "kpi_results"):
+                frame = pd.read_sql_query(f"SELECT * FROM {table}", self._conn)
+                path = os.path.join(directory, f"{table}.parquet")
+                frame.to_parquet(path, index=False)
+                paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export analyses from the results store.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_json = sub.add_parser("export-json", help="Write one call as an _analysis.json file.")
+    export_json.add_argument("call_id")
+    export_json.add_argument("output", nargs="?")
+    export_parquet = sub.add_parser("export-parquet", help="Write all tables as Parquet files.")
+    export_parquet.add_argument("directory")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    try:
+        if args.command == "export-json":
+            output = args.output or f"{args.call_id}_analysis.json"
+            if store.export_json(args.call_id, output):
+                print(f"Analysis written to {output}")
+        else:
+            for path in store.export_parquet(args.directory):
+                print(f"Wrote {path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+# service.py
+# Long-running local HTTP service for analysis, ideal-call, STT and TTS jobs.
+#
+# Config, the Gemini client, Whisper and the TTS engines (Dia) are loaded once and kept warm,
+# so a request pays only for its own work. Jobs run on per-kind worker pools; every job keeps
+# an event log that can be streamed while it runs (KPI entries as Gemini produces them, the
+# ideal call text as it is generated, the STT transcript before diarization).
+#
+# Endpoints (JSON in and out, bound to localhost by default):
+#   POST /jobs/analysis    {"transcript": "..." | "transcript_path": "...", "call_id", "agent", "call_date", "store": true}
+#   POST /jobs/ideal_call  {"transcript" | "transcript_path", "analysis" (optional), "audio_path" (optional)}
+#   POST /jobs/stt         {"audio_path": "...", "diarize": true}
+#   POST /jobs/tts         {"script": "AGENT: ...", "output_path": "..."}
+#   GET  /jobs/<id>          status            GET /jobs           all jobs
+#   GET  /jobs/<id>/result   result (202 while running)
+#   GET  /jobs/<id>/events   newline-delimited JSON events, streamed until the job finishes
+#   GET  /health             warm components, job counts and TTS engine totals
+#   GET  /metrics            per-stage metrics in Prometheus text format (see tracing.py)
+#
+# Usage:
+#   python -m code.service [--port 8765] [--warm gemini,stt,tts] [--dry-run]
+#   curl -s -X POST localhost:8765/jobs/analysis -d '{"transcript_path": "sample_transcript1.txt"}'
+#   curl -N localhost:8765/jobs/<id>/events
+import argparse
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import code.config as config
+from code.tracing import call_context, metrics
+import code.profiling as profiling
+
+JOB_KINDS = ("analysis", "ideal_call", "stt", "tts")
+FINISHED_STATES = ("done", "failed")
+PARTIAL_PARSE_STEP = 256 # Re-parse a streamed analysis every this many new characters
+
+
+class Job:
+    """One submitted job: its parameters, state, event log and result."""
+
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = f"{kind}-{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.params = params
+        self.state = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events: List[Dict[str, Any]] = []
+        self.result = None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def emit(self, event: str, **data) -> None:
+        with self._cond:
+            self.events.append({"seq": len(self.events), "event": event, "time": round(time.time(), 3), **data})
+            self._cond.notify_all()
+
+    def start(self) -> None:
+        self.state = "running"
+        self.started_at = time.time()
+        self.emit("started")
+
+    def finish(self, result: Any = None, error: str | None = None) -> None:
+        with self._cond:
+            self.result, self.error = result, error
+            self.finished_at = time.time()
+            self.state = "failed" if error else "done"
+            self.events.append({"seq": len(self.events), "event": self.state, "time": round(self.finished_at, 3),
+                                **({"error": error} if error else {})})
+            self._cond.notify_all()
+
+    def wait_events(self, after: int, timeout: float = 15.0) -> tuple:
+        """Events with seq >= after (waiting up to `timeout` for new ones) and whether the job has finished."""
+        with self._cond:
+            if len(self.events) <= after and self.state not in FINISHED_STATES:
+                self._cond.wait(timeout)
+            return self.events[after:], self.state in FINISHED_STATES
+
+    def status(self) -> Dict[str, Any]:
+        seconds = (self.finished_at or time.time()) - self.started_at if self.started_at else None
+        return {"id": self.id, "kind": self.kind, "state": self.state, "submitted_at": self.submitted_at,
+                "started_at": self.started_at, "finished_at": self.finished_at,
+                "seconds": round(seconds, 3) if seconds is not None else None,
+                "queue_seconds": round((self.started_at or time.time()) - self.submitted_at, 3),
+                "events": len(self.events), "error": self.error}
+
+
+class CallService:
+    """
+    Keeps clients and models warm and runs jobs on per-kind worker pools.
+
+    Args:
+        generate: Prompt -> (text, finish_reason) callable (default: Gemini).
+        stream_generate: (prompt, on_text) -> (text, finish_reason) streaming
+            variant (default: Gemini streaming).
+        tts_router: TTS router (default: tts_generator.default_router()).
+        whisper_model: Whisper model size for STT jobs.
+        store_path: Results store analyses are saved to ("" = don't store).
+    """
+
+    def __init__(self, generate=None, stream_generate=None, tts_router=None, whisper_model: str = "base",
+                 store_path: str | None = None):
+        self.generate = generate
+        self.stream_generate = stream_generate
+        self.whisper_model_size = whisper_model
+        self._tts_router = tts_router
+        self._whisper = None
+        self._whisper_lock = threading.Lock() # One transcription at a time per loaded model
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self.store = None
+        store_path = config.RESULTS_DB_PATH if store_path is None else store_path
+        if store_path:
+            from code.results_store import ResultsStore
+            self.store = ResultsStore(store_path)
+        self._pools = {
+            "llm": ThreadPoolExecutor(config.SERVICE_LLM_WORKERS, thread_name_prefix="service-llm"),
+            "stt": ThreadPoolExecutor(1, thread_name_prefix="service-stt"),
+            "tts": ThreadPoolExecutor(config.SERVICE_TTS_WORKERS, thread_name_prefix="service-tts"),
+        }
+        self.warm_seconds: Dict[str, float] = {}
+        self.started_at = time.time()
+
+    # --- Warm components ---
+
+    def _generate(self):
+        if self.generate is None:
+            from code.gemini_client import generate_with_finish_reason
+            self.generate = generate_with_finish_reason
+        return self.generate
+
+    def _stream_generate(self):
+        if self.stream_generate is None:
+            from code.gemini_client import generate_stream_with_finish_reason
+            self.stream_generate = generate_stream_with_finish_reason
+        return self.stream_generate
+
+    def tts_router(self):
+        if self._tts_router is None:
+            from code.tts_generator import default_router
+            self._tts_router = default_router()
+        return self._tts_router
+
+    def whisper(self):
+        if self._whisper is None:
+            from code.stt_whisper import load_whisper_model
+            self._whisper = load_whisper_model(self.whisper_model_size)
+        return self._whisper
+
+    def warm(self, components: List[str]) -> None:
+        """Loads components up front ("gemini", "stt", "tts") so no request waits for them."""
+        for component in components:
+            start = time.perf_counter()
+            try:
+                if component == "gemini":
+                    self._generate(); self._stream_generate()
+                    if self.generate.__module__ == "code.gemini_client":
+                        from code.gemini_client import get_model
+                        get_model()
+                elif component == "stt":
+                    with self._whisper_lock:
+                        self.whisper()
+                elif component == "tts":
+                    for engine in self.tts_router().engines:
+                        engine.warm()
+                else:
+                    print(f"Warning: unknown component '{component}' in --warm, ignoring it.")
+                    continue
+            except Exception as e:
+                print(f"Warning: could not warm '{component}': {e}")
+                continue
+            self.warm_seconds[component] = round(time.perf_counter() - start, 2)
+            print(f"Warmed {component} in {self.warm_seconds[component]:.1f}s.")
+
+    # --- Jobs ---
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Job:
+        """Validates and queues a job. Raises ValueError for bad input."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'; expected one of {', '.join(JOB_KINDS)}.")
+        if not isinstance(params, dict):
+            raise ValueError("The request body must be a JSON object.")
+        if kind in ("analysis", "ideal_call") and not (params.get("transcript") or params.get("transcript_path")):
+            raise ValueError("'transcript' or 'transcript_path' is required.")
+        if kind == "stt" and not params.get("audio_path"):
+            raise ValueError("'audio_path' is required.")
+        if kind == "tts" and not (params.get("script") and params.get("output_path")):
+            raise ValueError("'script' and 'output_path' are required.")
+
+        job = Job(kind, params)
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        pool = {"analysis": "llm", "ideal_call": "llm", "stt": "stt", "tts": "tts"}[kind]
+        self._pools[pool].submit(self._run, job)
+        return job
+
+    def _evict_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(self._jobs) - config.SERVICE_MAX_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job | None:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._jobs_lock:
+            return list(self._jobs.values())
+
+    def _run(self, job: Job) -> None:
+        job.start()
+        try:
+            with call_context(job.params.get("call_id") or job.id):
+                result = getattr(self, f"_run_{job.kind}")(job)
+            job.finish(result=result)
+        except Exception as e:
+            traceback.print_exc()
+            job.finish(error=f"{type(e).__name__}: {e}")
+
+    # --- Job kinds ---
+
+    def _transcript(self, job: Job) -> str:
+        if job.params.get("transcript"):
+            return job.params["transcript"]
+        from code.transcript_processor import load_transcript
+        transcript = load_transcript(job.params["transcript_path"])
+        if not transcript:
+            raise ValueError(f"Could not load transcript '{job.params['transcript_path']}'.")
+        return transcript
+
+    def _analyze(self, job: Job, transcript: str) -> Dict[str, Any]:
+        """Streams the analysis, emitting each KPI entry as soon as it is complete in the response."""
+        from code.analysis_parser import kpi_key, parse_gemini_response_with_report
+        from code.kpis import KPI_LIST
+        from code.main import analyze_transcript
+        emitted, parsed_at = set(), [0]
+
+        def on_text(text: str) -> None:
+            if len(text) - parsed_at[0] < PARTIAL_PARSE_STEP:
+                return
+            parsed_at[0] = len(text)
+            partial, _ = parse_gemini_response_with_report(text, KPI_LIST)
+            # The last entry may still be cut mid-reason; it is emitted once the next one starts
+            for entry in (partial or {}).get("kpi_analysis", [])[:-1]:
+                if kpi_key(entry["kpi"]) not in emitted:
+                    emitted.add(kpi_key(entry["kpi"]))
+                    job.emit("kpi", **entry)
+
+        def generate(prompt):
+            parsed_at[0] = 0 # Continuation and re-ask responses are parsed on their own
+            return self._stream_generate()(prompt, on_text)
+
+        analysis = analyze_transcript(transcript, generate)
+        if not analysis:
+            raise RuntimeError("Analysis failed (no valid response from the model).")
+        # Entries that only became complete at the very end, or were filled by a re-ask
+        for entry in analysis["kpi_analysis"]:
+            if kpi_key(entry["kpi"]) not in emitted:
+                emitted.add(kpi_key(entry["kpi"]))
+                job.emit("kpi", **entry)
+        job.emit("overall_assessment", **(analysis.get("overall_assessment") or {}))
+        return analysis
+
+    def _run_analysis(self, job: Job) -> Dict[str, Any]:
+        analysis = self._analyze(job, self._transcript(job))
+        if self.store is not None and job.params.get("store", True):
+            self.store.add_analysis(job.params.get("call_id") or job.id, analysis,
+                                    {"transcript_path": job.params.get("transcript_path"),
+                                     "agent": job.params.get("agent"), "call_date": job.params.get("call_date")})
+            job.emit("stored", call_id=job.params.get("call_id") or job.id)
+        return analysis
+
+    def _run_ideal_call(self, job: Job) -> Dict[str, Any]:
+        from code.main import generate_ideal_call_text
+        transcript = self._transcript(job)
+        analysis = job.params.get("analysis") or self._analyze(job, transcript)
+        sent = [0]
+
+        def on_text(text: str) -> None:
+            job.emit("ideal_call_text", delta=text[sent[0]:])
+            sent[0] = len(text)
+
+        ideal_call_text = generate_ideal_call_text(transcript, analysis,
+                                                   lambda prompt: self._stream_generate()(prompt, on_text)[0])
+        if not ideal_call_text:
+            raise RuntimeError("Ideal call generation failed.")
+        result = {"ideal_call_text": ideal_call_text, "analysis": analysis}
+        if job.params.get("audio_path"):
+            from code.tts_generator import generate_audio_from_script
+            job.emit("synthesizing", output_path=job.params["audio_path"])
+            audio_path = generate_audio_from_script(ideal_call_text, job.params["audio_path"], router=self.tts_router())
+            if not audio_path:
+                raise RuntimeError("Audio synthesis failed.")
+            result["audio_path"] = audio_path
+        return result
+
+    def _run_stt(self, job: Job) -> Dict[str, Any]:
+        from code.stt_whisper import diarize_transcript_with_gemini, transcribe_audio
+        with self._whisper_lock:
+            raw = transcribe_audio(self.whisper(), job.params["audio_path"])
+        job.emit("transcribed", text=raw)
+        result = {"raw_transcript": raw}
+        if job.params.get("diarize", True):
+            transcript = diarize_transcript_with_gemini(raw, generate=lambda prompt: self._generate()(prompt)[0])
+            if not transcript:
+                raise RuntimeError("Diarization failed.")
+            result["transcript"] = transcript
+        return result
+
+    def _run_tts(self, job: Job) -> Dict[str, Any]:
+        from code.tts_generator import generate_audio_from_script
+        usage: Dict[str, Any] = {}
+        output_path = generate_audio_from_script(job.params["script"], job.params["output_path"],
+                                                 router=self.tts_router(), usage=usage)
+        if not output_path:
+            raise RuntimeError("Audio synthesis failed with every engine.")
+        return {"output_path": output_path, "engines": usage} # This job's usage; totals are on /health
+
+    def health(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs():
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return {"status": "ok", "uptime_seconds": round(time.time() - self.started_at, 1),
+                "warm": self.warm_seconds, "whisper_loaded": self._whisper is not None, "jobs": counts,
+                "tts_engines": self._tts_router.metrics() if self._tts_router is not None else {}}
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self.store is not None:
+            self.store.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, and chunked responses for the event stream
+    service: CallService = None # Set by serve()
+
+    def log_message(self, format, *args):
+        pass # One line per request is noise next to the job output
+
+    def _send_json(self, status: int, data: Any) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_or_404(self, job_id: str) -> Job | None:
+        job = self.service.get(job_id)
+        if job is None:
+            self._send_json(404, {"error": f"Unknown job '{job_id}'."})
+        return job
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "POST /jobs/<kind>"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+            job = self.service.submit(parts[1], params)
+        except (ValueError, json.JSONDecodeError) as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, {**job.status(), "status_url": f"/jobs/{job.id}",
+                              "result_url": f"/jobs/{job.id}/result", "events_url": f"/jobs/{job.id}/events"})
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts == ["health"]:
+            return self._send_json(200, self.service.health())
+        if parts == ["metrics"]:
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if parts == ["jobs"]:
+            return self._send_json(200, [job.status() for job in self.service.jobs()])
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "Unknown endpoint."})
+        job = self._job_or_404(parts[1])
+        if job is None:
+            return
+        if len(parts) == 2:
+            return self._send_json(200, job.status())
+        if parts[2] == "result":
+            if job.state == "done":
+                return self._send_json(200, {"id": job.id, "result": job.result})
+            if job.state == "failed":
+                return self._send_json(500, {"id": job.id, "error": job.error})
+            return self._send_json(202, job.status())
+        if parts[2] == "events":
+            return self._stream_events(job)
+        self._send_json(404, {"error": "Unknown endpoint."})
+
+    def _stream_events(self, job: Job) -> None:
+        """Sends the job's events as newline-delimited JSON, live, until it finishes."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                events, finished = job.wait_events(sent)
+                if events:
+                    data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events).encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                    self.wfile.flush()
+                    sent += len(events)
+                if finished and sent >= len(job.events):
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass # Client stopped listening; the job keeps running
+
+
+def serve(service: CallService, host: str, port: int) -> None:
+    handler = type("CallServiceHandler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Call service listening on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping service...")
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP service for analysis, ideal-call, STT and TTS jobs.")
+    parser.add_argument("--host", default=config.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT)
+    parser.add_argument("--warm", default="gemini", help="Components to load at startup: gemini, stt, tts (comma-separated).")
+    parser.add_argument("--whisper-model", default="base")
+    parser.add_argument("--dry-run", action="store_true", help="Local LLM stub and placeholder TTS engine; results are not stored.")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--profile", nargs="?", const="profile", default=None, metavar="DIR",
+                        help="Profile every job stage (CPU samples, Python/RSS memory peaks) into DIR, reported on shutdown (default: profile/; setting PROFILE_DIR also enables it).")
+    args = parser.parse_args()
+    profiling.configure(args.profile) # Before warm(), so model loading is profiled too
+
+    if args.dry_run:
+        from code.llm_stub import LocalLLMStub
+        from code.tts_engines import StubEngine, TTSRouter
+        stub = LocalLLMStub(latency_seconds=args.stub_latency)
+        service = CallService(stub.generate_with_finish_reason, stub.generate_stream_with_finish_reason,
+                              TTSRouter([StubEngine()]), args.whisper_model, store_path="")
+    else:
+        try:
+            config.require("gemini")
+        except ValueError as e:
+            parser.error(str(e))
+        service = CallService(whisper_model=args.whisper_model)
+    service.warm([c.strip() for c in args.warm.split(",") if c.strip()])
+    serve(service, args.host, args.port)
+    profiling.finish()
+
+
+if __name__ == "__main__":
+    main()
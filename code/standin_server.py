@@ -0,0 +1,374 @@
+# standin_server.py
+# Local stand-in for the Gemini, ElevenLabs and OpenAI HTTP APIs, for offline load tests.
+#
+# Serves just enough of each API for the clients in this repo:
+#   POST /v1beta/models/<model>:generateContent         Gemini (google-generativeai, REST transport)
+#   POST /v1beta/models/<model>:streamGenerateContent   Gemini streaming (JSON array, or SSE with ?alt=sse)
+#   POST /v1/text-to-speech/<voice_id>[/stream]         ElevenLabs (raw PCM for pcm_* formats, WAV otherwise)
+#   GET  /v1/voices                                     ElevenLabs voice list
+#   POST /v1/chat/completions                           OpenAI ("Sample conn" helper)
+#   GET  /_stats                                        Requests, injected faults and latency per API
+#
+# Text responses are templated by llm_stub.LocalLLMStub (analysis JSON, ideal call, diarization),
+# or read from --canned files in rotation. Audio is a tone as long as the text would take to speak.
+# Every request draws its latency and faults from a generator seeded with (--seed, API, request
+# number), so a load test with the same settings and request order sees the same faults.
+#
+# Usage:
+#   python -m code.standin_server --port 8790 --gemini-latency lognormal:1.5,0.4 --error-429 0.05 --truncate 0.1
+#   GEMINI_BASE_URL=http://127.0.0.1:8790 ELEVENLABS_BASE_URL=http://127.0.0.1:8790 \
+#       python -m code.main transcripts/ --workers 16
+#
+# Latency specs: "0.5" / "fixed:0.5", "uniform:LOW,HIGH", "normal:MEAN,SD", "lognormal:MEDIAN,SIGMA", "exp:MEAN".
+import argparse
+import glob
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from code.llm_stub import LocalLLMStub
+from code.tts_segmenter import estimate_seconds
+
+STREAM_CHUNK_CHARS = 400 # Characters per streamed Gemini chunk
+CHARS_PER_TOKEN = 4 # Rough token estimate for usage metadata and maxOutputTokens
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parses a latency spec into a sampler (rng -> seconds, never negative).
+
+    Raises:
+        ValueError: For unknown distributions or malformed parameters.
+    """
+    kind, _, params = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    try:
+        values = [float(v) for v in params.split(",")] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency spec '{spec}'.")
+    samplers = {
+        "fixed": (1, lambda rng, v: v[0]),
+        "uniform": (2, lambda rng, v: rng.uniform(v[0], v[1])),
+        "normal": (2, lambda rng, v: rng.gauss(v[0], v[1])),
+        "lognormal": (2, lambda rng, v: v[0] * math.exp(rng.gauss(0.0, v[1]))),
+        "exp": (1, lambda rng, v: rng.expovariate(1.0 / v[0]) if v[0] > 0 else 0.0),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"Invalid latency spec '{spec}'; expected one of: fixed:S, uniform:LOW,HIGH, "
+                         "normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exp:MEAN.")
+    sample = samplers[kind][1]
+    return lambda rng: max(0.0, sample(rng, values))
+
+
+class FaultProfile:
+    """
+    Latency and fault injection for one API.
+
+    Args:
+        latency: Latency spec (see parse_latency), sampled per request.
+        error_429: Share of requests answered with 429 (rate limited).
+        error_5xx: Share of requests answered with a random 500/502/503.
+        truncate: Share of Gemini responses cut short with finishReason MAX_TOKENS.
+        retry_after: Retry-After header (seconds) sent with 429s, 0 = none.
+        max_concurrency: Requests in flight above this get a 429, 0 = no limit.
+    """
+
+    def __init__(self, latency: str = "0", error_429: float = 0.0, error_5xx: float = 0.0, truncate: float = 0.0,
+                 retry_after: float = 0.0, max_concurrency: int = 0):
+        self.latency = parse_latency(latency)
+        self.latency_spec = latency
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.truncate = truncate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency
+
+
+class _ApiStats:
+    """Counters for one API; `in_flight` drives the concurrency limit."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.outcomes: Dict[str, int] = {}
+        self.latencies: List[float] = []
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+            return {"requests": self.requests, "in_flight": self.in_flight, "outcomes": dict(self.outcomes),
+                    "latency_p50": pick(0.5), "latency_p95": pick(0.95), "latency_max": round(latencies[-1], 3) if latencies else None}
+
+
+class StandInApis:
+    """
+    Response generation and fault decisions, independent of the HTTP layer.
+
+    Args:
+        gemini: FaultProfile for Gemini (and OpenAI) requests.
+        tts: FaultProfile for ElevenLabs requests.
+        seed: Seed for the per-request random generators.
+        canned: Response texts served in rotation instead of the templated stub responses.
+        tts_rtf: Synthesis time per second of audio, added to the sampled TTS latency.
+    """
+
+    def __init__(self, gemini: FaultProfile, tts: FaultProfile, seed: int = 0, canned: List[str] | None = None,
+                 tts_rtf: float = 0.0):
+        self.profiles = {"gemini": gemini, "openai": gemini, "elevenlabs": tts}
+        self.stats = {api: _ApiStats() for api in self.profiles}
+        self.seed = seed
+        self.canned = canned or []
+        self.tts_rtf = tts_rtf
+        self.stub = LocalLLMStub()
+
+    def begin(self, api: str) -> tuple:
+        """Registers a request; returns (request number, rng, fault) where fault is None, 429 or a 5xx status."""
+        profile, stats = self.profiles[api], self.stats[api]
+        with stats.lock:
+            number = stats.requests
+            stats.requests += 1
+            stats.in_flight += 1
+            over_limit = profile.max_concurrency and stats.in_flight > profile.max_concurrency
+        rng = random.Random(f"{self.seed}:{api}:{number}")
+        roll = rng.random()
+        if over_limit or roll < profile.error_429:
+            return number, rng, 429
+        if roll < profile.error_429 + profile.error_5xx:
+            return number, rng, rng.choice((500, 502, 503))
+        return number, rng, None
+
+    def end(self, api: str, outcome: str, seconds: float) -> None:
+        stats = self.stats[api]
+        with stats.lock:
+            stats.in_flight -= 1
+            stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+            stats.latencies.append(seconds)
+
+    def text_for(self, prompt: str, number: int) -> str:
+        if self.canned:
+            return self.canned[number % len(self.canned)]
+        return self.stub.generate(prompt)
+
+    def audio_for(self, text: str, output_format: str, voice_id: str) -> tuple:
+        """(audio bytes, content type) for `text`; a tone pitched per voice."""
+        codec, _, rate = output_format.partition("_")
+        sample_rate = int(rate.split("_")[0]) if rate and rate.split("_")[0].isdigit() else 24000
+        frames = max(1, int(estimate_seconds(text) * sample_rate))
+        frequency = 200.0 + (sum(voice_id.encode("utf-8")) % 200)
+        import numpy as np # Only when audio is requested; the tone must not add latency of its own
+        pcm = (2000 * np.sin(2 * np.pi * frequency / sample_rate * np.arange(frames))).astype("<i2").tobytes()
+        if codec == "pcm":
+            return pcm, "audio/pcm"
+        # MP3 can't be encoded with the stdlib; other formats get a WAV container instead
+        header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(pcm), b"WAVE", b"fmt ", 16, 1, 1, sample_rate,
+                             sample_rate * 2, 2, 16, b"data", len(pcm))
+        return header + pcm, "audio/wav"
+
+
+def _gemini_payload(text: str, finish_reason: str, prompt_tokens: int, output_tokens: int) -> Dict[str, Any]:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": finish_reason,
+                            "index": 0}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": prompt_tokens + output_tokens}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    apis: StandInApis = None # Set by serve()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: Dict[str, str] | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: Any, headers: Dict[str, str] | None = None):
+        self._send(status, json.dumps(data).encode("utf-8"), headers=headers)
+
+    def _send_fault(self, api: str, status: int):
+        """Error body in the shape each API uses, so client SDKs raise their usual exception types."""
+        names = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 502: "UNAVAILABLE", 503: "UNAVAILABLE"}
+        message = "Rate limit exceeded (injected)" if status == 429 else "Server error (injected)"
+        profile = self.apis.profiles[api]
+        headers = {"Retry-After": f"{profile.retry_after:g}"} if status == 429 and profile.retry_after else None
+        if api == "gemini":
+            body = {"error": {"code": status, "message": message, "status": names[status]}}
+        elif api == "openai":
+            body = {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error"}}
+        else:
+            body = {"detail": {"status": "too_many_concurrent_requests" if status == 429 else "internal_error",
+                               "message": message}}
+        self._send_json(status, body, headers)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/_stats":
+            return self._send_json(200, {api: stats.summary() for api, stats in self.apis.stats.items()})
+        if path == "/v1/voices":
+            return self._send_json(200, {"voices": [{"voice_id": "standin-agent", "name": "Stand-in Agent"},
+                                                    {"voice_id": "standin-patient", "name": "Stand-in Patient"}]})
+        self._send_json(404, {"error": f"Unknown endpoint {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/v1beta/models/") and ":" in url.path:
+            api = "gemini"
+        elif url.path.startswith("/v1/text-to-speech/"):
+            api = "elevenlabs"
+        elif url.path == "/v1/chat/completions":
+            api = "openai"
+        else:
+            return self._send_json(404, {"error": f"Unknown endpoint {url.path}"})
+
+        start = time.perf_counter()
+        number, rng, fault = self.apis.begin(api)
+        outcome = str(fault) if fault else "ok"
+        try:
+            request = self._read_json()
+            delay = self.apis.profiles[api].latency(rng)
+            if fault:
+                time.sleep(delay * rng.random()) # Errors usually come back faster than answers
+                return self._send_fault(api, fault)
+            if api == "gemini":
+                outcome = self._gemini(url, request, rng, delay, number)
+            elif api == "openai":
+                time.sleep(delay)
+                prompt = "\n".join(m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user")
+                text = self.apis.text_for(prompt, number)
+                self._send_json(200, {"id": f"standin-{number}", "object": "chat.completion",
+                                      "model": request.get("model", "standin"),
+                                      "choices": [{"index": 0, "finish_reason": "stop",
+                                                   "message": {"role": "assistant", "content": text}}],
+                                      "usage": {"prompt_tokens": len(prompt) // CHARS_PER_TOKEN,
+                                                "completion_tokens": len(text) // CHARS_PER_TOKEN}})
+            else:
+                voice_id = url.path.split("/")[4]
+                output_format = parse_qs(url.query).get("output_format", ["mp3_44100_128"])[0]
+                text = request.get("text", "")
+                time.sleep(delay + self.apis.tts_rtf * estimate_seconds(text))
+                audio, content_type = self.apis.audio_for(text, output_format, voice_id)
+                self._send(200, audio, content_type)
+        except (BrokenPipeError, ConnectionResetError):
+            outcome = "disconnected"
+        except (ValueError, json.JSONDecodeError) as e:
+            outcome = "400"
+            self._send_json(400, {"error": str(e)})
+        finally:
+            self.apis.end(api, outcome, time.perf_counter() - start)
+
+    def _gemini(self, url, request: Dict[str, Any], rng: random.Random, delay: float, number: int) -> str:
+        """Answers generateContent / streamGenerateContent; returns the outcome for the stats."""
+        prompt = "".join(part.get("text", "") for content in request.get("contents", [])
+                         for part in content.get("parts", []))
+        text, finish_reason, outcome = self.apis.text_for(prompt, number), "STOP", "ok"
+        max_chars = int((request.get("generationConfig") or {}).get("maxOutputTokens") or 0) * CHARS_PER_TOKEN
+        if rng.random() < self.apis.profiles["gemini"].truncate:
+            text, finish_reason, outcome = text[:int(len(text) * rng.uniform(0.3, 0.9))], "MAX_TOKENS", "truncated"
+        elif max_chars and len(text) > max_chars:
+            text, finish_reason, outcome = text[:max_chars], "MAX_TOKENS", "truncated"
+        prompt_tokens = len(prompt) // CHARS_PER_TOKEN
+
+        if url.path.endswith(":generateContent"):
+            time.sleep(delay)
+            self._send_json(200, _gemini_payload(text, finish_reason, prompt_tokens, len(text) // CHARS_PER_TOKEN))
+            return outcome
+
+        # Streaming: the latency is spread over the chunks, sent as SSE events or as one JSON array
+        sse = parse_qs(url.query).get("alt", [""])[0] == "sse"
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            time.sleep(delay / len(chunks))
+            last = i == len(chunks) - 1
+            payload = _gemini_payload(chunk, finish_reason if last else "FINISH_REASON_UNSPECIFIED", prompt_tokens,
+                                      sum(len(c) for c in chunks[:i + 1]) // CHARS_PER_TOKEN)
+            if not last:
+                del payload["candidates"][0]["finishReason"]
+            data = json.dumps(payload)
+            data = f"data: {data}\r\n\r\n" if sse else ("[" if i == 0 else ",") + data + ("]" if last else "")
+            data = data.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        return outcome
+
+
+def load_canned(path: str) -> List[str]:
+    """Response texts from a file or every file in a directory (sorted)."""
+    paths = sorted(glob.glob(os.path.join(path, "*"))) if os.path.isdir(path) else [path]
+    texts = []
+    for file_path in paths:
+        with open(file_path, "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+
+def serve(apis: StandInApis, host: str, port: int) -> ThreadingHTTPServer:
+    """Starts the stand-in server on a background thread and returns it (call shutdown() to stop)."""
+    handler = type("StandInHandler", (_Handler,), {"apis": apis})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini, ElevenLabs and OpenAI APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--gemini-latency", default="lognormal:1.5,0.4", help="Latency spec for Gemini/OpenAI responses.")
+    parser.add_argument("--tts-latency", default="uniform:0.2,0.6", help="Latency spec for ElevenLabs (time to first byte).")
+    parser.add_argument("--tts-rtf", type=float, default=0.1, help="Extra TTS seconds per second of audio.")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Share of requests rate limited (both APIs).")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Share of requests failing with 500/502/503.")
+    parser.add_argument("--truncate", type=float, default=0.0, help="Share of Gemini responses cut off (MAX_TOKENS).")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--gemini-concurrency", type=int, default=0, help="Concurrent Gemini requests before 429s, 0 = no limit.")
+    parser.add_argument("--tts-concurrency", type=int, default=0, help="Concurrent TTS requests before 429s, 0 = no limit.")
+    parser.add_argument("--canned", help="File or directory of response texts served instead of templated ones.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        gemini = FaultProfile(args.gemini_latency, args.error_429, args.error_5xx, args.truncate, args.retry_after,
+                              args.gemini_concurrency)
+        tts = FaultProfile(args.tts_latency, args.error_429, args.error_5xx, 0.0, args.retry_after, args.tts_concurrency)
+    except ValueError as e:
+        parser.error(str(e))
+    apis = StandInApis(gemini, tts, args.seed, load_canned(args.canned) if args.canned else None, args.tts_rtf)
+    server = serve(apis, args.host, args.port)
+    base_url = f"http://{args.host}:{args.port}"
+    print(f"Stand-in APIs listening on {base_url} (Ctrl+C to stop)")
+    print(f"  GEMINI_BASE_URL={base_url} ELEVENLABS_BASE_URL={base_url} OPENAI_BASE_URL={base_url}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nStopping stand-in server...")
+        print(json.dumps({api: stats.summary() for api, stats in apis.stats.items()}, indent=2))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-import whisper
-import os 
+import os
 import code.config as config
 from code.prompt_builder import build_analysis_prompt, build_ideal_call_prompt, build_diarization_prompt
 from code.gemini_client import generate_analysis # Reusable Gemini client function
+from code.tracing import span
 
 # --- Configuration ---
 AUDIO_FILENAME = os.path.join("voice_samples", "patient_voice_sample.wav")# Your input audio file
@@ -10,12 +10,46 @@ OUTPUT_TEXT_FILENAME = "patient_voice_sample_transcript1.txt" # Name for the out
 MODEL_SIZE = "base" # Or "tiny", "small", "medium", "large" depending on your needs/resources
 
 
-def diarize_transcript_with_gemini(raw_transcript_text: str) -> str | None:
+def load_whisper_model(model_size: str = MODEL_SIZE):
+    """
+    Loads a Whisper model. Whisper (and torch) are imported here, so
+    importing this module for its helpers stays cheap.
+
+    Args:
+        model_size: "tiny", "small", "base", "medium" or "large".
+
+    Returns:
+        The loaded model.
+    """
+    import whisper
+    print(f"Loading Whisper model ('{model_size}')...")
+    # You might want to specify device="cuda" if you have a compatible GPU and PyTorch installed
+    # model = whisper.load_model(model_size, device="cuda")
+    with span("stt_load", model=model_size):
+        model = whisper.load_model(model_size)
+    print("Model loaded successfully.")
+    return model
+
+
+def transcribe_audio(model, audio_path: str) -> str:
+    """Transcribes one audio file with a loaded Whisper model and returns the raw text."""
+    print(f"Starting transcription for '{audio_path}'...")
+    with span("stt", audio_path=audio_path) as current:
+        result = model.transcribe(audio_path)
+        segments = result.get("segments") or []
+        current.set(text_chars=len(result["text"]), audio_seconds=segments[-1]["end"] if segments else None)
+    print("Transcription complete.")
+    # Extract the transcribed text
+    return result["text"]
+
+
+def diarize_transcript_with_gemini(raw_transcript_text: str, generate=None) -> str | None:
     """
     Uses Gemini to format raw transcript text and add speaker labels.
 
     Args:
         raw_transcript_text: The unstructured text from Whisper.
+        generate: Prompt -> text callable (defaults to gemini_client.generate_analysis).
 
     Returns:
         The formatted transcript string with speaker labels, or None on failure.
@@ -31,7 +65,7 @@ def diarize_transcript_with_gemini(raw_transcript_text: str) -> str | None:
 
     # 2. Call Gemini
     # Consider a slightly higher temperature? Maybe 0.3? Let's stick with default for now.
-    formatted_text = generate_analysis(diarization_prompt)
+    formatted_text = (generate or generate_analysis)(diarization_prompt)
 
     # 3. Basic Validation (Check if it looks like dialogue)
     if formatted_text and (config.AGENT_SPEAKER_LABEL in formatted_text or config.PATIENT_SPEAKER_LABEL in formatted_text):
@@ -56,61 +90,59 @@ def load_raw_transcript(file_path: str) -> str | None:
         print(f"Error reading raw transcript file {file_path}: {e}")
         return None
 
-# --- Check if audio file exists ---
-if not os.path.exists(AUDIO_FILENAME):
-    print(f"Error: Audio file not found at '{AUDIO_FILENAME}'")
-    exit() # Stop the script if the audio file is missing
 
-# --- Load Model ---
-try:
-    print(f"Loading Whisper model ('{MODEL_SIZE}')...")
-    # You might want to specify device="cuda" if you have a compatible GPU and PyTorch installed
-    # model = whisper.load_model(MODEL_SIZE, device="cuda")
-    model = whisper.load_model(MODEL_SIZE)
-    print("Model loaded successfully.")
-except Exception as e:
-    print(f"Error loading Whisper model: {e}")
-    print("Please ensure Whisper is installed correctly and model files are accessible.")
-    exit()
-
-# --- Perform Transcription ---
-try:
-    print(f"Starting transcription for '{AUDIO_FILENAME}'...")
-    result = model.transcribe(AUDIO_FILENAME)
-    # Extract the transcribed text
-    transcribed_text = result["text"]
-    print("Transcription complete.")
-    # You could also print the text here if you still want to see it:
-    # print("\n--- Transcribed Text ---")
-    # print(transcribed_text)
-    # print("------------------------\n")
-
-except Exception as e:
-    print(f"Error during transcription: {e}")
-    exit()
-
-# --- Save Transcription to File ---
-try:
-    print(f"Saving transcription to '{OUTPUT_TEXT_FILENAME}'...")
-    # Open the file in write mode ('w').
-    # If the file already exists, it will be overwritten.
-    # Use encoding='utf-8' to handle a wide range of characters.
-    with open(OUTPUT_TEXT_FILENAME, 'w', encoding='utf-8') as f:
-        f.write(transcribed_text)
-    print(f"Transcription successfully saved to '{OUTPUT_TEXT_FILENAME}'.")
-except Exception as e:
-    print(f"Error writing transcription to file: {e}")
-
-
-    # --- STEP 0: Load Raw Transcript ---
-raw_text = load_raw_transcript(OUTPUT_TEXT_FILENAME)
-
-if raw_text:
-    # --- STEP 1: Diarize using Gemini ---
-    formatted_transcript_text = diarize_transcript_with_gemini(raw_text)
-
-    if formatted_transcript_text:
-        # --- STEP 1.5: Save the Formatted Transcript ---
-            with open(OUTPUT_TEXT_FILENAME, 'w', encoding='utf-8') as f:
-                f.write(formatted_transcript_text)
-            print(f"Formatted transcript saved to: {OUTPUT_TEXT_FILENAME}")
\ No newline at end of file
+def main():
+    # --- Check if audio file exists ---
+    if not os.path.exists(AUDIO_FILENAME):
+        print(f"Error: Audio file not found at '{AUDIO_FILENAME}'")
+        exit() # Stop the script if the audio file is missing
+
+    # --- Load Model ---
+    try:
+        model = load_whisper_model(MODEL_SIZE)
+    except Exception as e:
+        print(f"Error loading Whisper model: {e}")
+        print("Please ensure Whisper is installed correctly and model files are accessible.")
+        exit()
+
+    # --- Perform Transcription ---
+    try:
+        transcribed_text = transcribe_audio(model, AUDIO_FILENAME)
+        # You could also print the text here if you still want to see it:
+        # print("\n--- Transcribed Text ---")
+        # print(transcribed_text)
+        # print("------------------------\n")
+
+    except Exception as e:
+        print(f"Error during transcription: {e}")
+        exit()
+
+    # --- Save Transcription to File ---
+    try:
+        print(f"Saving transcription to '{OUTPUT_TEXT_FILENAME}'...")
+        # Open the file in write mode ('w').
+        # If the file already exists, it will be overwritten.
+        # Use encoding='utf-8' to handle a wide range of characters.
+        with open(OUTPUT_TEXT_FILENAME, 'w', encoding='utf-8') as f:
+            f.write(transcribed_text)
+        print(f"Transcription successfully saved to '{OUTPUT_TEXT_FILENAME}'.")
+    except Exception as e:
+        print(f"Error writing transcription to file: {e}")
+
+
+        # --- STEP 0: Load Raw Transcript ---
+    raw_text = load_raw_transcript(OUTPUT_TEXT_FILENAME)
+
+    if raw_text:
+        # --- STEP 1: Diarize using Gemini ---
+        formatted_transcript_text = diarize_transcript_with_gemini(raw_text)
+
+        if formatted_transcript_text:
+            # --- STEP 1.5: Save the Formatted Transcript ---
+                with open(OUTPUT_TEXT_FILENAME, 'w', encoding='utf-8') as f:
+                    f.write(formatted_transcript_text)
+                print(f"Formatted transcript saved to: {OUTPUT_TEXT_FILENAME}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+# tracing.py
+# Per-stage tracing and metrics: wall time, Gemini tokens, TTS characters, cost, retries and cache hits.
+#
+# Stages are wrapped in `with span("stage", ...)` blocks (load, prompt_build, gemini, parse,
+# retrieve, stt, tts). Every finished span is
+#   - appended to the JSONL trace file (config.TRACE_PATH / --trace, one JSON object per line), and
+#   - aggregated into in-process metrics, served in Prometheus text format on /metrics
+#     (config.METRICS_PORT / --metrics-port for CLI runs, and on the local service).
+# Spans record the call they belong to (call_context) and their parent span, so a batch trace
+# can be grouped per call. Worker processes (pipeline STT/TTS stages) append to the same trace
+# file, but their metrics stay in the worker; the trace file is the complete record.
+# With --profile, spans are also the stages of the CPU/memory profiler (see profiling.py), and
+# their memory figures (py_peak_mb, rss_mb, max_rss_raised_mb) are added to the trace records.
+#
+# Usage:
+#   python -m code.main transcripts/ --dry-run --trace trace.jsonl --metrics-port 9464
+#   python -m code.tracing trace.jsonl        # slowest stages and calls of a batch
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List
+
+import code.config as config
+import code.profiling as profiling
+
+METRIC_PREFIX = "callgen_"
+STAGE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0) # Seconds
+COUNTER_HELP = {
+    "gemini_tokens_total": "Gemini tokens from usage metadata, by type (prompt/response).",
+    "tts_characters_total": "Characters sent to TTS engines, by engine.",
+    "cost_usd_total": "Estimated API cost in USD, by stage.",
+    "retries_total": "Retried or follow-up requests, by stage.",
+    "cache_hits_total": "Cache hits, by cache.",
+    "cache_misses_total": "Cache misses, by cache.",
+}
+
+_call = contextvars.ContextVar("trace_call", default=None)
+_parent = contextvars.ContextVar("trace_parent", default=None)
+
+
+class Span:
+    """One timed stage; attributes can be added while it runs with set()."""
+
+    def __init__(self, stage: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:16]
+        self.stage = stage
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+class Metrics:
+    """Thread-safe stage histograms and labelled counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.counters: Dict[tuple, float] = {}
+
+    def observe(self, stage: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "sum": 0.0, "errors": 0, "buckets": [0] * len(STAGE_BUCKETS)})
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["errors"] += int(error)
+            for i, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """The metrics in Prometheus text exposition format."""
+        def labels(pairs) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        name = METRIC_PREFIX + "stage_seconds"
+        lines = [f"# HELP {name} Wall time per pipeline stage.", f"# TYPE {name} histogram"]
+        with self._lock:
+            stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in self.stages.items()}
+            counters = dict(self.counters)
+        for stage, entry in sorted(stages.items()):
+            for bound, count in zip(STAGE_BUCKETS, entry["buckets"]):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {entry["count"]}')
+        name = METRIC_PREFIX + "stage_errors_total"
+        lines += [f"# HELP {name} Stages that raised, by stage.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{stage="{stage}"}} {entry["errors"]}' for stage, entry in sorted(stages.items())]
+        for counter in sorted({key[0] for key in counters}):
+            name = METRIC_PREFIX + counter
+            lines += [f"# HELP {name} {COUNTER_HELP.get(counter, counter)}", f"# TYPE {name} counter"]
+            lines += [f"{name}{labels(pairs)} {value:g}" for (n, pairs), value in sorted(counters.items()) if n == counter]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+_trace_lock = threading.Lock()
+_trace_file = None
+_trace_path = config.TRACE_PATH
+
+
+def configure(trace_path: str | None = None, metrics_port: int | None = None) -> None:
+    """
+    Overrides the trace file and starts the metrics endpoint (CLI flags).
+
+    The trace path is also exported as TRACE_PATH, so spawned worker
+    processes write their spans to the same file.
+    """
+    global _trace_path, _trace_file
+    if trace_path is not None:
+        with _trace_lock:
+            if _trace_file is not None:
+                _trace_file.close()
+            _trace_path, _trace_file = trace_path, None
+        os.environ["TRACE_PATH"] = trace_path
+    port = config.METRICS_PORT if metrics_port is None else metrics_port
+    if port:
+        serve_metrics(port)
+
+
+def _write(record: Dict[str, Any]) -> None:
+    global _trace_file
+    if not _trace_path:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _trace_lock:
+        if _trace_file is None:
+            _trace_file = open(_trace_path, "a", encoding="utf-8", buffering=1) # Line-buffered: complete lines only
+        _trace_file.write(line)
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """Adds to a labelled counter (e.g. count("retries_total", stage="tts"))."""
+    metrics.inc(name, value, **labels)
+
+
+@contextlib.contextmanager
+def call_context(call_id: str | None) -> Iterator[None]:
+    """Spans opened inside this block are attributed to `call_id`."""
+    token = _call.set(call_id)
+    try:
+        yield
+    finally:
+        _call.reset(token)
+
+
+def current_call() -> str | None:
+    return _call.get()
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs) -> Iterator[Span]:
+    """
+    Times a stage. Known attributes also feed the counters: prompt_tokens /
+    response_tokens (Gemini), characters + engine (TTS) and cost_usd.
+    """
+    current = Span(stage, attrs)
+    parent = _parent.get()
+    token = _parent.set(current.id)
+    profile = profiling.stage_started(stage) # None unless --profile / PROFILE_DIR
+    started_at, start = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _parent.reset(token)
+        seconds = time.perf_counter() - start
+        if profile is not None:
+            current.attrs.update(profiling.stage_finished(profile, seconds, error is not None))
+        attrs = current.attrs
+        metrics.observe(stage, seconds, error is not None)
+        for kind in ("prompt", "response"):
+            if attrs.get(f"{kind}_tokens"):
+                metrics.inc("gemini_tokens_total", attrs[f"{kind}_tokens"], type=kind)
+        if attrs.get("characters") and stage == "tts":
+            metrics.inc("tts_characters_total", attrs["characters"], engine=attrs.get("engine", "unknown"))
+        if attrs.get("cost_usd"):
+            metrics.inc("cost_usd_total", attrs["cost_usd"], stage=stage)
+        _write({"span": current.id, "parent": parent, "call": _call.get(), "stage": stage,
+                "start": round(started_at, 6), "seconds": round(seconds, 6), "pid": os.getpid(),
+                "thread": threading.current_thread().name, "error": error, **attrs})
+
+
+def gemini_cost(prompt_tokens: int, response_tokens: int) -> float:
+    """Estimated USD cost of one Gemini request (config.GEMINI_*_COST_PER_1M)."""
+    return (prompt_tokens * config.GEMINI_INPUT_COST_PER_1M + response_tokens * config.GEMINI_OUTPUT_COST_PER_1M) / 1e6
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Serves /metrics on a background thread for the lifetime of the process."""
+    # http.server (and the email package behind it) is only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"Metrics served on http://{host}:{port}/metrics")
+    return server
+
+
+# --- Trace summary (python -m code.tracing trace.jsonl) ---
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass # A line cut off by a crash
+    return spans
+
+
+def summarize(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-stage totals (slowest first) and the slowest calls by wall time."""
+    stages: Dict[str, Dict[str, Any]] = {}
+    calls: Dict[str, List[float]] = {}
+    for s in spans:
+        entry = stages.setdefault(s["stage"], {"stage": s["stage"], "spans": 0, "errors": 0, "seconds": [],
+                                               "prompt_tokens": 0, "response_tokens": 0, "characters": 0, "cost_usd": 0.0})
+        entry["spans"] += 1
+        entry["errors"] += int(bool(s.get("error")))
+        entry["seconds"].append(s["seconds"])
+        for field in ("prompt_tokens", "response_tokens", "characters", "cost_usd"):
+            entry[field] += s.get(field) or 0
+        if s.get("call"):
+            bounds = calls.setdefault(s["call"], [s["start"], s["start"] + s["seconds"]])
+            bounds[0], bounds[1] = min(bounds[0], s["start"]), max(bounds[1], s["start"] + s["seconds"])
+    rows = []
+    for entry in stages.values():
+        seconds = sorted(entry.pop("seconds"))
+        entry.update(total_seconds=round(sum(seconds), 3), mean_seconds=round(sum(seconds) / len(seconds), 4),
+                     p95_seconds=round(seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))], 4),
+                     max_seconds=round(seconds[-1], 4), cost_usd=round(entry["cost_usd"], 6))
+        rows.append(entry)
+    rows.sort(key=lambda row: row["total_seconds"], reverse=True)
+    slowest = sorted(((call, end - start) for call, (start, end) in calls.items()), key=lambda c: c[1], reverse=True)
+    return {"stages": rows, "slowest_calls": [{"call": call, "seconds": round(s, 3)} for call, s in slowest[:10]]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a JSONL trace: slowest stages and calls.")
+    parser.add_argument("trace", help="Trace file written with --trace / TRACE_PATH.")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args()
+
+    summary = summarize(load_trace(args.trace))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{'stage':<14}{'spans':>7}{'total s':>10}{'mean s':>9}{'p95 s':>9}{'max s':>9}{'errors':>8}"
+          f"{'tokens in/out':>16}{'chars':>9}{'cost $':>10}")
+    for row in summary["stages"]:
+        tokens = f"{row['prompt_tokens']}/{row['response_tokens']}" if row["prompt_tokens"] or row["response_tokens"] else "-"
+        print(f"{row['stage']:<14}{row['spans']:>7}{row['total_seconds']:>10.2f}{row['mean_seconds']:>9.3f}"
+              f"{row['p95_seconds']:>9.3f}{row['max_seconds']:>9.3f}{row['errors']:>8}{tokens:>16}"
+              f"{row['characters'] or '-':>9}{row['cost_usd']:>10.4f}")
+    if summary["slowest_calls"]:
+        print("\nSlowest calls (first span start to last span end):")
+        for call in summary["slowest_calls"]:
+            print(f"  {call['seconds']:>8.2f}s  {call['call']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # transcript_processor.py
 import os
+from typing import List, Dict, Any
 
 def load_transcript(file_path: str) -> str | None:
     """
@@ -24,6 +25,43 @@ def load_transcript(file_path: str) -> str | None:
         print(f"Error reading transcript file {file_path}: {e}")
         return None
 
+def parse_dialogue_lines(lines: List[str], speaker_labels: List[str]) -> List[Dict[str, Any]]:
+    """
+    Extracts the speaker turns from a labelled script (e.g. "AGENT: Hello...").
+
+    Args:
+        lines: The raw lines of the script file.
+        speaker_labels: The labels to recognise (e.g. ["AGENT", "PATIENT"]).
+
+    Returns:
+        A list of dicts with 'index' (0-based line number in the file),
+        'speaker' and 'text'. Headers, blank lines and labels without
+        text are skipped.
+    """
+    turns = []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        # Handle potential BOM (Byte Order Mark) for UTF-8 files from Windows
+        if i == 0 and line.startswith('\ufeff'):
+            line = line[1:]
+        if not line:
+            continue
+
+        for label in speaker_labels:
+            prefix = f"{label}:"
+            if line.startswith(prefix):
+                text = line[len(prefix):].strip()
+                if text:
+                    turns.append({"index": i, "speaker": label, "text": text})
+                else:
+                    print(f"Warning: Skipping line with speaker label but no text (line {i+1}): {line}")
+                break
+        else:
+            # Avoid noisy output for markdown headers like **Segment 1: ...**
+            if not (line.startswith("**") and line.endswith("**")):
+                print(f"Warning: Skipping unrecognized line format (line {i+1}): {line[:50]}")
+    return turns
+
 # --- Example Usage (Optional) ---
 # if __name__ == "__main__":
 #     sample_file = "sample_transcript.txt" # Make sure this file exists for testing
@@ -0,0 +1,182 @@
+# tts_cache.py
+# Persistent utterance-level audio cache shared by the TTS engines.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict
+
+from code.tracing import count
+
+INDEX_FILENAME = "index.sqlite"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes an utterance so trivially different spellings share a cache entry.
+    Unicode is NFKC-folded, curly quotes are straightened and whitespace collapsed.
+    Case and punctuation are kept because they change how the line is spoken.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = text.replace("‘", "'").replace("’", "'").replace("“", '"').replace("”", '"')
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(engine: str, voice_id: str, model: str, text: str) -> str:
+    """Stable key for (engine, voice ID, model, normalized text)."""
+    raw = "\x1f".join([engine, voice_id or "", model or "", normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Stores encoded audio segments on disk, indexed in a small SQLite table.
+
+    Entries are evicted least-recently-used first once the total size
+    exceeds `max_bytes`. Safe to share between worker threads.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, INDEX_FILENAME), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, engine TEXT, voice_id TEXT, model TEXT,"
+            " size INTEGER, created REAL, last_access REAL)"
+        )
+        self._conn.commit()
+
+    def _path(self, key: str) -> str:
+        # Two-level fan-out keeps directories small with many thousands of entries
+        return os.path.join(self.cache_dir, key[:2], key + ".bin")
+
+    def get(self, engine: str, voice_id: str, model: str, text: str) -> bytes | None:
+        """Returns the cached audio for the utterance, or None on a miss."""
+        key = make_cache_key(engine, voice_id, model, text)
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    audio = f.read()
+            except OSError:
+                # Index and files got out of sync (e.g. files removed by hand)
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return audio
+
+    def put(self, engine: str, voice_id: str, model: str, text: str, audio: bytes) -> None:
+        """Stores an encoded audio segment and evicts old entries if over budget."""
+        if not audio or len(audio) > self.max_bytes:
+            return
+        key = make_cache_key(engine, voice_id, model, text)
+        path = self._path(key)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, engine, voice_id, model, len(audio), now, now),
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drops least-recently-used entries until the cache fits in max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+        self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus the current on-disk footprint."""
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_default_cache() -> AudioCache | None:
+    """Opens the cache configured in config.py, or None if caching is disabled."""
+    import code.config as config
+    if not config.TTS_CACHE_DIR:
+        return None
+    return AudioCache(config.TTS_CACHE_DIR, int(config.TTS_CACHE_MAX_MB * 1024 * 1024))
+
+
+def with_cache(synthesize: Callable[[Dict[str, Any]], bytes], cache: AudioCache | None,
+               engine: str, model: str, voice_for: Callable[[Dict[str, Any]], str]) -> Callable[[Dict[str, Any]], bytes]:
+    """
+    Wraps a per-line synthesizer so repeated utterances are served from the cache.
+
+    Args:
+        synthesize: Callable returning audio bytes for a parsed line.
+        cache: The cache to use; if None, `synthesize` is returned unchanged.
+        engine: Engine name that is part of the key (e.g. "elevenlabs", "dia").
+        model: Model identifier (include the output format if it can vary).
+        voice_for: Maps a line to its voice ID.
+    """
+    if cache is None:
+        return synthesize
+
+    def _cached(line):
+        voice_id = voice_for(line)
+        audio = cache.get(engine, voice_id, model, line["text"])
+        if audio is None:
+            count("cache_misses_total", cache="tts")
+            audio = synthesize(line)
+            cache.put(engine, voice_id, model, line["text"], audio)
+        else:
+            count("cache_hits_total", cache="tts")
+        return audio
+    return _cached
+
+
+def print_cache_stats(cache: AudioCache | None) -> None:
+    """Prints a one-line summary of cache effectiveness."""
+    if cache is None:
+        return
+    s = cache.stats()
+    print(f"TTS cache: {s['hits']} hit(s), {s['misses']} miss(es) "
+          f"({s['hit_rate']:.0%} hit rate), {s['entries']} entries, "
+          f"{s['bytes'] / (1024 * 1024):.1f}/{s['max_bytes'] / (1024 * 1024):.0f} MB")
@@ -0,0 +1,265 @@
+# tts_engines.py
+# Common interface for the TTS backends (ElevenLabs, Dia, local stub) with per-engine metrics.
+import threading
+import time
+from typing import Any, Dict, List
+
+from code.tracing import span
+from code.tts_segmenter import estimate_seconds
+
+
+class EngineMetrics:
+    """Thread-safe counters for one engine: requests, failures, characters, latency and real-time factor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.characters = 0
+        self.synthesis_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.latencies: List[float] = []
+
+    def record(self, characters: int, seconds: float, audio_seconds: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.characters += characters
+            self.synthesis_seconds += seconds
+            self.audio_seconds += audio_seconds
+            self.latencies.append(seconds)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    @property
+    def rtf(self) -> float | None:
+        """Observed real-time factor (synthesis time / audio time), None before the first request."""
+        return self.synthesis_seconds / self.audio_seconds if self.audio_seconds else None
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "characters": self.characters,
+            "synthesis_seconds": self.synthesis_seconds,
+            "audio_seconds": self.audio_seconds,
+            "rtf": self.rtf,
+            "latency_mean": (sum(latencies) / len(latencies)) if latencies else None,
+            "latency_p95": p95,
+        }
+
+
+class TTSEngine:
+    """
+    Base class for TTS backends.
+
+    Subclasses implement `_synthesize(text, speaker) -> bytes` returning mono
+    16-bit PCM at `sample_rate`. `synthesize` wraps it with metrics: the
+    engine's lifetime totals, plus an optional per-job EngineMetrics.
+    """
+    name = "base"
+    sample_rate = 24000
+    cost_per_1k_chars = 0.0 # USD, used by the router's cost budget
+    default_rtf = 1.0 # Assumed real-time factor until metrics are available
+    max_concurrency = 1 # Parallel requests the backend can serve
+
+    def __init__(self):
+        self.metrics = EngineMetrics()
+
+    def synthesize(self, text: str, speaker: str, job_metrics: EngineMetrics | None = None) -> bytes:
+        start = time.perf_counter()
+        with span("tts", engine=self.name, speaker=speaker, characters=len(text),
+                  cost_usd=len(text) / 1000 * self.cost_per_1k_chars) as current:
+            try:
+                pcm = self._synthesize(text, speaker)
+            except Exception:
+                self.metrics.record_failure()
+                if job_metrics is not None:
+                    job_metrics.record_failure()
+                raise
+            seconds = time.perf_counter() - start
+            audio_seconds = len(pcm) / 2 / self.sample_rate
+            current.set(audio_seconds=round(audio_seconds, 3))
+        self.metrics.record(len(text), seconds, audio_seconds)
+        if job_metrics is not None:
+            job_metrics.record(len(text), seconds, audio_seconds)
+        return pcm
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        raise NotImplementedError
+
+    def warm(self) -> None:
+        """Loads whatever the first request would otherwise wait for (models, voices)."""
+
+    def estimate(self, characters: int, audio_seconds: float) -> Dict[str, float]:
+        """Expected latency (seconds, sequential) and cost (USD) for a job."""
+        rtf = self.metrics.rtf if self.metrics.rtf is not None else self.default_rtf
+        return {"latency": audio_seconds * rtf, "cost": characters / 1000 * self.cost_per_1k_chars}
+
+    def cache_identity(self, speaker: str) -> Dict[str, str]:
+        """Engine, voice and model strings used as the TTS cache key for this speaker."""
+        return {"engine": self.name, "voice_id": speaker, "model": ""}
+
+
+class ElevenLabsEngine(TTSEngine):
+    """ElevenLabs API, raw PCM output."""
+    name = "elevenlabs"
+    cost_per_1k_chars = 0.30
+    default_rtf = 0.3
+
+    def __init__(self, voice_ids: Dict[str, str], model_id: str, output_format: str = "pcm_24000",
+                 api_key: str | None = None, base_url: str | None = None, client=None,
+                 max_concurrency: int = 4):
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.voice_ids = voice_ids
+        self.model_id = model_id
+        self.output_format = output_format
+        self.sample_rate = int(output_format.split("_")[1])
+        self._api_key = api_key
+        self._base_url = base_url
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                from elevenlabs.client import ElevenLabs
+                kwargs = {"api_key": self._api_key}
+                if self._base_url:
+                    kwargs["base_url"] = self._base_url
+                self._client = ElevenLabs(**kwargs)
+            return self._client
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        audio_stream = self._get_client().text_to_speech.convert(
+            voice_id=self.voice_ids[speaker],
+            text=text,
+            model_id=self.model_id,
+            output_format=self.output_format
+        )
+        return b"".join(audio_stream)
+
+    def cache_identity(self, speaker: str) -> Dict[str, str]:
+        return {"engine": self.name, "voice_id": self.voice_ids[speaker], "model": f"{self.model_id}/{self.output_format}"}
+
+
+class DiaEngine(TTSEngine):
+    """Local Dia model; loaded on first use and kept for the life of the engine."""
+    name = "dia"
+    sample_rate = 44100
+    cost_per_1k_chars = 0.0
+    default_rtf = 3.0 # CPU-only nodes; a GPU is well below 1.0
+
+    def __init__(self, voice_name: str | None = None, use_torch_compile: bool = False, model_loader=None,
+                 seed: int | None = None):
+        super().__init__()
+        from code.openSourceTTS import resolve_seed
+        self.voice_name = voice_name
+        # Every segment is its own generate() call: without a voice prompt, only a fixed seed keeps the voices
+        self.seed = resolve_seed(seed)
+        if not voice_name and self.seed is None:
+            raise ValueError("The Dia engine needs a registered voice (TTS_DIA_VOICE) or DIA_SEED >= 0 "
+                             "to keep speaker voices consistent across segments.")
+        self.use_torch_compile = use_torch_compile
+        self._model_loader = model_loader
+        self._model = None
+        self._voice = None
+        # One Dia model serves one request at a time
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            if self._model_loader is None:
+                from code.openSourceTTS import load_dia_model
+                self._model_loader = load_dia_model
+            self._model = self._model_loader()
+        return self._model
+
+    def warm(self) -> None:
+        with self._lock:
+            self._get_model()
+            if self.voice_name and self._voice is None:
+                from code.openSourceTTS import _load_registered_voice
+                self._voice = _load_registered_voice(self.voice_name)
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        from code.audio_writer import float_to_pcm16
+        from code.openSourceTTS import SPEAKER_TAGS, _generate_cached, _load_registered_voice
+        with self._lock:
+            if self.voice_name and self._voice is None:
+                self._voice = _load_registered_voice(self.voice_name)
+            # Caching is done around the engine (see tts_generator), not inside it
+            audio, _, _ = _generate_cached(self._get_model, f"{SPEAKER_TAGS[speaker]} {text}", None,
+                                           self.use_torch_compile, self._voice, self.seed)
+        return float_to_pcm16(audio)
+
+    def cache_identity(self, speaker: str) -> Dict[str, str]:
+        from code.openSourceTTS import DIA_MODEL_ID
+        voice = self.voice_name or f"seed-{self.seed}"
+        return {"engine": self.name, "voice_id": f"{voice}/{speaker}", "model": DIA_MODEL_ID}
+
+
+class StubEngine(TTSEngine):
+    """
+    Instant local backend for dry runs and tests: returns a quiet tone whose
+    length matches the estimated spoken duration of the text.
+    """
+    name = "stub"
+    sample_rate = 16000
+    cost_per_1k_chars = 0.0
+    default_rtf = 0.001
+    max_concurrency = 8
+
+    def __init__(self, latency_seconds: float = 0.0):
+        super().__init__()
+        self.latency_seconds = latency_seconds
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        import numpy as np
+        frames = max(1, int(estimate_seconds(text) * self.sample_rate))
+        frequency = 220.0 if speaker == "AGENT" else 330.0
+        tone = 2000 * np.sin(2 * np.pi * frequency / self.sample_rate * np.arange(frames))
+        return tone.astype("<i2").tobytes()
+
+
+class TTSRouter:
+    """
+    Picks an engine per job from a latency and/or cost budget and falls back on failure.
+
+    Engines are ranked by: within budget first, then fastest expected latency
+    (cheapest first instead when a cost budget is set, TTS_MAX_COST_USD).
+    Latency estimates use each engine's observed real-time factor once it has
+    handled requests, so routing adapts to how the engines actually perform.
+    """
+
+    def __init__(self, engines: List[TTSEngine], max_latency_seconds: float | None = None,
+                 max_cost: float | None = None):
+        self.engines = engines
+        self.max_latency_seconds = max_latency_seconds
+        self.max_cost = max_cost
+
+    def rank(self, texts: List[str]) -> List[TTSEngine]:
+        """Engines in the order they should be tried for a job made of `texts`."""
+        characters = sum(len(t) for t in texts)
+        audio_seconds = sum(estimate_seconds(t) for t in texts)
+
+        def _key(engine):
+            estimate = engine.estimate(characters, audio_seconds)
+            over_latency = self.max_latency_seconds is not None and estimate["latency"] > self.max_latency_seconds
+            over_cost = self.max_cost is not None and estimate["cost"] > self.max_cost
+            if self.max_cost is not None:
+                return (over_latency or over_cost, estimate["cost"], estimate["latency"])
+            return (over_latency or over_cost, estimate["latency"], estimate["cost"])
+
+        return sorted(self.engines, key=_key)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Each engine's totals over the router's lifetime (all jobs)."""
+        return {engine.name: engine.metrics.summary() for engine in self.engines}
@@ -0,0 +1,137 @@
+# tts_generator.py
+# Turns a generated AGENT/PATIENT script into one audio file through the engine router.
+import os
+import shutil
+from typing import Any, Dict, List
+
+import code.config as config
+from code.audio_writer import open_writer_for_output, writable_output_path
+from code.transcript_processor import parse_dialogue_lines
+from code.tts_cache import open_default_cache, with_cache, print_cache_stats
+from code.tts_engines import DiaEngine, ElevenLabsEngine, EngineMetrics, StubEngine, TTSEngine, TTSRouter
+from code.tts_segmenter import segment_dialogue
+from code.tts_synthesis import synthesize_lines
+
+
+def build_engine(name: str) -> TTSEngine | None:
+    """Creates a configured engine by name ("elevenlabs", "dia" or "stub"); None if it is not usable here."""
+    if name == "elevenlabs":
+        missing = config.missing_settings("elevenlabs")
+        if missing:
+            print(f"Skipping ElevenLabs engine: {', '.join(missing)} not set.")
+            return None
+        voice_ids = {config.AGENT_SPEAKER_LABEL: config.AGENT_VOICE_ID, config.PATIENT_SPEAKER_LABEL: config.PATIENT_VOICE_ID}
+        return ElevenLabsEngine(voice_ids, config.ELEVENLABS_MODEL, config.ELEVENLABS_OUTPUT_FORMAT,
+                                api_key=config.ELEVENLABS_API_KEY, base_url=config.ELEVENLABS_BASE_URL,
+                                max_concurrency=config.TTS_MAX_WORKERS)
+    if name == "dia":
+        try:
+            return DiaEngine(voice_name=config.TTS_DIA_VOICE or None, use_torch_compile=config.DIA_USE_TORCH_COMPILE)
+        except ValueError as e:
+            print(f"Skipping Dia engine: {e}")
+            return None
+    if name == "stub":
+        return StubEngine()
+    print(f"Warning: unknown TTS engine '{name}' in TTS_ENGINES, ignoring it.")
+    return None
+
+
+def default_router() -> TTSRouter:
+    """Router over the engines listed in TTS_ENGINES, with the configured budgets."""
+    engines = [e for e in (build_engine(n.strip()) for n in config.TTS_ENGINES.split(",") if n.strip()) if e]
+    return TTSRouter(engines,
+                     max_latency_seconds=config.TTS_MAX_LATENCY_SECONDS or None,
+                     max_cost=config.TTS_MAX_COST_USD or None)
+
+
+def _render_with_engine(engine: TTSEngine, segments: List[dict], output_path: str, cache,
+                        job_metrics: EngineMetrics) -> str | None:
+    """Synthesizes every segment with one engine; returns the written path, or None if any segment failed."""
+    synthesize = with_cache(lambda line: engine.synthesize(line["text"], line["speaker"], job_metrics), cache,
+                            engine.name, engine.cache_identity(segments[0]["speaker"])["model"],
+                            lambda line: engine.cache_identity(line["speaker"])["voice_id"])
+    # Per-engine parts directory: segments from engines with different voices/rates must not mix
+    parts_dir = f"{output_path}.{engine.name}.parts"
+    writer = open_writer_for_output(output_path, engine.sample_rate, [s["index"] for s in segments],
+                                    pauses_after={s["index"]: s["pause_after_ms"] / 1000 for s in segments})
+    try:
+        result = synthesize_lines(segments, synthesize,
+                                  max_workers=engine.max_concurrency,
+                                  max_retries=config.TTS_MAX_RETRIES,
+                                  base_delay=config.TTS_RETRY_BASE_DELAY,
+                                  parts_dir=parts_dir,
+                                  extension="pcm",
+                                  on_segment=writer.append,
+                                  identity_for=lambda line: engine.cache_identity(line["speaker"]))
+    finally:
+        writer.close()
+    if result["failed"]:
+        index, message = result["failed"][0]
+        print(f"Engine '{engine.name}' failed on {len(result['failed'])} segment(s), first: segment {index+1}: {message}")
+        return None
+    return writer.path
+
+
+def generate_audio_from_script(script_text: str, output_path: str, router: TTSRouter | None = None,
+                               usage: Dict[str, Any] | None = None) -> str | None:
+    """
+    Renders an "AGENT: ... / PATIENT: ..." script to `output_path`.
+
+    The router ranks its engines for this job (latency/cost budget) and the
+    next engine is tried if one fails. Each engine streams its segments into
+    the output file as they finish, so a partial file exists early.
+
+    Args:
+        script_text: The dialogue script (e.g. the generated ideal call).
+        output_path: Output audio file (.wav, or .mp3/.ogg when ffmpeg is available).
+        router: Engine router; defaults to the one configured in config.py.
+        usage: Filled with this job's metrics per engine tried (the engines'
+            own metrics are totals over every job the router has run).
+
+    Returns:
+        The path actually written (a .wav next to `output_path` when ffmpeg is
+        missing for a compressed format), or None if every engine failed.
+    """
+    router = router or default_router()
+    if not router.engines:
+        print("Error: no TTS engine is available (check TTS_ENGINES and the engine credentials).")
+        return None
+
+    turns = parse_dialogue_lines(script_text.splitlines(), [config.AGENT_SPEAKER_LABEL, config.PATIENT_SPEAKER_LABEL])
+    if not turns:
+        print("Error: the script has no AGENT/PATIENT lines to synthesize.")
+        return None
+    segments = segment_dialogue(turns, config.TTS_SEGMENT_MAX_SECONDS or float("inf"))
+
+    cache = open_default_cache()
+    try:
+        for engine in router.rank([s["text"] for s in segments]):
+            print(f"Synthesizing {len(segments)} segment(s) with '{engine.name}'...")
+            job_metrics = EngineMetrics()
+            try:
+                path = _render_with_engine(engine, segments, output_path, cache, job_metrics)
+            except Exception as e:
+                print(f"Engine '{engine.name}' could not render the script: {e}")
+                path = None
+            if usage is not None:
+                usage[engine.name] = job_metrics.summary()
+            if path:
+                # Parts kept for resuming earlier, failed engines are obsolete now
+                for other in router.engines:
+                    shutil.rmtree(f"{output_path}.{other.name}.parts", ignore_errors=True)
+                summary = job_metrics.summary() # This job only; cached segments aren't synthesized
+                rtf = f"{summary['rtf']:.2f}" if summary["rtf"] is not None else "n/a"
+                print(f"Audio written to {path} by '{engine.name}' "
+                      f"({summary['characters']} chars synthesized, {summary['audio_seconds']:.1f}s audio, RTF {rtf}).")
+                return path
+            print("Falling back to the next engine...")
+    finally:
+        print_cache_stats(cache)
+        if cache:
+            cache.close()
+    # Don't leave a truncated file from the last failed engine looking like a result (incl. the WAV fallback)
+    for path in {output_path, writable_output_path(output_path)}:
+        if os.path.exists(path):
+            os.remove(path)
+    print("Error: every TTS engine failed for this script.")
+    return None
@@ -0,0 +1,115 @@
+# tts_segmenter.py
+# Splits long dialogue turns into sentence/clause-sized TTS segments with pause hints.
+import re
+from typing import Any, Dict, List
+
+# Average speaking rate used to estimate durations before synthesis
+WORDS_PER_SECOND = 2.6
+
+# Pauses inserted after each kind of boundary when the segments are stitched back together
+PAUSE_AFTER_SENTENCE_MS = 250
+PAUSE_AFTER_CLAUSE_MS = 120
+PAUSE_AFTER_TURN_MS = 400
+
+# Tokens ending in a period that do not end a sentence
+ABBREVIATIONS = {"dr", "mr", "mrs", "ms", "st", "jr", "sr", "vs", "etc", "e.g", "i.e", "a.m", "p.m", "no", "approx"}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+|\s+(?=—|–|-{2})")
+
+
+def estimate_seconds(text: str) -> float:
+    """Rough spoken duration of `text`; digits are read one by one so they count extra."""
+    words = len(text.split())
+    digits = sum(ch.isdigit() for ch in text)
+    return (words + digits * 0.5) / WORDS_PER_SECOND
+
+
+def split_sentences(text: str) -> List[str]:
+    """Splits at sentence-ending punctuation, keeping abbreviations like "Dr." intact."""
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        candidate = text[start:match.start()].strip()
+        last_word = candidate.rsplit(" ", 1)[-1].rstrip(".").lower()
+        if last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()):
+            continue # "Dr. Davis", "M. Smith"
+        if candidate:
+            sentences.append(candidate)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def _split_long(text: str, max_seconds: float) -> List[tuple]:
+    """Splits one over-long sentence at clause boundaries, then at word boundaries."""
+    pieces = []
+    for clause in (c.strip() for c in _CLAUSE_END.split(text)):
+        if not clause:
+            continue
+        if estimate_seconds(clause) <= max_seconds:
+            pieces.append((clause, PAUSE_AFTER_CLAUSE_MS))
+            continue
+        words, current = clause.split(), []
+        for word in words:
+            if current and estimate_seconds(" ".join(current + [word])) > max_seconds:
+                pieces.append((" ".join(current), 0))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append((" ".join(current), PAUSE_AFTER_CLAUSE_MS))
+    return pieces
+
+
+def split_turn(text: str, max_seconds: float = 8.0) -> List[Dict[str, Any]]:
+    """
+    Splits one speaker turn into segments no longer than `max_seconds` (estimated).
+
+    Consecutive short sentences are merged while they fit, so short turns stay
+    a single request and prosody across them is preserved.
+
+    Returns:
+        A list of dicts with 'text' and 'pause_after_ms' (the pause that
+        belongs after the segment if it is not the last one of the turn).
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if estimate_seconds(sentence) <= max_seconds:
+            pieces.append((sentence, PAUSE_AFTER_SENTENCE_MS))
+        else:
+            sub_pieces = _split_long(sentence, max_seconds)
+            sub_pieces[-1] = (sub_pieces[-1][0], PAUSE_AFTER_SENTENCE_MS)
+            pieces.extend(sub_pieces)
+
+    segments = []
+    for piece, pause in pieces:
+        if segments and estimate_seconds(segments[-1]["text"] + " " + piece) <= max_seconds:
+            segments[-1]["text"] += " " + piece
+            segments[-1]["pause_after_ms"] = pause
+        else:
+            segments.append({"text": piece, "pause_after_ms": pause})
+    return segments
+
+
+def segment_dialogue(turns: List[Dict[str, Any]], max_seconds: float = 8.0) -> List[Dict[str, Any]]:
+    """
+    Splits parsed turns (see parse_dialogue_lines) into TTS segments.
+
+    Returns:
+        A list of dicts with 'index' (sequential segment number, used for
+        ordering), 'line' (the turn's line index), 'speaker', 'text' and
+        'pause_after_ms' (a longer pause at the end of each turn).
+    """
+    segments = []
+    for turn in turns:
+        pieces = split_turn(turn["text"], max_seconds)
+        for k, piece in enumerate(pieces):
+            segments.append({
+                "index": len(segments),
+                "line": turn["index"],
+                "speaker": turn["speaker"],
+                "text": piece["text"],
+                "pause_after_ms": PAUSE_AFTER_TURN_MS if k == len(pieces) - 1 else piece["pause_after_ms"],
+            })
+    return segments
@@ -0,0 +1,195 @@
+# tts_synthesis.py
+# Concurrent, order-preserving synthesis of script lines with per-line retries.
+import contextvars
+import hashlib
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+
+from code.tracing import count
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _status_code(error: Exception) -> int | None:
+    """Best-effort extraction of an HTTP status code from an SDK exception."""
+    for attr in ("status_code", "status", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after_seconds(error: Exception) -> float | None:
+    """Reads a Retry-After header from the exception, if the SDK exposes one."""
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for rate limits (429), server errors and connection problems."""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def segment_path(parts_dir: str, line: Dict[str, Any], extension: str,
+                 identity: Dict[str, str] | None = None) -> str:
+    """
+    Path of the stored audio segment for a script line or segment.
+
+    Parts are named after what was spoken (speaker + text) and how it was
+    rendered (`identity`: the engine's voice ID and model/output format, as
+    in the TTS cache key), not their position. A resume therefore never
+    stitches in audio from an edited script, a different segmentation
+    (TTS_SEGMENT_MAX_SECONDS), another voice or model, or an older run.
+    """
+    rendering = "\n".join(f"{key}={value}" for key, value in sorted((identity or {}).items()))
+    digest = hashlib.sha256(f"{line['speaker']}\n{line['text']}\n{rendering}".encode("utf-8")).hexdigest()[:24]
+    return os.path.join(parts_dir, f"{digest}.{extension}")
+
+
+def _synthesize_with_retries(line: Dict[str, Any], synthesize: Callable[[Dict[str, Any]], bytes],
+                             max_retries: int, base_delay: float) -> bytes:
+    """Calls `synthesize` for one line, backing off on retryable errors."""
+    attempt = 0
+    while True:
+        try:
+            return synthesize(line)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                # Exponential backoff with jitter so workers don't retry in lockstep
+                delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            attempt += 1
+            count("retries_total", stage="tts")
+            print(f"   Line {line.get('line', line['index'])+1}: retryable error ({_status_code(e) or type(e).__name__}), "
+                  f"retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def synthesize_lines(lines: List[Dict[str, Any]], synthesize: Callable[[Dict[str, Any]], bytes],
+                     max_workers: int = 4, max_retries: int = 5, base_delay: float = 1.0,
+                     parts_dir: str | None = None, extension: str = "mp3",
+                     on_segment: Callable[[int, bytes], None] | None = None,
+                     identity_for: Callable[[Dict[str, Any]], Dict[str, str]] | None = None) -> Dict[str, Any]:
+    """
+    Synthesizes script lines with a bounded worker pool.
+
+    Each finished segment is written to `parts_dir` (if given) as soon as it
+    completes, so an interrupted or partially failed run can be resumed: lines
+    whose segment (same speaker, text and voice/model, see segment_path)
+    already exists are not sent again.
+
+    Lines are submitted in order and at most a few pool-widths ahead of the
+    oldest unfinished line, so a consumer that writes segments in order never
+    has to buffer more than that window.
+
+    Args:
+        lines: Parsed turns from `parse_dialogue_lines` or segments from
+            `segment_dialogue` ('index', 'speaker', 'text'; optional 'line').
+        synthesize: Callable returning the audio bytes for one line. Swap in a
+            fake here to test without the real TTS endpoint.
+        max_workers: Maximum number of concurrent requests.
+        max_retries: Retries per line for 429 / 5xx / connection errors.
+        base_delay: Initial backoff in seconds (doubled after every retry).
+        parts_dir: Directory for per-line segments (enables resume).
+        extension: File extension used for stored segments.
+        on_segment: Optional callback `(index, audio)` invoked from the calling
+            thread for every finished line (in completion order). When given,
+            segments are not kept in memory.
+        identity_for: Maps a line to the voice ID / model / output format it
+            is rendered with (e.g. `engine.cache_identity(speaker)`), so parts
+            from another voice or model are not resumed.
+
+    Returns:
+        A dict with 'segments' (list of audio bytes ordered by line index,
+        None for lines that failed or when `on_segment` is used),
+        'failed' (list of (index, error message)), 'completed' (number of
+        lines synthesized or resumed) and 'resumed' (number of lines loaded
+        from `parts_dir`).
+    """
+    ordered_indexes = [line["index"] for line in lines]
+    results: Dict[int, bytes] = {}
+    done = set()
+    failed = []
+    resumed = 0
+
+    def _deliver(index, audio):
+        done.add(index)
+        if on_segment is not None:
+            on_segment(index, audio)
+        else:
+            results[index] = audio
+
+    if parts_dir:
+        os.makedirs(parts_dir, exist_ok=True)
+        for line in lines:
+            path = segment_path(parts_dir, line, extension, identity_for(line) if identity_for else None)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    _deliver(line["index"], f.read())
+                resumed += 1
+        if resumed:
+            print(f"Resuming: {resumed}/{len(lines)} line(s) already synthesized in '{parts_dir}'.")
+
+    pending = [line for line in lines if line["index"] not in done]
+
+    def _work(line):
+        audio = _synthesize_with_retries(line, synthesize, max_retries, base_delay)
+        if parts_dir:
+            # Write-then-rename so a crash never leaves a truncated segment behind
+            path = segment_path(parts_dir, line, extension, identity_for(line) if identity_for else None)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        return audio
+
+    workers = max(1, max_workers)
+    window = workers * 4
+    finished = [False] * len(pending) # By position in `pending`
+    oldest = 0 # Position of the oldest unfinished line
+    next_pos = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        while next_pos < len(pending) or in_flight:
+            while next_pos < len(pending) and len(in_flight) < workers and next_pos < oldest + window:
+                # Each line runs in a copy of the caller's context, so its trace spans keep the call ID
+                in_flight[executor.submit(contextvars.copy_context().run, _work, pending[next_pos])] = next_pos
+                next_pos += 1
+
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                pos = in_flight.pop(future)
+                line = pending[pos]
+                finished[pos] = True
+                try:
+                    _deliver(line["index"], future.result())
+                    print(f" - Line {line.get('line', line['index'])+1} ({line['speaker']}) done: '{line['text'][:50]}...'")
+                except Exception as e:
+                    failed.append((line["index"], str(e)))
+                    print(f"Error: Giving up on line {line.get('line', line['index'])+1} ({line['speaker']}): {e}")
+            while oldest < len(pending) and finished[oldest]:
+                oldest += 1
+
+    failed.sort()
+    return {
+        "segments": [results.get(index) for index in ordered_indexes],
+        "failed": failed,
+        "completed": len(done),
+        "resumed": resumed,
+    }
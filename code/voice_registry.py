@@ -0,0 +1,176 @@
+# voice_registry.py
+# Persistent registry of voice-cloning references: preprocessed audio, encoded prompt tokens, transcript.
+#
+# Layout (one directory per voice):
+#   <registry>/<name>/manifest.json   name, content hash, transcript, model, source paths
+#   <registry>/<name>/reference.wav   mono reference resampled to Dia's 44.1 kHz
+#   <registry>/<name>/codes.pt        DAC prompt tokens produced by Dia.load_audio
+#
+# Usage:
+#   python -m code.voice_registry register agent_ben voice_samples/sample_output_for_cloning.mp3 \
+#       voice_samples/sample_transcript_for_cloning.txt
+#   python -m code.voice_registry list
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List
+
+DEFAULT_REGISTRY_DIR = "voice_registry"
+REFERENCE_SAMPLE_RATE = 44100 # Dia's native rate
+_VALID_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def content_hash(audio_path: str, transcript: str) -> str:
+    """Hash of the reference audio bytes and its transcript; changes when either changes."""
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(b"\x00" + transcript.strip().encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _voice_dir(registry_dir: str, name: str) -> str:
+    if not _VALID_NAME.match(name):
+        raise ValueError(f"Invalid voice name '{name}': use letters, digits, '.', '_' or '-'.")
+    return os.path.join(registry_dir, name)
+
+
+def read_manifest(name: str, registry_dir: str = DEFAULT_REGISTRY_DIR) -> Dict[str, Any] | None:
+    path = os.path.join(_voice_dir(registry_dir, name), "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_voices(registry_dir: str = DEFAULT_REGISTRY_DIR) -> List[Dict[str, Any]]:
+    """Manifests of every registered voice, sorted by name."""
+    if not os.path.isdir(registry_dir):
+        return []
+    voices = []
+    for name in sorted(os.listdir(registry_dir)):
+        if _VALID_NAME.match(name):
+            manifest = read_manifest(name, registry_dir)
+            if manifest:
+                voices.append(manifest)
+    return voices
+
+
+def _preprocess_reference(audio_path: str, output_path: str) -> float:
+    """Decodes the reference, downmixes to mono, resamples to 44.1 kHz and saves it as WAV."""
+    import torchaudio
+    audio, sample_rate = torchaudio.load(audio_path)
+    if audio.shape[0] > 1:
+        audio = audio.mean(dim=0, keepdim=True)
+    if sample_rate != REFERENCE_SAMPLE_RATE:
+        audio = torchaudio.functional.resample(audio, sample_rate, REFERENCE_SAMPLE_RATE)
+    torchaudio.save(output_path, audio, REFERENCE_SAMPLE_RATE)
+    return audio.shape[1] / REFERENCE_SAMPLE_RATE
+
+
+def register_voice(model, name: str, audio_path: str, transcript: str, model_id: str,
+                   registry_dir: str = DEFAULT_REGISTRY_DIR, force: bool = False) -> Dict[str, Any]:
+    """
+    Preprocesses and encodes a reference voice once and stores it under `name`.
+
+    Registration is skipped when the stored voice already has the same content
+    hash and model, so it is cheap to call on every run.
+
+    Args:
+        model: A loaded Dia model (used to encode the prompt tokens).
+        name: Voice name jobs will refer to (e.g. "agent_ben").
+        audio_path: Reference recording.
+        transcript: "[S1] ... [S2] ..." transcript of the recording.
+        model_id: Model the tokens are encoded for (tokens are model-specific).
+        registry_dir: Registry directory.
+        force: Re-encode even if the stored voice is up to date.
+
+    Returns:
+        The voice manifest.
+    """
+    import torch
+    voice_hash = content_hash(audio_path, transcript)
+    existing = read_manifest(name, registry_dir)
+    if existing and not force and existing["content_hash"] == voice_hash and existing["model_id"] == model_id:
+        print(f"Voice '{name}' is up to date in the registry.")
+        return existing
+
+    voice_dir = _voice_dir(registry_dir, name)
+    os.makedirs(voice_dir, exist_ok=True)
+    start = time.perf_counter()
+    reference_path = os.path.join(voice_dir, "reference.wav")
+    duration = _preprocess_reference(audio_path, reference_path)
+    with torch.inference_mode():
+        codes = model.load_audio(reference_path)
+    torch.save(codes.cpu(), os.path.join(voice_dir, "codes.pt"))
+
+    manifest = {
+        "name": name,
+        "content_hash": voice_hash,
+        "model_id": model_id,
+        "transcript": transcript.strip(),
+        "source_audio": os.path.abspath(audio_path),
+        "reference_seconds": duration,
+        "registered_at": time.time(),
+        "preprocess_seconds": time.perf_counter() - start,
+    }
+    with open(os.path.join(voice_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Registered voice '{name}' ({duration:.1f}s reference) in {manifest['preprocess_seconds']:.1f}s.")
+    return manifest
+
+
+def load_voice(name: str, registry_dir: str = DEFAULT_REGISTRY_DIR, device=None) -> Dict[str, Any]:
+    """
+    Loads a registered voice as a voice prompt for code.dia_clone (no audio decoding or encoding).
+
+    Raises:
+        KeyError: If the voice is not registered.
+    """
+    import torch
+    manifest = read_manifest(name, registry_dir)
+    if manifest is None:
+        raise KeyError(f"Voice '{name}' is not registered in '{registry_dir}'.")
+    voice_dir = _voice_dir(registry_dir, name)
+    codes = torch.load(os.path.join(voice_dir, "codes.pt"), map_location=device or "cpu")
+    return {
+        "codes": codes,
+        "transcript": manifest["transcript"] + "\n",
+        "audio_path": os.path.join(voice_dir, "reference.wav"),
+        "encode_seconds": 0.0,
+        "name": name,
+        "content_hash": manifest["content_hash"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage voice-cloning references.")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    reg = sub.add_parser("register", help="Preprocess and encode a reference voice.")
+    reg.add_argument("name")
+    reg.add_argument("audio")
+    reg.add_argument("transcript", help="Path of the reference transcript file.")
+    reg.add_argument("--force", action="store_true")
+    sub.add_parser("list", help="List registered voices.")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        from code.openSourceTTS import load_dia_model, DIA_MODEL_ID
+        with open(args.transcript, "r", encoding="utf-8") as f:
+            transcript = f.read()
+        register_voice(load_dia_model(), args.name, args.audio, transcript, DIA_MODEL_ID, args.registry, args.force)
+    else:
+        voices = list_voices(args.registry)
+        if not voices:
+            print(f"No voices registered in '{args.registry}'.")
+        for v in voices:
+            print(f"- {v['name']}: {v['reference_seconds']:.1f}s, hash {v['content_hash'][:12]}, model {v['model_id']}")
+
+
+if __name__ == "__main__":
+    main()